@@ -21,6 +21,7 @@ import pandas
 from math import sqrt
 import numpy
 import rpy2.robjects as robj
+from alinea.adel.kinetics import concat_tables
 r = robj.r
 
 from rpy2.robjects import numpy2ri
@@ -310,6 +311,49 @@ def setCanopy(RcanT,nplants = 1,randomize = True, seed = None):
     can = RsetCanopy(RcanT,nplants,rrand,rseed)
     return can
 
+def _rvect_asfloat(rvect):
+    """ convert a r_vector into a numpy array, with NA numeric values converted to nan """
+    if r['is.numeric'](rvect)[0] or r['is.logical'](rvect)[0]:
+        return numpy.array(r['as.numeric'](rvect), dtype=float)
+    return numpy.array(r['as.character'](rvect))
+
+def _rdf_asdict(df):
+    """ convert an RDataframe or a Rlist of vectors to a dict of numpy arrays (NA -> nan) """
+    if r['is.null'](df)[0]:
+        return None
+    return dict([(k, _rvect_asfloat(df.rx2(str(k)))) for k in r.names(df)])
+
+def plant_parameters(setAdelPars):
+    """ convert plant parameters generated by setAdel into python structures,
+    as expected by alinea.adel.kinetics functions
+    """
+    plants = []
+    for plant in setAdelPars:
+        names = list(r.names(plant))
+        phytoT = plant.rx2('phytoT')
+        columns = list(r.dimnames(phytoT)[1])
+        values = numpy.array(r['as.numeric'](phytoT), dtype=float)
+        values = values.reshape(tuple(r.dim(phytoT)), order='F')
+        pedT = plant.rx2('pedT')
+        p = {'refp': str(plant.rx2('refp')[0]),
+             'axeT': _rdf_asdict(plant.rx2('axeT')),
+             'phytoT': dict([(k, values[:, i, :]) for i, k in enumerate(columns)]),
+             'pheno': [_rdf_asdict(df) for df in plant.rx2('pheno')],
+             'pedT': [],
+             'ssisenT': None,
+             'ssipars': None}
+        if 'ssisenT' in names:
+            p['ssisenT'] = _rdf_asdict(plant.rx2('ssisenT'))
+        if 'ssipars' in names and not r['is.null'](plant.rx2('ssipars'))[0]:
+            p['ssipars'] = dict([(k, v[0]) for k, v in _rdf_asdict(plant.rx2('ssipars')).items()])
+        for i in range(len(pedT)):
+            ped = _rdf_asdict(pedT[i])
+            if ped is not None:
+                ped = dict([(k, v[0]) for k, v in ped.items()])
+            p['pedT'].append(ped)
+        plants.append(p)
+    return plants
+
 def RunAdel(datesTT,plant_parameters,adelpars={'senescence_leaf_shrink' : 0.5,'leafDuration' : 2, 'fracLeaf' : 0.2, 'stemDuration' : 2. / 1.2, 'dHS_col' : 0.2, 'dHS_en':0, 'epsillon' : 1e-6, 'HSstart_inclination_tiller': 1, 'rate_inclination_tiller': 30, 'drop_empty':True}):
     """ Run Adel model for each date in datesTT according to parameter list """
     
@@ -327,6 +371,17 @@ def RunAdel(datesTT,plant_parameters,adelpars={'senescence_leaf_shrink' : 0.5,'l
     return d
 
 
+def RunAdelTable(datesTT,plant_parameters,adelpars={'senescence_leaf_shrink' : 0.5,'leafDuration' : 2, 'fracLeaf' : 0.2, 'stemDuration' : 2. / 1.2, 'dHS_col' : 0.2, 'dHS_en':0, 'epsillon' : 1e-6, 'HSstart_inclination_tiller': 1, 'rate_inclination_tiller': 30, 'drop_empty':True}):
+    """ Run Adel model for all dates in datesTT within one R call.
+    Returns a single long-format canopy table (dict of typed numpy arrays, TT column giving the date) or None for empty canopies"""
+    if (type(datesTT) is not list):
+        datesTT = [datesTT]
+    x = robj.FloatVector(datesTT)
+    ap = robj.r['list'](**adelpars)
+    res = RrunAdel(x,plant_parameters,ap)
+    return concat_tables([dataframeAsdict(df) for df in res])
+
+
 def _devCsv(axeTfn,dimTfn,phenTfn,earTfn=None,ssi2senTfn=None):
     """ Import development parameters for adel from csv files and/or pandas dataframes """
     args = [axeTfn, dimTfn, phenTfn]
@@ -11,15 +11,19 @@ try:
 except:
     import pickle
 from openalea.plantgl.all import Viewer, Scene
+from openalea.mtg.algo import union
 
 from alinea.adel.colormap import colormap
 from alinea.adel.geometric_elements import Leaves
 from alinea.adel.Stand import AgronomicStand
-from alinea.adel.mtg_interpreter import plot3d, transform_geom, mtg_interpreter
+from alinea.adel.mtg_interpreter import plot3d, transform_geom, \
+    mtg_interpreter, triangle_arrays
 from alinea.adel.postprocessing import axis_statistics, plot_statistics, \
-    midrib_statistics
+    midrib_array_statistics, StatisticsAccumulator
 from alinea.adel.newmtg import exposed_areas, exposed_areas2canS, duplicate, \
-    mtg_factory
+    mtg_factory, mtg_grow
+from alinea.adel.instancing import PlantInstances
+from alinea.adel.snapshot import save_snapshot, load_snapshot
 
 
 def flat_list(nested_list):
@@ -57,7 +61,7 @@ class Adel(object):
                  aspect='smart', split=False,
                  face_up=False, classic=False, scene_unit='cm',
                  age=None, seed=None, leaf_db=None, positions=None,
-                 convUnit=None):
+                 convUnit=None, processes=None):
         """
 
         Args:
@@ -82,6 +86,8 @@ class Adel(object):
             leaf_db: deprecated, use leaves
             positions: deprecated, use stand
             convUnit: deprecated, use scene_unit
+            processes: (int) if greater than 1, the number of processes used
+             to compute plant geometries in parallel
         """
 
         if leaf_db is not None:
@@ -128,6 +134,7 @@ class Adel(object):
         self.split = split
         self.face_up = face_up
         self.classic = classic
+        self.processes = processes
         self.seed = seed
         self.meta = {}
 
@@ -222,15 +229,46 @@ class Adel(object):
         return g
 
 
+    def instanced(self, gquot, grem=None):
+        """Construct a canopy of instances of the plants of gquot and grem
+
+        Unlike duplicated, plants of gquot and grem are stored once, and each
+        plant of the stand only holds its reference plant, position and azimuth
+        """
+        if self.duplicate is None:
+            raise ValueError('Duplication not defined for this stand')
+        g = gquot
+        if grem is not None:
+            g = union(grem, gquot)
+        plants = list(g.vertices(1))
+        nrem = 0 if grem is None else grem.nb_vertices(scale=1)
+        quot = plants[nrem:]
+        # same plant order as in duplicated
+        references = [plants[i] if i < nrem else quot[(i - nrem) % len(quot)]
+                      for i in range(self.nplants)]
+        return PlantInstances(g, references, self.positions,
+                              self.plant_azimuths)
+
     def build_mtg(self, parameters, stand, **kwds):
         g = mtg_factory(parameters, stand=stand, leaf_sectors=self.nsect,
                         leaves=self.leaves, split=self.split, **kwds)
         g = mtg_interpreter(g, self.leaves, classic=self.classic,
-                            face_up=self.face_up)
+                            face_up=self.face_up, processes=self.processes)
+        return g
+
+    def grow_mtg(self, g, parameters, stand, **kwds):
+        """ update g in place with a new canopy table and recompute geometry
+        """
+        g = mtg_grow(g, parameters, stand=stand, leaf_sectors=self.nsect,
+                     leaves=self.leaves, split=self.split, **kwds)
+        g = mtg_interpreter(g, self.leaves, classic=self.classic,
+                            face_up=self.face_up, processes=self.processes)
         return g
 
 
     def meta_informations(self, g):
+        if isinstance(g, PlantInstances):
+            g = g.g
         if 'meta' in g.property_names():
             return list(g.property('meta').values())[0]
         else:
@@ -250,6 +288,12 @@ class Adel(object):
         Viewer.display(s)
         return s
 
+    @staticmethod
+    def triangles(g, dtype=numpy.float32):
+        """ all triangles of the canopy as flat numpy arrays (see
+        mtg_interpreter.triangle_arrays), for coupling with light models """
+        return triangle_arrays(g, dtype=dtype)
+
     @staticmethod
     def scene(g, property=None):
         if property:
@@ -266,7 +310,10 @@ class Adel(object):
         return s
 
     def get_exposed_areas(self, g, convert=False, TT=None):
-        areas = exposed_areas(g)
+        if isinstance(g, PlantInstances):
+            areas = g.exposed_areas()
+        else:
+            areas = exposed_areas(g)
         if convert:
             areas = exposed_areas2canS(areas)
         if TT is None:
@@ -291,8 +338,27 @@ class Adel(object):
         pstat = plot_statistics(axstat, meta['nplants'], meta['domain_area'])
         return pstat
 
+    def statistics_accumulator(self, g, **kwds):
+        """ return a StatisticsAccumulator set up with canopy meta informations
+
+        Feed it with accumulator.add(adel.get_exposed_areas(g, convert=True))
+        at each step of a simulation
+        """
+        meta = self.meta_informations(g)
+        return StatisticsAccumulator(meta['domain_area'], meta['nplants'],
+                                     meta['convUnit'], **kwds)
+
     def save(self, g, index=0, dir='./adel_saved', basename=None,
-             check_meta=True):
+             check_meta=True, format='pickle'):
+        """ save g (with its geometry) to disk.
+
+        format is either 'pickle' (pickled mtg + BGEOM scene, return the two
+        file names) or 'snapshot' (see alinea.adel.snapshot, return the
+        snapshot directory name)
+        """
+        if isinstance(g, PlantInstances):
+            raise TypeError('instanced canopies cannot be saved, use a '
+                            'duplicated canopy instead')
         if check_meta:
             if 'meta' not in g.property_names():
                 root = g.node(0)
@@ -304,6 +370,10 @@ class Adel(object):
             basename_adel = dir + '/adel%04d' % (index)
         else:
             basename_adel = basename_geom = str(basename)
+        if format == 'snapshot':
+            return save_snapshot(g, basename_adel + '.snapshot')
+        elif format != 'pickle':
+            raise ValueError('unknown format: ' + str(format))
         s = Adel.scene(g)
         geom = {sh.id: sh.geometry for sh in s}
         g.remove_property('geometry')
@@ -318,7 +388,14 @@ class Adel(object):
         return fgeom, fg
 
     @staticmethod
-    def load(index=0, dir='./adel_saved', basename=None, load_geom=True):
+    def load(index=0, dir='./adel_saved', basename=None, load_geom=True,
+             lazy=False):
+        """ load a canopy saved with Adel.save.
+
+        With lazy=True, geometries of a snapshot are read from disk
+        (memory-mapped) on first access to each element, rather than all
+        up front. Canopies saved with format='pickle' are always fully loaded.
+        """
         if basename is None:
             if not os.path.exists(dir):
                 os.mkdir(dir)
@@ -326,6 +403,9 @@ class Adel(object):
             basename_adel = dir + '/adel%04d' % (index)
         else:
             basename_adel = basename_geom = basename
+        fsnap = basename_adel + '.snapshot'
+        if os.path.isdir(fsnap):
+            return load_snapshot(fsnap, load_geom=load_geom, lazy=lazy)
         fgeom = basename_geom + '.bgeom'
         fg = basename_adel + '.pckl'
         if not os.path.exists(fgeom) or not os.path.exists(fg):
@@ -345,6 +425,9 @@ class Adel(object):
                 root.meta.update(meta)
 
         if load_geom:
+            if lazy:
+                warnings.warn('lazy loading is only available for snapshots, '
+                              'geometry is fully loaded')
             s = Scene()
             s.read(fgeom, 'BGEOM')
             geom = {sh.id: sh.geometry for sh in s}
@@ -353,44 +436,68 @@ class Adel(object):
 
         return g
 
-    def get_midribs(self, g, resample=False):
+    def midrib_arrays(self, g, resample=False):
+        """ visible midribs of all blades as ragged arrays.
+
+        Returns a dict with one value per midrib for 'vid', 'ntop', 'metamer',
+        'axe', 'plant', 'species' and 'hins' (height of insertion), and the
+        concatenated coordinates 'x', 'y' of midribs, those of midrib i being
+        x[offsets[i]:offsets[i + 1]]
+        """
         visible_length = g.property('visible_length')
+        anchor = g.property('anchor_point')
+        ntop = g.property('ntop')
+        p = g.property('species')
         blades = (vid for vid in g.vertices(scale=g.max_scale() - 1) if
                 g.label(vid).startswith('blade'))
-        vids = (vid for vid in blades if visible_length[vid] > 0)
-        metamer = {vid: g.complex(vid) for vid in vids}
-        axe = {vid: g.complex(metamer[vid]) for vid in metamer}
-        plant = {vid: g.complex(axe[vid]) for vid in axe}
-        p = g.property('species')
-        species = {vid: p.get(plant[vid], 0) for vid in plant}
+        res = {k: [] for k in ('vid', 'ntop', 'metamer', 'axe', 'plant',
+                               'species', 'hins', 'x', 'y')}
+        npts = []
+        for vid in blades:
+            if not visible_length[vid] > 0:
+                continue
+            anchors = [anchor[cid] for cid in g.components(vid) if cid in anchor]
+            # midribs without geometry (anchor point) are skipped
+            if len(anchors) == 0:
+                continue
+            metamer = g.complex(vid)
+            axe = g.complex(metamer)
+            plant = g.complex(axe)
+            species = p.get(plant, 0)
+            x, y, dy = self.leaves[species].midrib(g.node(vid),
+                                                   resample=resample)
+            if x is None:
+                continue
+            res['vid'].append(vid)
+            res['ntop'].append(ntop[vid])
+            res['metamer'].append(int(g.label(metamer).split('metamer')[1]))
+            res['axe'].append(g.label(axe))
+            res['plant'].append(int(g.label(plant).split('plant')[1]))
+            res['species'].append(species)
+            res['hins'].append(anchors[0][2] + dy)
+            res['x'].append(numpy.asarray(x, dtype=float))
+            res['y'].append(numpy.asarray(y, dtype=float))
+            npts.append(len(x))
+        for k in ('x', 'y'):
+            res[k] = numpy.concatenate(res[k]) if npts else numpy.zeros(0)
+        for k in ('vid', 'ntop', 'metamer', 'axe', 'plant', 'species', 'hins'):
+            res[k] = numpy.array(res[k])
+        res['offsets'] = numpy.zeros(len(npts) + 1, dtype=int)
+        res['offsets'][1:] = numpy.cumsum(npts)
+        return res
 
-        midribs = {vid: self.leaves[species[vid]].midrib(g.node(vid), resample=resample) for
-                   vid in species}
-        #
-        anchor = g.property('anchor_point')
-        midribs_anchor = {
-            vid: [anchor[cid] for cid in g.components(vid) if cid in anchor] for
-            vid
-            in midribs}
-        hins = {k: v[0][2] + midribs[k][2] for k, v in
-                midribs_anchor.items() if len(v) > 0}
-
-        ntop = g.property('ntop')
-        res = [pandas.DataFrame({'vid': vid,
-                                 'ntop': ntop[vid],
-                                 'metamer': int(
-                                     g.label(metamer[vid]).split('metamer')[1]),
-                                 'axe': g.label(axe[vid]),
-                                 'plant': int(
-                                     g.label(plant[vid]).split('plant')[1]),
-                                 'species': species[vid],
-                                 'x': midribs[vid][0],
-                                 'y': midribs[vid][1],
-                                 'hins': hins[vid]}) for vid in
-               hins]  # hins keys are for midribs keys wich also have a geometry (anchor point
-
-        return pandas.concat(res)
+    def get_midribs(self, g, resample=False):
+        midribs = self.midrib_arrays(g, resample=resample)
+        npts = numpy.diff(midribs['offsets'])
+        columns = {k: numpy.repeat(midribs[k], npts) for k in
+                   ('vid', 'ntop', 'metamer', 'axe', 'plant', 'species')}
+        columns['x'] = midribs['x']
+        columns['y'] = midribs['y']
+        columns['hins'] = numpy.repeat(midribs['hins'], npts)
+        # index restarts at 0 for each midrib
+        index = numpy.arange(len(midribs['x'])) - numpy.repeat(
+            midribs['offsets'][:-1], npts)
+        return pandas.DataFrame(columns, index=index)
 
     def midrib_statistics(self, g):
-        data = self.get_midribs(g)
-        return midrib_statistics(data)
+        return midrib_array_statistics(self.midrib_arrays(g))
@@ -4,10 +4,12 @@
 import os
 import numpy
 from alinea.adel.AdelR import setAdel, RunAdel, genGeoAxe, checkAxeDyn, getAxeT, \
-    getPhenT, getPhytoT, saveRData, readRData
+    getPhenT, getPhytoT, saveRData, readRData, plant_parameters, RunAdelTable
+import alinea.adel.kinetics as kinetics
 from alinea.adel.newmtg import move_properties
 import alinea.adel.data_samples as adel_data
 from alinea.adel.mtg_interpreter import plot3d
+from alinea.adel.instancing import PlantInstances
 
 
 from alinea.adel.adel import Adel
@@ -53,7 +55,10 @@ class AdelWheat(Adel):
                  age=None, seed=None,
                  leaf_db=None,
                  positions=None,
-                 convUnit=None):
+                 convUnit=None, engine='R', processes=None):
+
+        if engine not in ('R', 'numpy'):
+            raise ValueError('unknown engine for adel kinetics: ' + str(engine))
 
         if species is not None or isinstance(leaves, dict):
             raise ValueError('multi_species canopies not yet implemented')
@@ -82,7 +87,8 @@ class AdelWheat(Adel):
                                         age=age,
                                         seed=seed, leaf_db=leaf_db,
                                         positions=positions,
-                                        convUnit=convUnit)
+                                        convUnit=convUnit,
+                                        processes=processes)
 
 
         if run_adel_pars is None:
@@ -114,6 +120,14 @@ class AdelWheat(Adel):
             if self.nrem > 0:
                 self.pars_rem = setAdel(nplants=self.nrem, **pars)
 
+        # the numpy engine only needs a one-time conversion of R parameters
+        self.engine = engine
+        self.plants = {}
+        if engine == 'numpy':
+            for what in ('pars', 'pars_quot', 'pars_rem'):
+                if hasattr(self, what):
+                    self.plants[what] = plant_parameters(getattr(self, what))
+
         self.thermal_time = thermal_time_model
         self.run_adel_pars = run_adel_pars
         self.aborting_tiller_reduction = aborting_tiller_reduction
@@ -143,13 +157,39 @@ class AdelWheat(Adel):
                                dt=delay) if not i % delay  else TimeControlSet(
             dt=0) for i in range(steps))
 
-    def setup_canopy(self, age=10):
+    def run_adel(self, age, what='pars'):
+        """ canopy table of plants self.<what> ('pars', 'pars_quot' or
+        'pars_rem') at a given age, computed with the kinetics engine
+        """
+        if self.engine == 'numpy':
+            return kinetics.RunAdel(age, self.plants[what],
+                                    adelpars=self.run_adel_pars)
+        return RunAdel(age, getattr(self, what), adelpars=self.run_adel_pars)
+
+    def canopy_table(self, dates, what='pars'):
+        """ canopy tables of plants self.<what> at all dates, evaluated in one
+        kinetic pass. Returns a single long-format table (dict of typed arrays,
+        TT column giving the date of each row), or None for empty canopies
+        """
+        dates = list(dates)
+        if self.engine == 'numpy':
+            return kinetics.canopy_table(dates, self.plants[what],
+                                         adelpars=self.run_adel_pars)
+        return RunAdelTable(dates, getattr(self, what),
+                            adelpars=self.run_adel_pars)
+
+    def setup_canopy(self, age=10, instancing=False):
+        """ build the canopy at a given age. If instancing is True and the stand
+        uses duplication, a PlantInstances canopy is returned instead of a mtg.
+        Such a canopy gives geometries, scenes, exposed areas and statistics,
+        but it cannot be grown or saved
+        """
         if "stand" not in self.meta: 
             self.new_stand(age=age)
 
         if self.duplicate is None:
             self.canopy_age = age
-            canopy = RunAdel(age, self.pars, adelpars=self.run_adel_pars)
+            canopy = self.run_adel(age)
             stand = list(zip(self.positions, self.plant_azimuths))
             g = self.build_mtg(canopy, stand,
                                aborting_tiller_reduction=self.aborting_tiller_reduction)
@@ -157,15 +197,17 @@ class AdelWheat(Adel):
             # produce plants positionned at origin
             grem = None
             if self.nrem > 0:
-                canopy = RunAdel(age, self.pars_rem, adelpars=self.run_adel_pars)
+                canopy = self.run_adel(age, 'pars_rem')
                 grem = self.build_mtg(canopy, stand=None,
                                aborting_tiller_reduction=self.aborting_tiller_reduction)
 
             if self.nquot > 0:
-                canopy = RunAdel(age, self.pars_quot, adelpars=self.run_adel_pars)
+                canopy = self.run_adel(age, 'pars_quot')
                 gquot = self.build_mtg(canopy, stand=None,
                                aborting_tiller_reduction=self.aborting_tiller_reduction)
 
+            if instancing:
+                return self.instanced(gquot, grem)
             g = self.duplicated(gquot, grem)
 
         return g
@@ -218,6 +260,9 @@ class AdelWheat(Adel):
 
 
     def grow(self, g, time_control):
+        if isinstance(g, PlantInstances):
+            raise TypeError('instanced canopies cannot be grown, use a '
+                            'duplicated canopy instead')
 
         try:  # old interface
             if time_control.dt <= 0:
@@ -229,17 +274,20 @@ class AdelWheat(Adel):
             tt = self.thermal_time(data.index, data)
             dday = tt[-1]
 
-        # refg = self.setup_canopy(age = self.canopy_age)
-        self.canopy_age += dday
-        newg = self.setup_canopy(age=self.canopy_age)
-        # newg = mtg_update(newg, g, refg)
-        move_properties(g, newg)
-
-        return newg
+        return self.grow_dd(g, dday)
 
     def grow_dd(self, g, dday):
-        # refg = self.setup_canopy(age = self.canopy_age)
+        if isinstance(g, PlantInstances):
+            raise TypeError('instanced canopies cannot be grown, use a '
+                            'duplicated canopy instead')
         self.canopy_age += dday
+        if self.duplicate is None:
+            # update g in place rather than rebuilding it
+            canopy = self.run_adel(self.canopy_age)
+            stand = list(zip(self.positions, self.plant_azimuths))
+            return self.grow_mtg(g, canopy, stand,
+                                 aborting_tiller_reduction=self.aborting_tiller_reduction)
+        # refg = self.setup_canopy(age = self.canopy_age)
         newg = self.setup_canopy(age=self.canopy_age)
         # newg = mtg_update(newg, g, refg)
         move_properties(g, newg)
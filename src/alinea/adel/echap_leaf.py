@@ -86,11 +86,11 @@ def geoLeaf(nlim=4,dazt=60,dazb=10, Lindex_base = 1, Lindex_top = 2):
     return rcode.format(ntoplim=nlim, dazTop=dazt, dazBase=dazb, top_class=Lindex_top, base_class= Lindex_base)
 
 
-def echap_leaves(xy_model='Tremie_byleafclass', sr_model='Mercia', disc_level=7, top_leaves=4, dazt=60,dazb=10):
+def echap_leaves(xy_model='Tremie_byleafclass', sr_model='Mercia', disc_level=7, top_leaves=4, dazt=60,dazb=10, lazy_fit=False):
     gL = geoLeaf(nlim=top_leaves, dazt=dazt, dazb=dazb)
     trajs,bins = median_leaf_trajectories(xy_model)
     sr = sr_data(sr_model)
     sr['Lindex'] = sr['rankclass']
     srdb = {k:v.loc[:,['s','r']].to_dict('list') for k, v in sr.groupby('Lindex')}
-    return Leaves(trajs, srdb, geoLeaf=gL, dynamic_bins=bins, discretisation_level=disc_level)
+    return Leaves(trajs, srdb, geoLeaf=gL, dynamic_bins=bins, discretisation_level=disc_level, lazy_fit=lazy_fit)
 
@@ -1,11 +1,12 @@
 import os
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
 from scipy.interpolate import splprep, splev
 from scipy.integrate import simps, trapz
 
 
 import openalea.plantgl.all as pgl
-from .simplification import cost
+from .simplification import simplify_mask
 
 
 ##### DEBUG
@@ -294,28 +295,47 @@ def leaf_to_mesh_new(x, y, r, twist=True, nb_twist=1., nb_waves=8, **kwds):
     return points, indices
 
 
-def leaf_to_mesh(x, y, r, twist_start=0, twist_end=0, **kwds):
+def leaf_arrays(x, y, r, twist_start=0, twist_end=0):
+    """ points ((2n, 3) array) and triangle indices ((m, 3) array) of the mesh
+    of a leaf of n midrib points (x, y) and widths r """
+    x, y, r = (np.asarray(a, dtype=float) for a in (x, y, r))
     n = len(x)
     theta = np.linspace(np.radians(twist_start),np.radians(twist_end),n)
-    points = list(zip(x, -r/2. * abs(np.cos(theta)), y + abs(np.sin(theta)) * r / 2.))
-    points.extend(list(zip(x, r/2.* abs(np.cos(theta)), y - abs(np.sin(theta)) * r / 2.)))
-
-    ind = np.array(range(n-2)) if n > 2 else np.array([0])
-    indices = list(zip(ind, ind+n, ind+(n+1)))
-    indices.extend(list(zip(ind, ind+(n+1), ind+1)))
+    points = np.empty((2 * n, 3))
+    points[:n, 0] = x
+    points[:n, 1] = -r/2. * abs(np.cos(theta))
+    points[:n, 2] = y + abs(np.sin(theta)) * r / 2.
+    points[n:, 0] = x
+    points[n:, 1] = r/2.* abs(np.cos(theta))
+    points[n:, 2] = y - abs(np.sin(theta)) * r / 2.
+
+    ind = np.arange(n-2) if n > 2 else np.array([0])
+    indices = [np.column_stack((ind, ind+n, ind+(n+1))),
+               np.column_stack((ind, ind+(n+1), ind+1))]
 
     # add only one triangle at the end !!
     if n < 2:
         assert len(points) == 4
         if r[-1] < 0.001:
-            indices = indices[0:1]
+            indices = [indices[0][0:1]]
     elif r[-1] < 0.001:
-        indices.append((n-2, 2*n-2, 2*n-1))
+        indices.append([(n-2, 2*n-2, 2*n-1)])
     else:
-        indices.append((n-2, 2*n-2, 2*n-1))
-        indices.append((n-2, 2*n-1, n-1))
+        indices.append([(n-2, 2*n-2, 2*n-1), (n-2, 2*n-1, n-1)])
 
-    return points, indices
+    return points, np.concatenate(indices).astype(int)
+
+
+def triangle_areas(points, indices):
+    """ areas of the triangles (indices) of a mesh """
+    points = np.asarray(points, dtype=float)
+    A, B, C = (points[indices[:, i]] for i in range(3))
+    return np.linalg.norm(np.cross(B - A, C - A), axis=1) / 2.0
+
+
+def leaf_to_mesh(x, y, r, twist_start=0, twist_end=0, **kwds):
+    points, indices = leaf_arrays(x, y, r, twist_start, twist_end)
+    return list(map(tuple, points.tolist())), list(map(tuple, indices.tolist()))
 
 
 def _mesh(leaf, length_max, length, radius_max, antisens=True, functor=leaf_to_mesh, **kwds):
@@ -364,18 +384,16 @@ def leaf_element(leaf, length_max, length, s_base, s_top, radius_max):
     if length > length_max:
         length = length_max
 
-    x, y, s, r = leaf
+    # leaf arrays may be views on a shared shape database: never modify them in place
+    x, y, s, r = (np.asarray(a, dtype=float) for a in leaf)
     # just scale leaf case
     if length == length_max and s_base == 0 and s_top == 1:
-        x *= length_max
-        y *= length_max
-        s *= length_max
-        r *= radius_max
-        return x,y,s,r
+        return x * length_max, y * length_max, s * length_max, r * radius_max
 
     # 1. compute s_xy and s_r for length vs length_max
 
     # force the leaf width to zero at the top
+    r = r.copy()
     r[-1] = 0
 
 
@@ -441,15 +459,10 @@ def mesh4(leaf, length_max, length, s_base, s_top, radius_max,
         # Degenarated element.
         return [], []
 
-    pts, ind = leaf_to_mesh(xf, yf, rf, twist_start=twist * min(s_val), twist_end=twist * max(s_val))
-
-    def _surf(ind, pts):
-        from openalea.plantgl.all import norm, cross, Vector3
-        A, B, C = [Vector3(pts[i]) for i in ind]
-        return norm(cross(B - A, C - A)) / 2.0
-
-    ind = [id for id in ind if _surf(id, pts) > 1e-6]
-    return pts, ind
+    pts, ind = leaf_arrays(xf, yf, rf, twist_start=twist * min(s_val), twist_end=twist * max(s_val))
+    # filter degenerated triangles
+    ind = ind[triangle_areas(pts, ind) > 1e-6]
+    return list(map(tuple, pts.tolist())), list(map(tuple, ind.tolist()))
 
 
 def write_smf(filename, points, indices):
@@ -579,10 +592,9 @@ def simplify(leaf, nb_points, scale_radius=True):
     """
     xn, yn, sn, rn = leaf
 
-    points = [pgl.Vector3(*pt) for pt in zip(xn, rn, yn)]
-    pts = [_f for _f in cost(points, nb_points) if _f]
-    coords = ((pt.x, pt.y, pt.z) for pt in pts)
-    x, r, y = list(map(np.array, zip(*coords)))
+    points = np.column_stack((xn, rn, yn)).astype(float)
+    keep = simplify_mask(points, nb_points)
+    x, r, y = (np.array(c) for c in points[keep].T)
     s = curvilinear_abscisse(x, y)
     # keep smax similar to sn
     adj = max(sn) / max(s)
@@ -629,21 +641,48 @@ def _fit_element(el, nb_points):
     return leaf
 
 
-def fit_leaves(leaves, nb_points, dynamic=False):
+def fit_elements(elements, nb_points, processes=None):
+    """ fit a list of leaf shapes (None for shapes that cannot be fitted).
+
+    If processes > 1, elements are fitted in a pool of processes
+    """
+    if processes is not None and processes > 1 and len(elements) > 1:
+        chunksize = max(1, len(elements) // (4 * processes))
+        with ProcessPoolExecutor(processes) as pool:
+            return list(pool.map(_fit_element, elements,
+                                 [nb_points] * len(elements),
+                                 chunksize=chunksize))
+    return [_fit_element(el, nb_points) for el in elements]
+
+
+def fit_leaves(leaves, nb_points, dynamic=False, processes=None):
+    """ fit all leaf shapes of a leaf database (see _fit_element).
+
+    If processes > 1, elements are fitted in a pool of processes
+    """
     new_db = {}
     discarded = {}
     db = leaves
 
+    # elements to be fitted, in database order
+    elements = []
+    for key in db:
+        for el in db[key]:
+            if not dynamic:
+                elements.append(el)
+            else:
+                elements.extend(el.values())
+    fitted = iter(fit_elements(elements, nb_points, processes))
+
     for key in db:
         l = db[key]
         for i, el in enumerate(l):
             leaf = None
 
             if not dynamic:
-                leaf = _fit_element(el, nb_points)
+                leaf = next(fitted)
             else:
-                leaf = {age: _fit_element(v, nb_points) for age, v in
-                        el.items()}
+                leaf = {age: next(fitted) for age in el}
                 if any([x is None for x in list(leaf.values())]):
                     leaf = None
             if leaf is not None:
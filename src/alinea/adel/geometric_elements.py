@@ -5,7 +5,13 @@ New proposal for computing organ shapes
 import numpy
 import pandas
 import os
-from scipy.integrate import simps
+import hashlib
+import pickle
+import tempfile
+import warnings
+from multiprocessing import shared_memory
+from collections import OrderedDict, namedtuple
+from collections.abc import Mapping
 
 import openalea.plantgl.all as pgl
 from math import radians, pi, cos, sin
@@ -14,6 +20,13 @@ from functools import reduce
 
 datadir = os.path.dirname(__file__)
 
+# a directory for the (opt-in) on-disk cache of fitted leaf shapes, eg
+# Leaves(fit_cache_dir=FIT_CACHE_DIR)
+FIT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'alinea.adel',
+                             'fitted_leaves')
+# to be incremented when fitting algorithms change, to invalidate the cache
+FIT_CACHE_VERSION = 1
+
 
 def genGeoLeaf(nlim=4,dazt=60,dazb=10):
     """ generate geoLeaf function for Adel """
@@ -71,6 +84,58 @@ def srdb_from_csv(filename):
     return srdb
 
 
+def _digest(h, obj):
+    """ update hash h with a leaf database (nested dicts/lists of arrays) """
+    if isinstance(obj, dict):
+        h.update(b'{%d' % len(obj))
+        for k in sorted(obj, key=repr):
+            h.update(repr(k).encode())
+            _digest(h, obj[k])
+    elif isinstance(obj, (list, tuple)) and len(obj) > 0 and not numpy.isscalar(obj[0]):
+        h.update(b'[%d' % len(obj))
+        for o in obj:
+            _digest(h, o)
+    else:
+        a = numpy.asarray(obj, dtype=float)
+        h.update(b'a%d' % a.size)
+        h.update(a.tobytes())
+
+
+def fit_cache_key(leaves, nb_points, dynamic):
+    """ hash key of the fit of a leaf database """
+    h = hashlib.sha1(b'%d %d %d' % (FIT_CACHE_VERSION, nb_points, dynamic))
+    _digest(h, leaves)
+    return h.hexdigest()
+
+
+def _load_fitted(path):
+    """ fitted leaves stored in the cache, or None if missing, stale or corrupt """
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, 'rb') as f:
+            fitted = pickle.load(f)
+    except Exception:
+        return None
+    if not isinstance(fitted, dict):
+        return None
+    return fitted
+
+
+def _save_fitted(path, fitted):
+    """ save fitted leaves in the cache (atomically, cache errors are ignored) """
+    try:
+        cache_dir = os.path.dirname(path)
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+        fd, tmp = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(fitted, f)
+        os.replace(tmp, path)
+    except OSError as e:
+        warnings.warn('fitted leaves could not be cached: ' + str(e))
+
+
 def curvilinear_abscisse( x, y ):
     s = numpy.zeros(len(x))
     s[1:] = numpy.sqrt(numpy.diff(x)**2+numpy.diff(y)**2)
@@ -104,9 +169,161 @@ def incline_leaf(shape, inclin, relative_angle = True):
     return leaf
 
 
+class LeafShape(namedtuple('LeafShape', ('x', 'y', 's', 'r'))):
+    """ x, y, s, r samples of a fitted leaf shape (views on a LeafShapeStore)"""
+    __slots__ = ()
+
+
+class LeafShapeStore(object):
+    """ fitted leaf shapes packed in contiguous arrays.
+
+    samples is a read-only (4, n) array of concatenated x, y, s, r samples,
+    shape i spanning samples[:, offsets[i]:offsets[i + 1]]. keys[i] is the
+    (key, index, age class) of shape i (age class is None for static databases).
+
+    Samples can be moved to shared memory (see share): a shared store is then
+    pickled as the name of its memory block, and unpickled (e.g. in a worker
+    process) by attaching to the block, without copy.
+    """
+    __slots__ = ('samples', 'offsets', 'keys', '_index', '_shapes', '_owner', '_shm')
+
+    def __init__(self, samples, offsets, keys, shm=None, owner=False):
+        self.offsets = numpy.asarray(offsets)
+        self.keys = [tuple(k) for k in keys]
+        self._index = {k: i for i, k in enumerate(self.keys)}
+        self._set_samples(samples, shm, owner)
+
+    def _set_samples(self, samples, shm=None, owner=False):
+        samples.flags.writeable = False
+        self.samples = samples
+        self._shm = shm
+        self._owner = owner
+        bounds = self.offsets.tolist()
+        self._shapes = [LeafShape(*samples[:, bounds[i]:bounds[i + 1]]) for i in range(len(self.keys))]
+
+    @staticmethod
+    def from_leaves(leaves, dynamic=False):
+        """ store of a fitted leaf database ({key: [shapes]}, shapes being
+        {age class: shape} dicts if dynamic) """
+        keys, shapes = [], []
+        for k in sorted(leaves):
+            for i, leaf in enumerate(leaves[k]):
+                items = sorted(leaf.items()) if dynamic else [(None, leaf)]
+                for age, shape in items:
+                    if isinstance(shape, dict):
+                        shape = shape['x'], shape['y'], shape['s'], shape['r']
+                    keys.append((k, i, age))
+                    shapes.append(numpy.array(shape, dtype=float))
+        offsets = numpy.zeros(len(shapes) + 1, dtype=int)
+        offsets[1:] = numpy.cumsum([sh.shape[1] for sh in shapes])
+        samples = numpy.concatenate(shapes, axis=1) if shapes else numpy.zeros((4, 0))
+        return LeafShapeStore(samples, offsets, keys)
+
+    @property
+    def shared_memory_name(self):
+        """ name of the shared memory block holding samples (None if not shared)"""
+        return None if self._shm is None else self._shm.name
+
+    def share(self):
+        """ move samples to a new shared memory block and return its name.
+
+        The block is released by unshare (or at exit of the creating process)
+        """
+        if self._shm is None:
+            shm = shared_memory.SharedMemory(create=True, size=max(1, self.samples.nbytes))
+            samples = numpy.ndarray(self.samples.shape, dtype=self.samples.dtype, buffer=shm.buf)
+            samples[:] = self.samples
+            self._set_samples(samples, shm, owner=True)
+        return self._shm.name
+
+    @staticmethod
+    def attach(name, shape, offsets, keys):
+        """ store using the samples of a shared memory block (no copy) """
+        store = LeafShapeStore.__new__(LeafShapeStore)
+        store.__setstate__((name, shape, offsets, keys))
+        return store
+
+    def unshare(self):
+        """ copy samples back to private memory and detach from (and, for the
+        creating process, release) the shared memory block.
+
+        Shapes obtained before remain views on the shared block.
+        """
+        shm, owner = self._shm, self._owner
+        if shm is None:
+            return
+        self._set_samples(numpy.array(self.samples))
+        try:
+            shm.close()
+        except BufferError:
+            warnings.warn('shared leaf shapes are still in use, memory block %s is not closed' % shm.name)
+        if owner:
+            shm.unlink()
+
+    def __getstate__(self):
+        if self._shm is not None:
+            return self._shm.name, self.samples.shape, self.offsets, self.keys
+        return self.samples, self.offsets, self.keys
+
+    def __setstate__(self, state):
+        if len(state) == 4:
+            name, shape, offsets, keys = state
+            shm = shared_memory.SharedMemory(name=name)
+            samples = numpy.ndarray(shape, dtype=float, buffer=shm.buf)
+            self.__init__(samples, offsets, keys, shm=shm)
+        else:
+            self.__init__(numpy.array(state[0]), *state[1:])
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __contains__(self, leaf_key):
+        return tuple(leaf_key) in self._index
+
+    def __getitem__(self, leaf_key):
+        return self._shapes[self._index[tuple(leaf_key)]]
+
+    def as_leaves(self):
+        """ fitted leaf database ({key: [shapes]}) of views on the store """
+        leaves = {}
+        for (k, i, age), shape in zip(self.keys, self._shapes):
+            shapes = leaves.setdefault(k, [])
+            if i == len(shapes):
+                shapes.append(shape if age is None else {})
+            if age is not None:
+                shapes[i][age] = shape
+        return leaves
+
+
+class LazyShapes(Mapping):
+    """ {age class: fitted shape} of a leaf of a dynamic database, where
+    shapes are fitted on first access only """
+
+    def __init__(self, xysr, nb_points):
+        self.xysr = xysr
+        self.nb_points = nb_points
+        self.fitted = {}
+
+    def set_fitted(self, age, leaf):
+        if leaf is None:
+            raise ValueError("can't fit leaf shape for age class %s" % str(age))
+        self.fitted[age] = leaf
+
+    def __getitem__(self, age):
+        if age not in self.fitted:
+            self.set_fitted(age, fitting._fit_element(self.xysr[age], self.nb_points))
+        return self.fitted[age]
+
+    def __iter__(self):
+        return iter(self.xysr)
+
+    def __len__(self):
+        return len(self.xysr)
+
+
 class Leaves(object):
     
-    def __init__(self, xydb = None, srdb = None, geoLeaf = None, dynamic_bins = None, discretisation_level = 9, twist = 0):
+    def __init__(self, xydb = None, srdb = None, geoLeaf = None, dynamic_bins = None, discretisation_level = 9, twist = 0, mesh_cache_size = 10000, mesh_cache_decimals = 4, processes = None, fit_cache_dir = None, lazy_fit = False):
 
         if xydb is None:
             data = datadir + '/data/So99.csv'
@@ -130,8 +347,73 @@ class Leaves(object):
         self.bins = dynamic_bins
         self.discretisation_level = discretisation_level
         self.twist = twist
+        # number of processes used for fitting, and directory of the cache of fitted shapes (None: no cache)
+        self.processes = processes
+        self.fit_cache_dir = fit_cache_dir
+        # for dynamic databases, fit shapes of (key, index, age class) on first use only
+        self.lazy_fit = lazy_fit
+        # LRU cache of leaf element meshes (in local frame), keyed by element parameters rounded to mesh_cache_decimals
+        self.mesh_cache_size = mesh_cache_size
+        self.mesh_cache_decimals = mesh_cache_decimals
+        self.clear_mesh_cache()
         self.fit_leaves()
 
+    def __getstate__(self):
+        # plantgl meshes are not picklable
+        state = dict(self.__dict__)
+        state['_mesh_cache'] = OrderedDict()
+        # leaves are views on the shape store, rebuilt when unpickled
+        if state.get('shapes') is not None:
+            state['leaves'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        # Leaves pickled by previous versions lack the attributes introduced since
+        for name, default in (('processes', None), ('fit_cache_dir', None), ('lazy_fit', False),
+                              ('mesh_cache_size', 10000), ('mesh_cache_decimals', 4)):
+            self.__dict__.setdefault(name, default)
+        if '_mesh_cache' not in self.__dict__ or 'mesh_cache_hits' not in self.__dict__:
+            self.clear_mesh_cache()
+        if 'shapes' not in self.__dict__:
+            try:
+                self.shapes = LeafShapeStore.from_leaves(self.leaves, self.dynamic)
+            except Exception:
+                # shapes that cannot be stored are read from self.leaves
+                self.shapes = None
+        if self.shapes is not None:
+            self.leaves = self.shapes.as_leaves()
+        # Leaves pickled before sr tables were introduced
+        if 'sr_tables' not in self.__dict__:
+            self.fit_sr_tables()
+
+    def share_memory(self):
+        """ move fitted shapes to shared memory, so that copies of self sent to
+        worker processes attach to them instead of copying them.
+        Return the name of the shared memory block.
+        """
+        if self.shapes is None:
+            raise ValueError('lazy fitted leaves cannot be shared')
+        name = self.shapes.share()
+        self.leaves = self.shapes.as_leaves()
+        return name
+
+    def unshare_memory(self):
+        """ move fitted shapes back to private memory (releasing the shared block) """
+        if self.shapes is not None:
+            self.shapes.unshare()
+            self.leaves = self.shapes.as_leaves()
+
+    def clear_mesh_cache(self):
+        self._mesh_cache = OrderedDict()
+        self.mesh_cache_hits = 0
+        self.mesh_cache_misses = 0
+
+    def mesh_cache_info(self):
+        """ return hits, misses, maximal size and current size of the mesh cache"""
+        return {'hits': self.mesh_cache_hits, 'misses': self.mesh_cache_misses,
+                'maxsize': self.mesh_cache_size, 'currsize': len(self._mesh_cache)}
+
     def fit_leaves(self):
         leaves = {}
         xy = self.xydb
@@ -144,9 +426,62 @@ class Leaves(object):
                 else:
                     xysr = (xy[k][i][0], xy[k][i][1], sr[k][0], sr[k][1])
                 leaves[k].append(xysr)
-        leaves,discard = fitting.fit_leaves(leaves, self.discretisation_level, self.dynamic)
-            
-        self.leaves = leaves
+        if self.dynamic and self.lazy_fit:
+            # no shape is discarded: indices are those of xydb, and shapes that cannot be fitted raise an error when used
+            self.shapes = None
+            self.leaves = {k: [LazyShapes(xysr, self.discretisation_level) for xysr in leaves[k]] for k in leaves}
+            self.fit_sr_tables()
+            return
+
+        fitted = None
+        if self.fit_cache_dir is not None:
+            key = fit_cache_key(leaves, self.discretisation_level, self.dynamic)
+            cache_path = os.path.join(self.fit_cache_dir, key + '.pckl')
+            fitted = _load_fitted(cache_path)
+        if fitted is not None:
+            try:
+                self.shapes = LeafShapeStore.from_leaves(fitted, self.dynamic)
+            except Exception:
+                # stale cache content: fit again
+                fitted = None
+        if fitted is None:
+            fitted, discard = fitting.fit_leaves(leaves, self.discretisation_level, self.dynamic, processes=self.processes)
+            if self.fit_cache_dir is not None:
+                _save_fitted(cache_path, fitted)
+            self.shapes = LeafShapeStore.from_leaves(fitted, self.dynamic)
+
+        self.leaves = self.shapes.as_leaves()
+        self.fit_sr_tables()
+
+    def prefetch(self, ages, processes=None):
+        """ fit shapes of all leaves for a list of ages (lazy dynamic databases only)"""
+        if not (self.dynamic and self.lazy_fit):
+            return
+        age_indices = set(self.get_age_index(age) for age in ages)
+        todo = [(shapes, a) for k in self.leaves for shapes in self.leaves[k]
+                for a in age_indices if a in shapes.xysr and a not in shapes.fitted]
+        if processes is None:
+            processes = self.processes
+        fitted = fitting.fit_elements([shapes.xysr[a] for shapes, a in todo], self.discretisation_level, processes)
+        for (shapes, a), leaf in zip(todo, fitted):
+            shapes.set_fitted(a, leaf)
+
+    def fit_sr_tables(self):
+        """ precompute s, r, cumulated integral of r over s and cumulated sum of r for every key of srdb.
+
+        Integrals are those of the linear interpolation of r(s) (trapezoidal rule), which makes element areas exactly
+        additive. Previous versions used Simpson's rule, which gives values about 0.15% higher on the default database.
+        """
+        tables = {}
+        for k, sr in self.srdb.items():
+            if isinstance(sr, dict):
+                sr = sr['s'], sr['r']
+            s = numpy.asarray(sr[0], dtype=float)
+            r = numpy.asarray(sr[1], dtype=float)
+            area = numpy.zeros(len(s))
+            area[1:] = numpy.cumsum(numpy.diff(s) * (r[1:] + r[:-1]) / 2.)
+            tables[k] = s, r, area, numpy.cumsum(r)
+        self.sr_tables = tables
 
     def get_age_index(self, age=None):
         age_index = age
@@ -168,6 +503,8 @@ class Leaves(object):
         return key, index, age_index
     
     def get_leaf(self, leaf_key):
+        if self.shapes is not None:
+            return self.shapes[leaf_key]
         key, index, age_index = leaf_key
         if age_index is None:
             leaf = self.leaves[key][index]
@@ -186,46 +523,47 @@ class Leaves(object):
         
     def blade_elt_area(self, leaf_key, Lshape, Lwshape, sr_base, sr_top):
         """ surface of a blade element, positioned with two relative curvilinear absisca"""
-       
-        S=0
-        sr_base = min([1,max([0,sr_base])])
-        sr_top = min([1,max([sr_base,sr_top])])
-        if leaf_key is not None:
-            s,r = self.get_sr(leaf_key)
-            sre = [sr for sr in zip(s,r) if (sr_base < sr[0] < sr_top)]
-            if len(sre) > 0:
-                se,re = list(zip(*sre))
-                snew = [sr_base] + list(se) + [sr_top]
-                rnew = [numpy.interp(sr_base,s,r)] + list(re) + [numpy.interp(sr_top,s,r)]
-            else:
-                snew = [sr_base, sr_top]
-                rnew = [numpy.interp(sr_base,s,r), numpy.interp(sr_top,s,r)]
-
-            S = simps(rnew,snew) * Lshape * Lwshape
-
-        return S
+        return float(self.blade_elt_areas(leaf_key, Lshape, Lwshape, sr_base, sr_top))
 
     def blade_elt_width(self, leaf_key, Lshape, Lwshape, sr_base, sr_top):
         """ width of a blade element, positioned with two relative curvilinear absisca"""
-
-        w = 0
-        sr_base = min([1, max([0, sr_base])])
-        sr_top = min([1, max([sr_base, sr_top])])
-        if leaf_key is not None:
-            s, r = self.get_sr(leaf_key)
-            sre = [sr for sr in zip(s, r) if (sr_base < sr[0] < sr_top)]
-            if len(sre) > 0:
-                se, re = list(zip(*sre))
-                snew = [sr_base] + list(se) + [sr_top]
-                rnew = [numpy.interp(sr_base, s, r)] + list(re) + [
-                    numpy.interp(sr_top, s, r)]
-            else:
-                snew = [sr_base, sr_top]
-                rnew = [numpy.interp(sr_base, s, r), numpy.interp(sr_top, s, r)]
-
-            w = numpy.mean(rnew) * Lwshape
-
-        return w
+        return float(self.blade_elt_widths(leaf_key, Lshape, Lwshape, sr_base, sr_top))
+
+    def sr_table(self, leaf_key):
+        """ return s, r, cumulated integral of r over s and cumulated sum of r for the sr shape of leaf_key"""
+        return self.sr_tables[leaf_key[0]]
+
+    def _clip_sr(self, sr_base, sr_top):
+        sr_base = numpy.clip(numpy.asarray(sr_base, dtype=float), 0, 1)
+        sr_top = numpy.minimum(1, numpy.maximum(sr_base, sr_top))
+        return sr_base, sr_top
+
+    def blade_elt_areas(self, leaf_key, Lshape, Lwshape, sr_base, sr_top):
+        """ vectorised version of blade_elt_area (sr_base and sr_top are arrays).
+        Areas are integrals of the linear interpolation of r(s), and are therefore additive."""
+        sr_base, sr_top = self._clip_sr(sr_base, sr_top)
+        if leaf_key is None:
+            return numpy.zeros(sr_base.shape)
+        s, r, area, _ = self.sr_table(leaf_key)
+
+        def cumulated(x):
+            i = numpy.clip(numpy.searchsorted(s, x, side='right') - 1, 0, len(s) - 1)
+            return area[i] + (x - s[i]) * (r[i] + numpy.interp(x, s, r)) / 2.
+
+        return (cumulated(sr_top) - cumulated(sr_base)) * Lshape * Lwshape
+
+    def blade_elt_widths(self, leaf_key, Lshape, Lwshape, sr_base, sr_top):
+        """ vectorised version of blade_elt_width (sr_base and sr_top are arrays)"""
+        sr_base, sr_top = self._clip_sr(sr_base, sr_top)
+        if leaf_key is None:
+            return numpy.zeros(sr_base.shape)
+        s, r, _, rsum = self.sr_table(leaf_key)
+        # sum and number of r values strictly between sr_base and sr_top
+        ib = numpy.searchsorted(s, sr_base, side='right')
+        it = numpy.maximum(ib, numpy.searchsorted(s, sr_top, side='left'))
+        inner = numpy.where(it > ib, rsum[it - 1] - numpy.where(ib > 0, rsum[ib - 1], 0), 0)
+        total = numpy.interp(sr_base, s, r) + numpy.interp(sr_top, s, r) + inner
+        return total / (it - ib + 2) * Lwshape
 
     def mesh(self, leaf_key, L_shape, Lw_shape, length, s_base, s_top, incline=1, flipx = False):
         """ Compute mesh for a leaf element.
@@ -234,7 +572,23 @@ class Leaves(object):
             - Lw_shape is the width of the scaled shape
             - length is the total visible length to be meshed
             - s_base and s_top are relative proportion (on length) of the element to represent
+            Meshes are shared between identical calls (up to mesh_cache_decimals) and should not be modified in place
         """
+        if not self.mesh_cache_size:
+            return self._mesh(leaf_key, L_shape, Lw_shape, length, s_base, s_top, incline, flipx)
+        key = (tuple(leaf_key),) + tuple(round(float(x), self.mesh_cache_decimals) for x in (L_shape, Lw_shape, length, s_base, s_top, incline)) + (flipx,)
+        try:
+            mesh = self._mesh_cache.pop(key)
+            self.mesh_cache_hits += 1
+        except KeyError:
+            mesh = self._mesh(leaf_key, L_shape, Lw_shape, length, s_base, s_top, incline, flipx)
+            self.mesh_cache_misses += 1
+            if len(self._mesh_cache) >= self.mesh_cache_size:
+                self._mesh_cache.popitem(last=False)
+        self._mesh_cache[key] = mesh
+        return mesh
+
+    def _mesh(self, leaf_key, L_shape, Lw_shape, length, s_base, s_top, incline=1, flipx = False):
         shape = self.get_leaf(leaf_key)
 
         shape = incline_leaf(shape, incline)
@@ -258,13 +612,10 @@ class Leaves(object):
     
     def form_factor(self):
         """
-        return form factor for each key in sr_db
+        return form factor for each key in sr_db, ie the area of the blade of unit length and width (trapezoidal
+        rule, see fit_sr_tables), so that form_factor * L * W is the sum of element areas of a blade
         """
-        try:
-            return {k:simps(self.srdb[k]['r'], self.srdb[k]['s']) for k in self.srdb}
-        except TypeError:
-            return {k: simps(self.srdb[k][1], self.srdb[k][0]) for k in
-                    self.srdb}
+        return {k: self.sr_tables[k][2][-1] for k in self.srdb}
         
     def midrib(self, blade, resample=False):
         """ Compute visible midrib x,y coordinates  and vertical distance to insertion point due to rollingfrom a blade node
@@ -293,6 +644,6 @@ class Leaves(object):
 
         return x, y, dy
 
-def leaves_node(xydb = None, srdb = None, geoLeaf = None, dynamic_bins = None, discretisation_level = 9, twist = 0):
+def leaves_node(xydb = None, srdb = None, geoLeaf = None, dynamic_bins = None, discretisation_level = 9, twist = 0, mesh_cache_size = 10000, mesh_cache_decimals = 4):
     return Leaves(**locals())
     
\ No newline at end of file
@@ -0,0 +1,119 @@
+# -*- python -*-
+#
+#       Copyright 2015 INRIA - CIRAD - INRA
+#
+#       Distributed under the Cecill-C License.
+#       See accompanying file LICENSE.txt or copy at
+#           http://www.cecill.info/licences/Licence_CeCILL-C_V1-en.html
+#
+#       WebSite : https://github.com/openalea-incubator/adel
+#
+# ==============================================================================
+"""
+Canopies made of instances of reference plants
+
+"""
+import pandas
+import openalea.plantgl.all as pgl
+
+from alinea.adel.mtg_interpreter import plot3d, transform_geom
+from alinea.adel.newmtg import exposed_areas
+
+
+class PlantInstances(object):
+    """ A canopy stored as reference plants and plant instances.
+
+    g is a mtg of the reference plants, positioned at origin. Each instance
+    only stores the vid of its reference plant in g, its position and its
+    azimuth: geometries of instances are computed on demand, by transforming
+    the (shared) meshes of their reference plant.
+
+    A PlantInstances is not a mtg: it can be used to get geometries, scenes
+    and exposed areas (hence Adel statistics), but it cannot be grown or
+    saved. Use a duplicated canopy for that.
+    """
+
+    def __init__(self, g, references, positions, azimuths):
+        self.g = g
+        self.references = list(references)
+        self.positions = positions
+        self.azimuths = azimuths
+        # {reference vid: vids of elements of the reference}, filled on demand
+        self._elements = {}
+
+    def __len__(self):
+        return len(self.references)
+
+    def elements(self, reference):
+        """ vids of elements of a reference plant """
+        if reference not in self._elements:
+            self._elements[reference] = self.g.components_at_scale(
+                reference, self.g.max_scale())
+        return self._elements[reference]
+
+    def shape_id(self, instance, vid):
+        """ unique id of the shape of element vid in a given instance """
+        return instance * (self.g.nb_vertices() + 1) + vid
+
+    def instance_of(self, shape_id):
+        """ return (instance, vid) from a shape id """
+        return divmod(shape_id, self.g.nb_vertices() + 1)
+
+    def instance_geometry(self, instance):
+        """ return {vid: geometry} of the elements of an instance """
+        reference = self.references[instance]
+        position = self.positions[instance]
+        azimuth = self.azimuths[instance]
+        geometry = self.g.property('geometry')
+        return {vid: transform_geom(geometry[vid], position, azimuth) for vid
+                in self.elements(reference) if vid in geometry}
+
+    def iter_geometries(self):
+        """ iterate over (instance, vid, geometry) of all elements of the canopy """
+        for instance in range(len(self)):
+            for vid, geom in self.instance_geometry(instance).items():
+                yield instance, vid, geom
+
+    def exposed_areas(self):
+        """ exposed areas of the elements of all instances, as returned by
+        newmtg.exposed_areas for the duplicated canopy. Plants are labelled
+        'plant<instance + 1>' and vids are shape ids
+        """
+        areas = exposed_areas(self.g)
+        label = self.g.property('label')
+        rows = areas.groupby('plant', sort=False).indices
+        res = []
+        for instance, reference in enumerate(self.references):
+            df = areas.iloc[rows.get(label[reference], [])].copy()
+            df['plant'] = 'plant' + str(instance + 1)
+            df['vid'] = [self.shape_id(instance, vid) for vid in df['vid']]
+            df.index = df['vid'].values
+            res.append(df)
+        if len(res) == 0:
+            return areas
+        return pandas.concat(res)
+
+    def scene(self, leaf_material=None, stem_material=None,
+              soil_material=None, colors=None):
+        """ return a plantgl scene of the canopy.
+
+        Shape ids are given by shape_id(instance, vid)
+        """
+        ref_scene = plot3d(self.g, leaf_material=leaf_material,
+                           stem_material=stem_material,
+                           soil_material=soil_material, colors=colors)
+        shapes = {}
+        for sh in ref_scene:
+            shapes.setdefault(sh.id, []).append(sh)
+        scene = pgl.Scene()
+        for instance in range(len(self)):
+            position = self.positions[instance]
+            azimuth = self.azimuths[instance]
+            for vid in self.elements(self.references[instance]):
+                for sh in shapes.get(vid, []):
+                    shape = pgl.Shape(
+                        transform_geom(sh.geometry, position, azimuth),
+                        sh.appearance)
+                    shape.id = self.shape_id(instance, vid)
+                    scene.add(shape)
+        return scene
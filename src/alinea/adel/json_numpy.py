@@ -9,12 +9,14 @@ class NumpyEncoder(json.JSONEncoder):
         if input object is a ndarray it will be converted into a dict holding dtype, shape and the data base64 encoded
         """
         if isinstance(obj, numpy.ndarray):
-            data_b64 = base64.b64encode(obj.data)
-            return dict(__ndarray__=data_b64,
+            data_b64 = base64.b64encode(numpy.ascontiguousarray(obj).data)
+            return dict(__ndarray__=data_b64.decode('ascii'),
                         dtype=str(obj.dtype),
                         shape=obj.shape)
+        if isinstance(obj, numpy.generic):
+            return obj.item()
         # Let the base class default method raise the TypeError
-        return json.JSONEncoder(self, obj)
+        return json.JSONEncoder.default(self, obj)
 
 
 def json_numpy_obj_hook(dct):
@@ -0,0 +1,661 @@
+# -*- python -*-
+#
+#       Copyright 2015 INRIA - CIRAD - INRA
+#
+#       Distributed under the Cecill-C License.
+#       See accompanying file LICENSE.txt or copy at
+#           http://www.cecill.info/licences/Licence_CeCILL-C_V1-en.html
+#
+#       WebSite : https://github.com/openalea-incubator/adel
+#
+# ==============================================================================
+"""
+Pure python (numpy) implementation of Adel kinetics (runAdel, kinL, kinLvis
+and getdesc functions of Adel.R / UseAdel.R).
+
+Plant parameters are the ones generated by setAdel, converted once to python
+structures with alinea.adel.AdelR.plant_parameters. Each plant is a dict with
+keys:
+    - 'refp' : the id of the reference plant
+    - 'axeT' : a dict of arrays (axe, nf, nf_end, emf1, end, disp, azT, azTb,
+    incT, dredT, hasEar, HS_final) with one value per axe
+    - 'phytoT' : a dict of (n_phytomer, n_axe) arrays (Ll, Lw, Gl, Gd, El, Ed,
+    Azim, Lindex, Lseed, ...)
+    - 'pheno' : a list (one per axe) of dict of arrays (n, tip, col, ssi, disp)
+    - 'pedT' : a list (one per axe) of dict (startPed, endPed, senPed) or None
+    - 'ssisenT' : a dict of arrays (ndel, rate, dssit1, dssit2) or None
+    - 'ssipars' : a dict (r1, ndelsen) or None
+"""
+
+import numpy
+
+default_pars = {'senescence_leaf_shrink': 0.5, 'leafDuration': 2,
+                'fracLeaf': 0.2, 'stemDuration': 2. / 1.2, 'dHS_col': 0.2,
+                'dHS_en': 0, 'epsillon': 1e-6,
+                'HSstart_inclination_tiller': 1, 'rate_inclination_tiller': 30,
+                'drop_empty': True}
+
+# kinetic variables computed by kinL/kinLvis
+kin_variables = ('Ll', 'Gl', 'El', 'Lhem', 'Lhcol', 'xh', 'Lh', 'ht', 'Llvis',
+                 'Glvis', 'Elvis', 'Llrolled', 'Glopen', 'Llsen', 'Glsen',
+                 'Elsen', 'ntop', 'rph', 'rssi', 'rhs', 'exposition',
+                 'lifetime', 'age', 'is_ligulated')
+
+
+def openapprox(x, y, xout, extrapolate=True):
+    """ Linear interpolator/extrapolator (same as openapprox R function)
+    """
+    x = numpy.asarray(x, dtype=float)
+    y = numpy.asarray(y, dtype=float)
+    order = numpy.argsort(x, kind='stable')
+    x = x[order]
+    y = y[order]
+    # R approx collapses tied x using mean of y
+    ux, inv = numpy.unique(x, return_inverse=True)
+    if len(ux) < len(x):
+        uy = numpy.bincount(inv, weights=y) / numpy.bincount(inv)
+    else:
+        uy = y
+    xout = numpy.asarray(xout, dtype=float)
+    res = numpy.interp(xout, ux, uy)
+    if extrapolate and len(x) > 1:
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            lastrate = (y[-1] - y[-2]) / (x[-1] - x[-2])
+            firstrate = (y[1] - y[0]) / (x[1] - x[0])
+        if not numpy.isfinite(lastrate):
+            lastrate = y[-1] - y[-2]
+        if not numpy.isfinite(firstrate):
+            firstrate = y[1] - y[0]
+        res = numpy.where(xout > x[-1], y[-1] + lastrate * (xout - x[-1]), res)
+        res = numpy.where(xout < x[0], y[0] + firstrate * (xout - x[0]), res)
+    return res
+
+
+def _approx(x0, x1, y1, xout):
+    """ interpolation between (x0, 0) and (x1, y1), constant outside
+    """
+    return numpy.interp(xout, [x0, x1], [0, y1])
+
+
+def _ssi_column(ssisenT, name):
+    # R '$' operator on data.frame allows partial matching (eg rate -> rate1)
+    if name in ssisenT:
+        return numpy.asarray(ssisenT[name], dtype=float)
+    for k in ssisenT:
+        if k.startswith(name):
+            return numpy.asarray(ssisenT[k], dtype=float)
+    raise KeyError(name)
+
+
+def rssi_patternT(n, nf, ssisenT, hasEar=True):
+    """ senescence pattern for leaf n on an axe bearing nf leaves, using
+     ssi2sen table ('old' adel model)
+    """
+    ndelsen = int(numpy.max(ssisenT['ndel']))
+    t = [-1, 0]
+    p = [0, 1]
+    if hasEar and n > (nf - ndelsen):
+        idel = n - (nf - ndelsen) - 1
+        t0 = -(idel + 1)
+        t1 = t0 + _ssi_column(ssisenT, 'dssit1')[idel]
+        t2 = min(t0 + _ssi_column(ssisenT, 'dssit2')[idel], nf - n)
+        if nf < ndelsen:
+            t0 = -nf
+            t1 = min(nf - n, max(t1, t0))
+            t2 = min(nf - n, max(t2, t1))
+        p1 = _ssi_column(ssisenT, 'rate')[idel] * (t1 - t0)
+        t = [t0, t1, t2]
+        p = [0, p1, 1]
+    return t, p
+
+
+def ssi_table(r1=.1, ndel=3):
+    """ ssi table for senescence model based on r1 and ndel only
+    """
+    table = numpy.zeros((ndel, ndel))
+    table[0, :] = [r1] * (ndel - 1) + [1 - (ndel - 1) * r1]
+    for i in range(1, ndel):
+        if (ndel - i - 1) >= 1:
+            table[i, :ndel - i - 1] = r1
+        table[i, ndel - i] = 1 - table[:i, ndel - i].sum()
+        table[i, ndel - i - 1] = 1 - table[i, :].sum()
+    return table
+
+
+def rssi_pattern(n, nf, hasEar=True, pars=None):
+    """ senescence pattern for leaf n on an axe bearing nf leaves (model based
+     on r1 and ndel only)
+    """
+    if pars is None:
+        pars = {'r1': 0.07, 'ndelsen': 3}
+    t = [-1, 0]
+    p = [0, 1]
+    ndel = min(pars['ndelsen'], nf)
+    if ndel > 1 and hasEar and (nf - n) < pars['ndelsen']:
+        table = ssi_table(r1=pars['r1'], ndel=ndel)
+        t = numpy.arange(nf - ndel, nf + 1) - n
+        p = numpy.cumsum([0] + table[nf - n, :].tolist())
+    return t, p
+
+
+def psen(rssi, n, nf, hasEar=True, plant=None):
+    """ proportion senesced as a function of relative ssi and number from top
+    """
+    if plant is not None and plant.get('ssisenT') is not None:
+        t, p = rssi_patternT(n, nf, plant['ssisenT'], hasEar)
+    elif plant is not None and plant.get('ssipars') is not None:
+        t, p = rssi_pattern(n, nf, hasEar, plant['ssipars'])
+    else:
+        t, p = rssi_pattern(n, nf, hasEar)
+    return openapprox(t, p, rssi, extrapolate=False)
+
+
+def ms_pos(axeid):
+    """ position of axis on main stem from axis_id. returns 0 for ms itself
+    """
+    idpos = axeid.split('.')[0]
+    if idpos == 'MS':
+        return 0.
+    return float(idpos.split('T')[1])
+
+
+def kinL(x, plant, pars=None):
+    """ Model for organ extension and leaf senescence.
+
+    x is a list of thermal times, plant are the parameters generated by
+    setAdel (converted with AdelR.plant_parameters).
+    Returns a list (one item per axe) of {variable: (len(x), nf + 3) array}
+    dict
+    """
+    if pars is None:
+        pars = default_pars
+    apparentLeafDuration = (1 - pars['fracLeaf']) * pars['leafDuration']
+    dhslin = apparentLeafDuration - pars['dHS_col']
+    startLeaf = apparentLeafDuration - pars['leafDuration']
+    endLeaf = apparentLeafDuration
+    startE = endLeaf + pars['dHS_en']
+    endE = startE + pars['stemDuration']
+
+    x = numpy.atleast_1d(numpy.asarray(x, dtype=float))
+    nx = len(x)
+    axeT = plant['axeT']
+    phytoT = plant['phytoT']
+    res = []
+    for a in range(len(axeT['axe'])):
+        nfa = int(axeT['nf'][a])
+        hasEar = bool(axeT['hasEar'][a])
+        pheno = plant['pheno'][a]
+        ped = plant['pedT'][a]
+        dim = {k: v[:, a] for k, v in phytoT.items()}
+        xa = x.copy()
+        xend = axeT['end'][a]
+        if not numpy.isnan(xend):
+            xa[xa >= xend] = xend
+        ph = openapprox(pheno['tip'], pheno['n'], xa)
+        hs = ph - dhslin
+        ssi = openapprox(pheno['ssi'], pheno['n'], x)
+        disp = openapprox(pheno['disp'], pheno['n'], x)
+
+        kin = {k: numpy.full((nx, nfa + 3), numpy.nan) for k in kin_variables}
+        for k in ('Ll', 'Gl', 'El', 'Llsen', 'Glsen', 'Elsen', 'Llvis'):
+            kin[k][:] = 0
+
+        for i in range(1, nfa + 1):
+            j = i - 1
+            Ll, Gl, El = dim['Ll'][j], dim['Gl'][j], dim['El'][j]
+            rph = ph - i
+            rssi = ssi - i
+            kin['rph'][:, j] = rph
+            kin['rssi'][:, j] = rssi
+            kin['rhs'][:, j] = hs - i
+            xtip = openapprox(pheno['n'], pheno['tip'], i)
+            xssi = openapprox(pheno['n'], pheno['ssi'], i)
+            with numpy.errstate(divide='ignore', invalid='ignore'):
+                kin['lifetime'][:, j] = numpy.clip((x - xtip) / (xssi - xtip),
+                                                   0, 1)
+            kin['age'][:, j] = x - xtip
+            kin['is_ligulated'][:, j] = numpy.where(
+                rph > apparentLeafDuration, 1, 0)
+            # length blade + sheath
+            LGl = _approx(startLeaf, endLeaf, Ll + Gl, rph)
+            Elk = _approx(startE, endE, El, rph)
+            Llk = numpy.minimum(LGl, Ll)
+            Glk = LGl - Llk
+            kin['Ll'][:, j] = Llk
+            kin['Gl'][:, j] = Glk
+            kin['El'][:, j] = Elk
+            # hidden length of metamer at leaf emergence
+            Lhem = _approx(startLeaf, endLeaf, Ll + Gl, 0) + _approx(
+                startE, endE, El, 0)
+            # hidden length of metamer at collar appearance
+            xcol = openapprox(pheno['n'], pheno['col'], i)
+            rphcol = openapprox(pheno['tip'], pheno['n'], xcol) - i
+            LGcol = _approx(startLeaf, endLeaf, Ll + Gl, rphcol)
+            Ecol = _approx(startE, endE, El, rphcol)
+            Lhcol = LGcol + Ecol - Ll
+            with numpy.errstate(divide='ignore', invalid='ignore'):
+                xh = numpy.maximum(0, rph / rphcol)
+            Lh = numpy.where(xh <= 0, Llk + Glk + Elk,
+                             Lhem + (Lhcol - Lhem) * numpy.minimum(xh, 1))
+            # makes first phyto replace enclosing sheath after emergence
+            if i == 1:
+                Lh = numpy.where(xh > 0, 0, Lh)
+            else:
+                Lhmat = dim['Gl'][j - 1]
+                Lhx = Lhcol + (Lhcol - Lhmat) * (xh - 1)
+                if Lhmat < Lhcol:
+                    Lhx = numpy.minimum(Lhmat, Lhx)
+                else:
+                    Lhx = numpy.maximum(Lhmat, Lhx)
+                Lh = numpy.where(xh > 1, Lhx, Lh)
+            kin['Lhem'][:, j] = Lhem
+            kin['Lhcol'][:, j] = Lhcol
+            kin['xh'][:, j] = xh
+            kin['Lh'][:, j] = Lh
+            # Llvis is forced to be compatible with tip-col rates
+            kin['Llvis'][:, j] = numpy.maximum(0, numpy.minimum(Ll,
+                                                                LGl + Elk - Lh))
+            if Ll > 0:
+                kin['exposition'][:, j] = kin['Llvis'][:, j] / Ll
+            # senescence
+            kin['Llsen'][:, j] = psen(rssi, i, nfa, hasEar, plant) * Llk
+            kin['Glsen'][:, j] = psen(rssi - 2, i, nfa, hasEar, plant) * Glk
+            # leaf disappearance
+            gone = i <= disp
+            for k in ('Ll', 'Llsen', 'Llvis', 'Lh'):
+                kin[k][gone, j] = 0
+            gone = i <= (disp - 1)
+            for k in ('Gl', 'Glsen'):
+                kin[k][gone, j] = 0
+
+        # ear + peduncle elongation
+        if hasEar:
+            for j in (nfa + 1, nfa + 2):
+                kin['El'][:, j] = numpy.where(ph < (nfa + 1.6), 0, dim['El'][j])
+            if dim['El'][nfa] > 0:
+                kin['El'][:, nfa] = _approx(ped['startPed'], ped['endPed'],
+                                            dim['El'][nfa], xa)
+            else:
+                kin['El'][:, nfa] = 0
+            # senescence of stem + ear + awn + peduncle
+            for j in range(nfa + 3):
+                kin['Elsen'][:, j] = numpy.where(xa < ped['senPed'], 0,
+                                                 dim['El'][j])
+        # axe disappearance
+        if not numpy.isnan(axeT['disp'][a]):
+            gone = x > axeT['disp'][a]
+            for k in ('Ll', 'Gl', 'El', 'Llsen', 'Glsen', 'Elsen', 'Llvis',
+                      'Lh'):
+                kin[k][gone, :] = 0
+        # rank from flag leaf
+        kin['ntop'][:] = nfa - numpy.arange(1, nfa + 4)
+        res.append(kin)
+    return res
+
+
+def htube(kin, ht0):
+    """ height of the tube formed by the sheaths of an axe (hins, ht, Gt).
+
+    kin is a dict of 1D arrays (one date), ht0 is the height of the tube in
+    which the first leaf emerges
+    """
+    nmax = numpy.flatnonzero(kin['ntop'] >= 0).max() + 1
+    stem = numpy.cumsum(kin['El']) - kin['El']
+    hcol = stem + kin['Gl'] + kin['El'] + kin['Llrolled'] - kin['Glopen']
+    tube = numpy.concatenate(([ht0], hcol))[:len(hcol)]
+    hins = numpy.maximum.accumulate(tube)
+    # index of first maximum of tube[:i+1]
+    previous = numpy.concatenate(([-numpy.inf], hins[:-1]))
+    record = numpy.where(tube > previous, numpy.arange(len(tube)), 0)
+    Gt = numpy.minimum(nmax, numpy.maximum.accumulate(record))
+    ht = numpy.maximum(0, hins - stem)
+    return hins, ht, Gt
+
+
+def whorl(kin):
+    """ whorl adjustments needed to make Lh match ht.
+
+    returns a list of (Gt, delta) tuples
+    """
+    res = []
+    for gt in numpy.unique(kin['Gt']):
+        if gt <= 0:
+            continue
+        sel = kin['Gt'] == gt
+        emerged = kin['xh'][sel] > 0
+        delta = (kin['Lh'][sel] - kin['ht'][sel])[emerged]
+        delta = delta[~numpy.isnan(delta)]
+        if len(delta) > 0:
+            delta = delta.mean()
+            if abs(delta) > 1e-6:
+                res.append((gt, delta))
+    return res
+
+
+def visibility(kin, ht0=0):
+    """ Construct whorl, compute rolling and visibility for one axe at one date
+    """
+    kin['Llrolled'] = numpy.zeros_like(kin['Ll'])
+    kin['Glopen'] = numpy.zeros_like(kin['Ll'])
+    kin['hins'], kin['ht'], kin['Gt'] = htube(kin, ht0)
+    w = whorl(kin)
+    if len(w) > 0:
+        for i, (gt, delta) in enumerate(w):
+            # Nb: as in Adel.R, Gl and Llvis are read at whorl row index
+            if delta < 0:
+                kin['Glopen'][gt - 1] = min(kin['Gl'][i], -delta)
+            else:
+                kin['Llrolled'][gt - 1] = min(delta, kin['Llvis'][i])
+        kin['hins'], kin['ht'], kin['Gt'] = htube(kin, ht0)
+    kin['Glvis'] = numpy.minimum(
+        numpy.maximum(0, kin['Gl'] - kin['Glopen'] + kin['El'] - kin['ht']),
+        kin['Gl'])
+    kin['Elvis'] = numpy.minimum(numpy.maximum(0, kin['El'] - kin['ht']),
+                                 kin['El'])
+    return kin
+
+
+def kinLvis(kinlist, axes):
+    """ compute rolling and visibility of the axes of a plant.
+
+    kinlist is the output of kinL, axes the list of axe names. Tillers emerge
+    from the tube of their bearing sheath on the main stem.
+    """
+    order = sorted(range(len(axes)), key=lambda a: axes[a] != 'MS')
+    nx = kinlist[0]['Ll'].shape[0]
+    for d in range(nx):
+        htbm = None
+        for a in order:
+            kin = {k: v[d].copy() for k, v in kinlist[a].items()}
+            if axes[a] == 'MS':
+                kin = visibility(kin, kin['Lh'][0])
+                htbm = kin['ht']
+            else:
+                axilrank = int(ms_pos(axes[a]))
+                axil = htbm[axilrank] if axilrank < len(htbm) else numpy.nan
+                kin = visibility(kin, axil)
+            kinlist[a]['ht'][d] = kin['ht']
+            kinlist[a]['Llrolled'][d] = kin['Llrolled']
+            kinlist[a]['Glopen'][d] = kin['Glopen']
+            kinlist[a]['Glvis'][d] = kin['Glvis']
+            kinlist[a]['Elvis'][d] = kin['Elvis']
+    return kinlist
+
+
+def stem_elements(dat):
+    """ returns stack (metamer index, element type, length) of visible
+    elements of the stem of an axe
+    """
+    metamer = []
+    elt = []
+    dl = []
+    for i in range(len(dat['Ev'])):
+        if dat['Ev'][i] > 0:
+            metamer.append(i)
+            elt.append('en')
+            dl.append(dat['Ev'][i])
+        if dat['Gv'][i] > 0:
+            metamer.append(i)
+            elt.append('ga')
+            dl.append(dat['Gv'][i])
+    return metamer, elt, numpy.array(dl)
+
+
+def axe_inclination(dat, HS, ht, axename, incBase, dredT, start_incT=1,
+                    incT_rate=30, epsillon=1e-6):
+    """ Compute inclinations of stem elements
+    """
+    nbphy = len(dat['Ll'])
+    Einc = numpy.zeros(nbphy)
+    Ginc = numpy.zeros(nbphy)
+    if axename == 'MS':
+        incT = incBase
+    elif HS > start_incT:
+        incT = max(3, min(incBase, incT_rate * (HS - start_incT)))
+    else:
+        incT = 3
+    Einc[0] = incT
+    if axename != 'MS' and incT <= 3:
+        # Do not represent basal part of first metamer for non inclining tillers
+        Ll, Gl, El = dat['Ll'][0], dat['Gl'][0], dat['El'][0]
+        dat['Lv'][0] = min(Ll, max(0, Ll + Gl + El - ht))
+        dat['Lr'][0] = min(dat['Lv'][0], dat['Lr'][0])
+        dat['Gv'][0] = min(Gl, max(0, Gl + El - ht))
+        dat['Ev'][0] = min(El, max(0, El - ht))
+
+    def _set_inclination(k, inc):
+        if elt[k] == 'en':
+            Einc[metamer[k]] = inc
+        else:
+            Ginc[metamer[k]] = inc
+
+    # redressement (if any)
+    if dredT > 0 and numpy.sum(dat['Ev'] + dat['Gv']) > epsillon:
+        metamer, elt, dl = stem_elements(dat)
+        alpha = (90 - incT) * numpy.pi / 180
+        hc = numpy.cumsum(dl)
+        dc = hc * numpy.cos(alpha)
+        if numpy.any(dc >= dredT):
+            nd = numpy.flatnonzero(dc >= dredT)[0]
+            with numpy.errstate(invalid='ignore'):
+                if nd > 0:
+                    beta = numpy.arccos(
+                        (dredT - dc[nd - 1]) / (hc[nd] - hc[nd - 1]))
+                    _set_inclination(nd, -(beta - alpha) / numpy.pi * 180)
+                    if nd < len(dl) - 1:
+                        _set_inclination(nd + 1,
+                                         -(numpy.pi / 2 - beta) / numpy.pi * 180)
+                else:  # incT too large
+                    beta = numpy.arccos(dredT / hc[0])
+                    Einc[0] = (numpy.pi / 2 - beta) / numpy.pi * 180
+                    if len(dl) > 1:
+                        _set_inclination(1, -Einc[0])
+    dat['Einc'] = Einc
+    dat['Ginc'] = Ginc
+    return dat
+
+
+def _last_growing(desc):
+    """ number of metamers up to the last one having a non zero length
+    """
+    lmetamer = desc['Ll'] + desc['El'] + desc['Gl']
+    last = 1
+    if numpy.nansum(lmetamer) > 0:
+        last = numpy.flatnonzero(lmetamer > 0).max() + 1
+    return last
+
+
+def getdesc(kinlists, plants, pars=None, t=0):
+    """ generate the canopy description table at time index t
+
+    kinlists is the list (one per plant) of kinLvis outputs.
+    Returns a dict of arrays or None if the canopy is empty
+    """
+    if pars is None:
+        pars = default_pars
+    epsillon = pars['epsillon']
+    fshrink = pars['senescence_leaf_shrink']
+    start_incT = pars['HSstart_inclination_tiller']
+    incT_rate = pars['rate_inclination_tiller']
+    drop_empty = pars['drop_empty']
+    kin_cols = ('Ll', 'Gl', 'El', 'Llvis', 'Glvis', 'Elvis', 'Llsen', 'Glsen',
+                'Elsen', 'Llrolled')
+    dat_cols = ('Ll', 'Gl', 'El', 'Lv', 'Gv', 'Ev', 'Lsen', 'Gsen', 'Esen',
+                'Lr')
+    res = []
+    for p, (kin, plant) in enumerate(zip(kinlists, plants)):
+        refp = float(plant['refp'])
+        axeT = plant['axeT']
+        axes = list(axeT['axe'])
+        ims = axes.index('MS')
+        pldesc = []
+        for a, axename in enumerate(axes):
+            dat = {k: kin[a][kc][t].copy() for k, kc in zip(dat_cols, kin_cols)}
+            if sum(v.sum() for v in dat.values()) <= epsillon and a != 0:
+                # do not represent empty tillers (main stems are needed even if empty)
+                continue
+            nbleaf = int(axeT['nf'][a])
+            nbphy = nbleaf + 3
+            datp = {k: v[:nbphy, a] for k, v in plant['phytoT'].items()}
+            HS_axe = kin[a]['rhs'][t, 0] + 1
+            if axename == 'MS':
+                ht = 0
+            else:
+                axilrank = int(ms_pos(axename))
+                ht = kin[ims]['ht'][t, axilrank]
+            dat = axe_inclination(dat, HS_axe, ht, axename, axeT['incT'][a],
+                                  axeT['dredT'][a], start_incT, incT_rate)
+            # azimuts are relative to previous phytomer
+            Laz = datp['Azim'].copy()
+            Laz[0] = axeT['azT'][a]
+            with numpy.errstate(divide='ignore', invalid='ignore'):
+                Linc = numpy.where(datp['Ll'] > 0, dat['Lv'] / datp['Ll'], 1)
+            numphy = numpy.arange(1, nbphy + 1)
+            desc = {'refplant_id': numpy.full(nbphy, refp),
+                    'axe_id': numpy.array([axename] * nbphy),
+                    'ms_insertion': numpy.full(nbphy, ms_pos(axename)),
+                    'az_insertion': numpy.full(nbphy, axeT['azTb'][a]),
+                    'nff': numpy.full(nbphy, axeT['nf'][a]),
+                    'nff_end': numpy.full(nbphy, axeT['nf_end'][a]),
+                    'HS_final': numpy.full(nbphy, axeT['HS_final'][a]),
+                    'hasEar': numpy.full(nbphy, bool(axeT['hasEar'][a])),
+                    'numphy': numphy,
+                    'ntop': nbleaf + 1. - numphy,
+                    'L_shape': datp['Ll'],
+                    'Lw_shape': datp['Lw'],
+                    'LsenShrink': numpy.full(nbphy, float(fshrink)),
+                    'LcType': datp['Lindex'],
+                    'LcIndex': datp['Lseed'],
+                    'Linc': Linc,
+                    'Laz': Laz,
+                    'Lpo': numpy.ones(nbphy),
+                    'Lpos': numpy.full(nbphy, 2.),
+                    'Gd': datp['Gd'],
+                    'Gpo': numpy.ones(nbphy),
+                    'Gpos': numpy.full(nbphy, 2.),
+                    'Ed': datp['Ed'],
+                    'Epo': numpy.array([1.] * nbleaf + [3.] * 3),
+                    'Epos': numpy.array([2.] * nbleaf + [4.] * 3)}
+            for k in ('rph', 'rssi', 'rhs', 'exposition', 'lifetime'):
+                desc[k] = kin[a][k][t].copy()
+            desc['m_type'] = numpy.array(
+                ['vegetative'] * nbleaf + ['peduncle', 'ear', 'awn'])
+            for k in ('age', 'is_ligulated'):
+                desc[k] = kin[a][k][t].copy()
+            desc.update(dat)
+            pldesc.append(desc)
+        if len(pldesc) <= 0:
+            continue
+        if drop_empty:
+            # filter non growing metamers, keeping at least two rows of MS to
+            # avoid degenerated one-line tables
+            ms = [d for d in pldesc if d['axe_id'][0] == 'MS']
+            tillers = sorted([d for d in pldesc if d['axe_id'][0] != 'MS'],
+                             key=lambda d: d['axe_id'][0])
+            filtered = []
+            for d in ms:
+                last = max(2, _last_growing(d))
+                filtered.append({k: v[:last] for k, v in d.items()})
+            for d in tillers:
+                last = _last_growing(d)
+                filtered.append({k: v[:last] for k, v in d.items()})
+            pldesc = filtered
+        pldesc = {k: numpy.concatenate([d[k] for d in pldesc]) for k in
+                  pldesc[0]}
+        pldesc['plant'] = numpy.full(len(pldesc['numphy']), p + 1)
+        res.append(pldesc)
+    if len(res) <= 0:
+        return None
+    return {k: numpy.concatenate([d[k] for d in res]) for k in res[0]}
+
+
+def _na_column(values):
+    """ mimics AdelR.dataframeAsdict conversion of numeric columns holding NA
+    (an array of strings, with 'NA' for missing values)
+    """
+    if values.dtype.kind == 'f' and numpy.isnan(values).any():
+        return numpy.array(['NA' if numpy.isnan(v) else '%.15g' % v for v in
+                            values])
+    return values
+
+
+def _with_dates(desc, date):
+    columns = ['TT', 'plant'] + [k for k in desc if k != 'plant']
+    desc = dict(desc, TT=numpy.full(len(desc['plant']), float(date)))
+    return {k: desc[k] for k in columns}
+
+
+def _canopy_descriptions(dates, plants, pars=None):
+    """ iterates on (date, canopy description) of plants, computing
+    kinetics of all dates in one pass
+    """
+    pars = dict(default_pars, **(pars or {}))
+    if isinstance(plants, dict):
+        plants = [plants]
+    dates = numpy.atleast_1d(numpy.asarray(dates, dtype=float))
+    kinlists = [kinLvis(kinL(dates, plant, pars), list(plant['axeT']['axe']))
+                for plant in plants]
+    for t, date in enumerate(dates):
+        yield date, getdesc(kinlists, plants, pars, t)
+
+
+def runAdel(dates, plants, pars=None):
+    """ Run Adel for several dates and a list of plants.
+
+    Returns a list (one item per date) of canopy tables (dict of arrays, None
+    for empty canopies)
+    """
+    out = []
+    for date, desc in _canopy_descriptions(dates, plants, pars):
+        if desc is not None:
+            desc = {k: _na_column(v) for k, v in _with_dates(desc,
+                                                             date).items()}
+        out.append(desc)
+    return out
+
+
+def RunAdel(datesTT, plants, adelpars=None):
+    """ Run Adel model according to parameter list (numpy counterpart of
+    AdelR.RunAdel). Returns the canopy table of the first date in datesTT.
+    """
+    if not isinstance(datesTT, list):
+        datesTT = [datesTT]
+    res = runAdel(datesTT[:1], plants, adelpars)
+    return res[0]
+
+
+def as_numeric(values):
+    """ convert a canopy table column holding 'NA' strings to a float array
+    (with nan for NA). Other columns are returned unchanged.
+    """
+    values = numpy.asarray(values)
+    if values.dtype.kind in ('U', 'S', 'O'):
+        try:
+            return numpy.where(values == 'NA', 'nan', values).astype(float)
+        except ValueError:
+            pass
+    return values
+
+
+def concat_tables(tables):
+    """ concatenate canopy tables (dict of arrays) into a single typed table,
+    numeric columns holding NA being converted to float arrays with nan.
+    Returns None if all tables are empty
+    """
+    tables = [t for t in tables if t is not None]
+    if len(tables) <= 0:
+        return None
+    return {k: numpy.concatenate([as_numeric(t[k]) for t in tables]) for k in
+            tables[0]}
+
+
+def canopy_table(dates, plants, adelpars=None):
+    """ Run Adel for several dates in one kinetic pass.
+
+    Returns a single long-format canopy table (dict of typed arrays, with a
+    TT column giving the date of each row), or None if the canopy is empty at
+    all dates
+    """
+    return concat_tables(_with_dates(desc, date) for date, desc in
+                         _canopy_descriptions(dates, plants, adelpars) if
+                         desc is not None)
@@ -8,6 +8,7 @@ Date: 08/07/2008
 """
 
 import csv
+import io
 
 from openalea.mtg import MTG, fat_mtg
 
@@ -499,22 +500,35 @@ def to_plantgl(g,
     return scene,
 
 
-def _line(ind, pts, label):
-    s = "p 1 %s 3 %s"%(str(label), ' '.join('%.6f'%x for i in ind for x in pts[i]))
-    return s
+def _can_lines(labels, triangles):
+    """ format triangles ((n, 3, 3) array) and their labels as can file lines,
+    in one formatting operation """
+    n = len(triangles)
+    if n == 0:
+        return ''
+    values = numpy.empty((n, 10), dtype=object)
+    values[:, 0] = labels
+    values[:, 1:] = numpy.asarray(triangles, dtype=float).reshape(n, 9)
+    line = 'p 1 %s 3 ' + ' '.join(['%.6f'] * 9) + '\n'
+    return (line * n) % tuple(values.ravel().tolist())
 
-def to_canestra(g):
+
+def write_canestra(g, f, chunk_size=10000):
     """
-    Return a string representing a canestra file.
+    Write the canestra file representing g to f (a file name or a writable
+    text file object), by chunks of about chunk_size triangles.
     """
+    if isinstance(f, str):
+        with open(f, 'w') as output:
+            return write_canestra(g, output, chunk_size)
+
     geometry = g.property('geometry')
     can_label = g.property("can_label")
 
-    begin = '# File generated by OpenAlea.Adel program'
-
-    lines = [begin]
+    f.write('# File generated by OpenAlea.Adel program\n')
     max_scale = g.max_scale()
 
+    labels, triangles = [], []
     for root_elt in g.roots_iter(scale=max_scale):
         for vid in pre_order(g, root_elt):
             mesh = geometry.get(vid)
@@ -522,10 +536,22 @@ def to_canestra(g):
                 continue
             pts = numpy.array(mesh.pointList, ndmin=2)
             indices = numpy.array(mesh.indexList, ndmin=2)
-            label = can_label[vid]
-            lines.extend([_line(ind, pts, label) for ind in indices])
-    lines.append('')
-    return '\n'.join(lines)
+            triangles.append(pts[indices])
+            labels.extend([can_label[vid]] * len(indices))
+            if len(labels) >= chunk_size:
+                f.write(_can_lines(labels, numpy.concatenate(triangles)))
+                labels, triangles = [], []
+    if labels:
+        f.write(_can_lines(labels, numpy.concatenate(triangles)))
+
+
+def to_canestra(g):
+    """
+    Return a string representing a canestra file.
+    """
+    output = io.StringIO()
+    write_canestra(g, output)
+    return output.getvalue()
 
 def planter(g, distribution, random_seed=0, azimuths = None):
     """
@@ -1,9 +1,13 @@
 """ Methods for mtg interpretation with turtle """
 
 from math import degrees, radians, pi, cos, sin
+from weakref import WeakKeyDictionary
+import pickle
+from concurrent.futures import ProcessPoolExecutor
+import numpy
 import openalea.plantgl.all as pgl
 # from openalea.mtg import MTG
-from openalea.mtg.turtle import TurtleFrame
+from openalea.mtg.turtle import TurtleFrame, traverse_with_turtle
 # from openalea.mtg.algo import union
 # from alinea.astk.plantgl_utils import addSets
 
@@ -99,6 +103,22 @@ def compute_element(element_node, leaves, classic=False):
             geom = StemElement_mesh(n.length, diameter_base, diameter_top, classic)
         
     return geom
+
+
+def element_signature(element_node, classic=False):
+    """ return the tuple of inputs that determine the (untransformed) mesh computed by compute_element """
+    n = element_node
+    organ = n.complex()
+    if n.label.startswith('Leaf'):
+        return (n.label, classic, n.length, n.srb, n.srt, n.lrolled,
+                n.d_rolled, organ.species, organ.visible_length,
+                organ.shape_key, organ.shape_mature_length,
+                organ.shape_max_width, organ.inclination)
+    else:
+        return (n.label, classic, n.length, organ.diameter)
+
+# meshes of elements computed during previous interpretations, by mtg
+_mesh_cache = WeakKeyDictionary()
         
 
 class AdelTurtle(pgl.PglTurtle):
@@ -135,10 +155,12 @@ class AdelTurtle(pgl.PglTurtle):
 class AdelVisitor():
     """ Performs geometric interpretation of mtg nodes
     """
-    def __init__(self, leaves, classic, face_up):
+    def __init__(self, leaves, classic, face_up, cache=None):
         self.classic = classic
         self.face_up = face_up
         self.leaves = leaves
+        # {vid: (signature, untransformed mesh)}, or None for no caching
+        self.cache = cache
     
     def __call__(self, g, v, turtle):
         geometry=g.property('geometry')
@@ -227,7 +249,16 @@ class AdelVisitor():
             # update geometry of elements
             mesh = None
             if n.length > 0:
-                mesh = compute_element(n, self.leaves, self.classic)
+                if self.cache is None:
+                    mesh = compute_element(n, self.leaves, self.classic)
+                else:
+                    signature = element_signature(n, self.classic)
+                    cached = self.cache.get(v)
+                    if cached is not None and cached[0] == signature:
+                        mesh = cached[1]
+                    else:
+                        mesh = compute_element(n, self.leaves, self.classic)
+                        self.cache[v] = (signature, mesh)
             if mesh:
                 n.geometry = turtle.transform(mesh, face_up= self.face_up and  n.label.startswith('Leaf'))
                 n.anchor_point = turtle.getPosition()
@@ -246,8 +277,63 @@ class AdelVisitor():
                 turtle.context.update({'top': turtle.getFrame()})        
         turtle.context.update({'axis':axis})
         
-def mtg_interpreter(g, leaves, classic=False, face_up = False):
-    ''' Compute/update the geometry on each node of the MTG using Turtle geometry. '''
+def _interpret_roots(data, roots, leaves, classic, face_up):
+    ''' interpret the plants starting at roots in a pickled mtg (process pool worker).
+    Returns {vid: (points, indices, normalPerVertex, anchor_point)} for elements with a geometry
+    '''
+    g = pickle.loads(data)
+    turtle = AdelTurtle()
+    visitor = AdelVisitor(leaves, classic, face_up)
+    for vid in roots:
+        traverse_with_turtle(g, vid, visitor, turtle)
+    anchors = g.property('anchor_point')
+    return {vid: (as_tuples(mesh.pointList), as_tuples(mesh.indexList),
+                  mesh.normalPerVertex, tuple(anchors[vid]))
+            for vid, mesh in g.property('geometry').items()}
+
+
+def _parallel_interpreter(g, leaves, classic, face_up, processes):
+    ''' interpret plants of g in a pool of processes and merge back geometries.
+    Plantgl objects are not picklable: they are removed from g before sending it to
+    the workers, that send back meshes as lists of points and indices
+    '''
+    roots = list(g.component_roots_at_scale_iter(g.root, scale=g.max_scale()))
+    props = g.properties()
+    removed = {k: props.pop(k) for k in ('geometry', 'anchor_point') if k in props}
+    try:
+        data = pickle.dumps(g)
+    finally:
+        props.update(removed)
+    chunks = [roots[i::processes] for i in range(processes)]
+    with ProcessPoolExecutor(processes) as pool:
+        results = pool.map(_interpret_roots, [data] * len(chunks), chunks,
+                           [leaves] * len(chunks), [classic] * len(chunks),
+                           [face_up] * len(chunks))
+        geometry = {}
+        anchor_point = {}
+        for res in results:
+            for vid, (points, indices, per_vertex, anchor) in res.items():
+                geometry[vid] = pgl.TriangleSet(points, indices,
+                                                normalPerVertex=per_vertex)
+                anchor_point[vid] = pgl.Vector3(*anchor)
+    for k, values in (('geometry', geometry), ('anchor_point', anchor_point)):
+        if k not in props:
+            g.add_property(k)
+        props[k].clear()
+        props[k].update(values)
+    return g
+
+
+def mtg_interpreter(g, leaves, classic=False, face_up = False, use_cache=True, processes=None):
+    ''' Compute/update the geometry on each node of the MTG using Turtle geometry.
+
+    If use_cache is True, elements whose geometric inputs did not change since
+    the previous interpretation of g are not re-meshed, only re-positioned.
+    If processes is an integer greater than 1, plants are interpreted in parallel
+    by a pool of processes (the cache is not used)
+    '''
+    if processes is not None and processes > 1:
+        return _parallel_interpreter(g, leaves, classic, face_up, processes)
 #BUG : sub_mtg mange le vertex plant => on perd la plante !
     #plants = g.component_roots_at_scale(g.root, scale=1)
     #nplants = g.nb_vertices(scale=1)
@@ -255,8 +341,14 @@ def mtg_interpreter(g, leaves, classic=False, face_up = False):
     
     #for plant in plants:
     #   gplant = g.sub_mtg(plant)
+    cache = None
+    if use_cache:
+        cached_leaves, cache = _mesh_cache.get(g, (None, None))
+        if cache is None or cached_leaves is not leaves:
+            cache = {}
+            _mesh_cache[g] = (leaves, cache)
     turtle = AdelTurtle()
-    visitor = AdelVisitor(leaves, classic, face_up)
+    visitor = AdelVisitor(leaves, classic, face_up, cache)
     scene = TurtleFrame(g, visitor=visitor, turtle=turtle, gc=False, all_roots=True)
     #   gt = union(gplant,gt)
        
@@ -333,4 +425,83 @@ def transform_geom(geom, translation, rotation):
         geom = pgl.Shape(pgl.Translated(translation,
                                         pgl.AxisRotated((0, 0, 1), rotation,
                                                         geom.geometry)))
-    return geom
\ No newline at end of file
+    return geom
+
+
+def _triangle_sets(geom):
+    """ list of TriangleSets of a geometry (a plantgl geometry, a shape or a
+    list of them) """
+    if geom is None:
+        return []
+    if isinstance(geom, list):
+        return [mesh for g in geom for mesh in _triangle_sets(g)]
+    if isinstance(geom, pgl.Shape):
+        geom = geom.geometry
+    if not isinstance(geom, pgl.TriangleSet):
+        tessel = pgl.Tesselator()
+        geom.apply(tessel)
+        geom = tessel.triangulation
+    return [] if geom is None else [geom]
+
+
+def mesh_arrays(geometry):
+    """ concatenate meshes of a {vid: geometry} dict.
+
+    Return vids, points (n, 3), indices (m, 3, local to the points of each vid),
+    point_offsets and index_offsets (len(vids) + 1 each)
+    """
+    vids, points, indices = [], [], []
+    for vid in sorted(geometry):
+        pts, ind = [], []
+        npts = 0
+        for mesh in _triangle_sets(geometry[vid]):
+            p = numpy.array(mesh.pointList, dtype=float).reshape(-1, 3)
+            i = numpy.array(mesh.indexList, dtype=numpy.int32).reshape(-1, 3)
+            pts.append(p)
+            ind.append(i + npts)
+            npts += len(p)
+        if npts == 0:
+            continue
+        vids.append(vid)
+        points.append(numpy.concatenate(pts))
+        indices.append(numpy.concatenate(ind))
+    point_offsets = numpy.zeros(len(vids) + 1, dtype=numpy.int64)
+    point_offsets[1:] = numpy.cumsum([len(p) for p in points])
+    index_offsets = numpy.zeros(len(vids) + 1, dtype=numpy.int64)
+    index_offsets[1:] = numpy.cumsum([len(i) for i in indices])
+    if vids:
+        points = numpy.concatenate(points)
+        indices = numpy.concatenate(indices)
+    else:
+        points = numpy.zeros((0, 3))
+        indices = numpy.zeros((0, 3), dtype=numpy.int32)
+    return (numpy.array(vids, dtype=numpy.int64), points, indices,
+            point_offsets, index_offsets)
+
+
+def triangle_set(points, indices):
+    """ plantgl mesh from point and index arrays """
+    return pgl.TriangleSet(list(map(tuple, numpy.asarray(points).tolist())),
+                           list(map(tuple, numpy.asarray(indices).tolist())))
+
+
+def triangle_arrays(g, dtype=numpy.float32):
+    """ all triangles of the canopy as flat numpy arrays.
+
+    Returns a dict with 'triangles' ((n, 3, 3) array of vertex coordinates),
+    and per triangle 'vid', 'label' and 'is_green' arrays
+    """
+    vids, points, indices, point_offsets, index_offsets = mesh_arrays(
+        g.property('geometry'))
+    ntri = numpy.diff(index_offsets)
+    shift = numpy.repeat(point_offsets[:-1], ntri)
+    triangles = points[indices + shift[:, None]].astype(dtype)
+    element = numpy.repeat(numpy.arange(len(vids)), ntri)
+    labels = g.property('label')
+    greenness = g.property('is_green')
+    label = numpy.array([labels.get(vid, '') for vid in vids.tolist()],
+                        dtype=str)
+    is_green = numpy.array([bool(greenness.get(vid, True)) for vid in
+                            vids.tolist()], dtype=bool)
+    return {'triangles': triangles, 'vid': vids[element],
+            'label': label[element], 'is_green': is_green[element]}
@@ -107,6 +107,74 @@ def sheath_elements(l, lvis, lsen, az, inc, d, split=False):
     return internode_elements(l, lvis, lsen, az, inc, d, split)
 
 
+def _blade_sectors(sectors, lvis, Lshape, Lwshape, s_limvis, s_limsen,
+                   s_limrolled, shape_key, leaves):
+    """ compute lengths, areas, widths and relative positions of the green and
+    senescent parts of all blade sectors in one pass.
+    s_limvis, s_limsen and s_limrolled are the curvilinear abscissa (on mature
+    shape) at which the blade becomes visible, senescent and rolled.
+    Returns a list of dicts (one per sector)
+    """
+    zero = numpy.zeros(sectors)
+    none = numpy.array([None] * sectors, dtype=object)
+    res = {k: zero for k in (
+        'ls_green', 'ls_sen', 'S_green', 'S_sen', 'S_tot', 'w_green', 'w_sen',
+        'w_tot', 'ls_rolled', 'ls_rolled_green', 'ls_rolled_sen', 'd_rolled')}
+    res.update({k: none for k in (
+        'srb_green', 'srt_green', 'srb_sen', 'srt_sen')})
+    try:
+        ds = float(Lshape) / sectors
+        st = numpy.arange(1, sectors + 1) * ds
+        ls_vis = numpy.minimum(ds, numpy.maximum(0., st - s_limvis))
+    except TypeError:  # input is None
+        return _sector_list(res, sectors)
+    visible = ls_vis > 0
+    sb = st - ls_vis
+    st_green = numpy.minimum(st, numpy.maximum(sb, s_limsen))
+    ls_green = numpy.where(visible, st_green - sb, 0)
+    ls_sen = numpy.where(visible, st - st_green, 0)
+    res.update({'ls_green': ls_green, 'ls_sen': ls_sen})
+    # Compute area of elements
+    if leaves is not None:
+        green = ls_green > 0
+        sen = ls_sen > 0
+        if Lshape == 0:
+            Lshape = numpy.inf  # no visible sector, avoid division by zero
+        res['S_green'] = numpy.where(green, leaves.blade_elt_areas(
+            shape_key, Lshape, Lwshape, sb / Lshape, st_green / Lshape), 0)
+        res['w_green'] = numpy.where(green, leaves.blade_elt_widths(
+            shape_key, Lshape, Lwshape, sb / Lshape, st_green / Lshape), 0)
+        res['S_sen'] = numpy.where(sen, leaves.blade_elt_areas(
+            shape_key, Lshape, Lwshape, st_green / Lshape, st / Lshape), 0)
+        res['w_sen'] = numpy.where(sen, leaves.blade_elt_widths(
+            shape_key, Lshape, Lwshape, st_green / Lshape, st / Lshape), 0)
+        res['S_tot'] = res['S_green'] + res['S_sen']
+        res['w_tot'] = numpy.maximum(res['w_green'], res['w_sen'])
+    # compute position of flat parts of the element
+    ls_flat = numpy.minimum(ls_vis, numpy.maximum(0., st - s_limrolled))
+    flat = visible & (ls_flat > 0)
+    sb_flat = st - ls_flat
+    st_green_flat = numpy.minimum(st, numpy.maximum(sb_flat, s_limsen))
+    for k, v in (('srb_green', sb_flat), ('srt_green', st_green_flat),
+                 ('srb_sen', st_green_flat), ('srt_sen', st)):
+        res[k] = numpy.where(flat, (v - s_limvis) / lvis, none)
+    rolled = visible & (ls_flat < ls_vis)
+    ls_rolled = numpy.where(rolled, ls_vis - ls_flat, 0)
+    res['ls_rolled'] = ls_rolled
+    res['ls_rolled_green'] = numpy.minimum(ls_rolled, ls_green)
+    res['ls_rolled_sen'] = ls_rolled - res['ls_rolled_green']
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        res['d_rolled'] = numpy.where(rolled, res['S_tot'] * ls_rolled / ls_vis
+                                      / numpy.pi / ls_rolled, 0)
+    return _sector_list(res, sectors)
+
+
+def _sector_list(res, sectors):
+    """ convert a dict of per sector arrays to a list of per sector dicts of python scalars """
+    res = {k: v.tolist() for k, v in res.items()}
+    return [{k: v[i] for k, v in res.items()} for i in range(sectors)]
+
+
 def blade_elements(sectors, l, lvis, lrolled, lsen, Lshape, Lwshape, shape_key,
                    leaves, split=False):
     """ return parameters of blade elements (visible parts of the blade).
@@ -153,102 +221,37 @@ def blade_elements(sectors, l, lvis, lrolled, lsen, Lshape, Lwshape, shape_key,
     hidden_elt = {'label': 'HiddenElement', 'length': lhide, 'area': S_hide,
                   'is_green': True}
     elements = [hidden_elt]
-    ds = 0
-    if Lshape is not None:
-        ds = float(Lshape) / sectors
-    # compute sectors from leafshape bes to leaf shape top
     if lvis > 1e-6:
-        for isect in range(sectors):
-            ls_vis = 0
-            ls_rolled = 0
-            ls_rolled_green = 0
-            ls_rolled_sen = 0
-            d_rolled = 0
-            ls_green = 0
-            ls_sen = 0
-            S_green = 0
-            S_sen = 0
-            S_tot = 0
-            w_green = 0
-            w_sen = 0
-            w_tot = 0
-            srb_green = None
-            srt_green = None
-            srb_sen = None
-            srt_sen = None
-
-            try:
-                st = (isect + 1) * ds
-                ls_vis = min(ds, max(0., st - s_limvis))
-                if ls_vis > 0:
-                    sb = st - ls_vis
-                    sb_green = sb
-                    st_green = min(st, max(sb_green, s_limsen))
-                    sb_sen = st_green
-                    st_sen = st
-                    ls_green = st_green - sb_green
-                    ls_sen = st_sen - sb_sen
-                    # print(sb_green,st_green,st_sen)
-                    #
-                    # Compute area of elements
-                    if ls_green > 0 and leaves is not None:
-                        S_green = leaves.blade_elt_area(shape_key, Lshape,
-                                                        Lwshape,
-                                                        sb_green / Lshape,
-                                                        st_green / Lshape)
-                        w_green = leaves.blade_elt_width(shape_key, Lshape,
-                                                        Lwshape,
-                                                        sb_green / Lshape,
-                                                        st_green / Lshape)
-                    if ls_sen > 0 and leaves is not None:
-                        S_sen = leaves.blade_elt_area(shape_key, Lshape,
-                                                      Lwshape, sb_sen / Lshape,
-                                                      st_sen / Lshape)
-                        w_sen = leaves.blade_elt_width(shape_key, Lshape, Lwshape,
-                                                  sb_sen / Lshape,
-                                                  st_sen / Lshape)
-                    # made intergration again for avoiding fluctuations
-                    # S_tot = blade_elt_area(xysr_shape, Lshape, Lwshape, sb / Lshape, st / Lshape)
-                    S_tot = S_green + S_sen
-                    w_tot = max(w_green, w_sen)
-                    #
-                    # compute position of flat parts of the element
-                    ls_flat = min(ls_vis, max(0., st - s_limrolled))
-                    if ls_flat > 0:
-                        sb = st - ls_flat
-                        sb_green = sb
-                        st_green = min(st, max(sb_green, s_limsen))
-                        sb_sen = st_green
-                        st_sen = st
-                        srb_green = (float(sb_green) - s_limvis) / lvis
-                        srt_green = (float(st_green) - s_limvis) / lvis
-                        srb_sen = (float(sb_sen) - s_limvis) / lvis
-                        srt_sen = (float(st_sen) - s_limvis) / lvis
-                    # print(srb_green,srt_green,srb_sen,srt_sen)
-                    if ls_flat < ls_vis:
-                        ls_rolled = ls_vis - ls_flat
-                        ls_rolled_green = min(ls_rolled, ls_green)
-                        ls_rolled_sen = ls_rolled - ls_rolled_green
-                        S_rolled = S_tot * ls_rolled / ls_vis
-                        d_rolled = float(S_rolled) / numpy.pi / ls_rolled
-
-            except TypeError:  # input is None
-                #    print "passing"
-                pass
+        for isect, sector in enumerate(_blade_sectors(sectors, lvis, Lshape, Lwshape,
+                                                      s_limvis, s_limsen,
+                                                      s_limrolled, shape_key,
+                                                      leaves)):
             green_elt = {'label': 'LeafElement' + str(isect + 1) + 'g',
-                         'length': ls_green, 'area': S_green, 'is_green': True,
-                         'srb': srb_green, 'srt': srt_green,
-                         'lrolled': ls_rolled_green, 'd_rolled': d_rolled, 'width': w_green}
+                         'length': sector['ls_green'],
+                         'area': sector['S_green'], 'is_green': True,
+                         'srb': sector['srb_green'],
+                         'srt': sector['srt_green'],
+                         'lrolled': sector['ls_rolled_green'],
+                         'd_rolled': sector['d_rolled'],
+                         'width': sector['w_green']}
             sen_elt = {'label': 'LeafElement' + str(isect + 1) + 's',
-                       'length': ls_sen, 'area': S_sen, 'is_green': False,
-                       'srb': srb_sen, 'srt': srt_sen, 'lrolled': ls_rolled_sen,
-                       'd_rolled': d_rolled, 'width': w_sen}
+                       'length': sector['ls_sen'], 'area': sector['S_sen'],
+                       'is_green': False, 'srb': sector['srb_sen'],
+                       'srt': sector['srt_sen'],
+                       'lrolled': sector['ls_rolled_sen'],
+                       'd_rolled': sector['d_rolled'],
+                       'width': sector['w_sen']}
             elt = {'label': 'LeafElement' + str(isect + 1),
-                   'length': ls_sen + ls_green, 'area': S_tot,
-                   'green_length': ls_green, 'green_area': S_green,
-                   'senesced_length': ls_sen, 'senesced_area': S_sen,
-                   'is_green': (ls_green > ls_sen), 'srb': srb_green,
-                   'srt': srt_sen, 'lrolled': ls_rolled, 'd_rolled': d_rolled, 'width': w_tot}
+                   'length': sector['ls_sen'] + sector['ls_green'],
+                   'area': sector['S_tot'],
+                   'green_length': sector['ls_green'],
+                   'green_area': sector['S_green'],
+                   'senesced_length': sector['ls_sen'],
+                   'senesced_area': sector['S_sen'],
+                   'is_green': (sector['ls_green'] > sector['ls_sen']),
+                   'srb': sector['srb_green'], 'srt': sector['srt_sen'],
+                   'lrolled': sector['ls_rolled'],
+                   'd_rolled': sector['d_rolled'], 'width': sector['w_tot']}
             if split:
                 elements.extend([green_elt, sen_elt])
             else:
@@ -383,13 +386,167 @@ def get_component(components, index):
     return properties, elements
 
 
+def _new_vertex(add, properties, collect, *args, **kwds):
+    """ add a vertex with g.add_component/g.add_child (add). If collect is a
+    list, (vid, properties) is appended to it instead of passing properties
+    to add, for a later bulk update (see set_vertex_properties)
+    """
+    if collect is None:
+        kwds.update(properties)
+        return add(*args, **kwds)
+    vid = add(*args, **kwds)
+    collect.append((vid, properties))
+    return vid
+
+
+def set_vertex_properties(g, collected):
+    """ set properties of vertices in bulk from a list of (vid, properties) """
+    columns = {}
+    for vid, properties in collected:
+        for k, v in properties.items():
+            columns.setdefault(k, {})[vid] = v
+    props = g.properties()
+    for k, values in columns.items():
+        if k not in props:
+            g.add_property(k)
+        props[k].update(values)
+
+
+def add_components(g, vid_metamer, components, anchor_node=None,
+                   anchor_element=None, edge_type='<', collect=None):
+    """ Add metamer components (organs and their elements) to vid_metamer.
+
+    First organ and first element are connected to anchor_node and
+    anchor_element (if any) with edge_type.
+    If collect is a list, vertex properties are appended to it rather than set.
+    Returns the vids of the first organ (the internode) and of its last element
+    """
+    # deals with first component (internode) and first element
+    node, elements = get_component(components, 0)
+    element = elements[0]
+    vid_node = _new_vertex(g.add_component, node, collect, vid_metamer,
+                           edge_type='/')
+    vid_elt = _new_vertex(g.add_component, element, collect, vid_node,
+                          edge_type='/')
+    if anchor_node is not None:
+        vid_node = g.add_child(anchor_node, child=vid_node,
+                               edge_type=edge_type)
+        vid_elt = g.add_child(anchor_element, child=vid_elt,
+                              edge_type=edge_type)
+    # add other elements of first component (the internode)
+    for i in range(1, len(elements)):
+        element = elements[i]
+        vid_elt = _new_vertex(g.add_child, element, collect, vid_elt,
+                              edge_type='<')
+    vid_topstem_node = vid_node
+    vid_topstem_element = vid_elt  # last element of internode
+
+    # add other components
+    for i in range(1, len(components)):
+        node, elements = get_component(components, i)
+        vid_node, vid_elt = _add_organ(g, vid_node, vid_elt, node, elements,
+                                       collect)
+    return vid_topstem_node, vid_topstem_element
+
+
+def _add_organ(g, vid_node, vid_elt, node, elements, collect=None):
+    """ Add an organ and its elements after organ vid_node / element vid_elt
+    """
+    if node['label'] == 'sheath':
+        edge_type = '+'
+    else:
+        edge_type = '<'
+    vid_node = _new_vertex(g.add_child, node, collect, vid_node,
+                           edge_type=edge_type)
+    element = elements[0]
+    new_elt = _new_vertex(g.add_component, element, collect, vid_node,
+                          edge_type='/')
+    vid_elt = g.add_child(vid_elt, child=new_elt, edge_type=edge_type)
+    for j in range(1, len(elements)):
+        element = elements[j]
+        vid_elt = _new_vertex(g.add_child, element, collect, vid_elt,
+                              edge_type='<')
+    return vid_node, vid_elt
+
+
+def _leaves_db(leaves):
+    """ returns {species: Leaves} and {species: is_dynamic} dicts """
+    if leaves is None:
+        dynamic_leaf_db = {0: False}
+        leaves = {0: None}
+    else:
+        dynamic_leaf_db = {k: leaves[k].dynamic for k in leaves}
+    return leaves, dynamic_leaf_db
+
+
+def metamer_components(args, species=0, leaves=None, dynamic_leaf_db=None,
+                       metamer_factory=adel_metamer, leaf_sectors=1,
+                       add_elongation=False, split=False,
+                       aborting_tiller_reduction=1.0):
+    """ Compute the components of a metamer from a row of the canopy table.
+
+    args is the dict of row parameters, leaves and dynamic_leaf_db are
+    {species: value} dicts.
+    Returns the list of components and the properties left to the metamer
+    """
+    if leaves is None or dynamic_leaf_db is None:
+        leaves, dynamic_leaf_db = _leaves_db(leaves)
+    components = []
+    if metamer_factory:
+        xysr_key = None
+        if leaves[species] is not None and 'LcType' in args and 'LcIndex' in args:
+            lctype = int(args['LcType'])
+            lcindex = int(args['LcIndex'])
+            if lctype != -999 and lcindex != -999:
+                age = None
+                if dynamic_leaf_db[species]:
+                    age = float(args[
+                                    'rph']) - 0.3  # age_db = HS - rank + 1 = ph - 1.3 - rank +1 = rph - .3
+                    if age != 'NA':
+                        age = max(0, int(float(age)))
+                xysr_key = leaves[species].get_leaf_key(lctype, lcindex,
+                                                        age)
+
+        elongation = None
+        if add_elongation:
+            startleaf = -.4
+            endleaf = 1.6
+            stemleaf = 1.2
+            startE = endleaf
+            endE = startE + (endleaf - startleaf) / stemleaf
+            endBlade = endleaf
+            if args['Gl'] > 0:
+                endBlade = args['Ll'] / args['Gl'] * (endleaf - startleaf)
+            elongation = {'startleaf': startleaf, 'endBlade': endBlade,
+                          'endleaf': endleaf, 'endE': endE}
+        if not 'ntop' in args:
+            args.update({'ntop': None})
+        if not 'Gd' in args:
+            args.update({'Gd': 0.19})
+        args.update({'split': split})
+        
+        hs_f = args.get('HS_final')
+        if hs_f != 'NA':
+            if float(hs_f) < args.get('nff'):
+                for what in (
+                'Ll', 'Lv', 'Lr', 'Lsen', 'L_shape', 'Lw_shape', 'Gl', 'Gv',
+                'Gsen', 'Gd', 'El', 'Ev', 'Esen', 'Ed'):
+                    args.update(
+                        {what: args.get(what) * aborting_tiller_reduction})
+        components = metamer_factory(Lsect=leaf_sectors, shape_key=xysr_key,
+                                     elongation=elongation,
+                                     leaves=leaves[species], **args)
+        args = {'L_shape': args.get('L_shape')}
+    return components, args
+
+
 def mtg_factory(parameters, metamer_factory=adel_metamer, leaf_sectors=1,
                 leaves=None, stand=None, axis_dynamics=None,
                 add_elongation=False, topology=['plant', 'axe_id', 'numphy'],
                 split=False, aborting_tiller_reduction=1.0, leaf_db=None):
     """ Construct a MTG from a dictionary of parameters.
 
-    The dictionary contains the parameters of all metamers in the stand (topology + properties).
+    The dictionary (or DataFrame) of columns contains the parameters of all metamers in the stand (topology + properties).
     metamer_factory is a function that build metamer properties and metamer elements from parameters dict.
     leaf_sectors is an integer giving the number of LeafElements per Leaf blade
     leaves is a {species:adel.geometric_elements.Leaves} dict
@@ -406,46 +563,43 @@ def mtg_factory(parameters, metamer_factory=adel_metamer, leaf_sectors=1,
         raise AdelDeprecationError(
             'leaf_db argument is deprecated, use leaves argument instead')
 
-    if leaves is None:
-        dynamic_leaf_db = {0: False}
-        leaves = {0: None}
-    else:
-        dynamic_leaf_db = {k: leaves[k].dynamic for k in leaves}
+    leaves, dynamic_leaf_db = _leaves_db(leaves)
+
+    if isinstance(parameters, pandas.DataFrame):
+        parameters = {k: parameters[k].values for k in parameters}
+    dp = parameters
+    nrow = len(dp['plant'])
+    # topology as columns
+    plants = numpy.asarray(dp[topology[0]]).astype(float).astype(int)
+    axes = numpy.asarray(dp[topology[1]])
+    num_metamers = numpy.asarray(dp[topology[2]]).astype(float).astype(int)
+    ms_insertions = numpy.asarray(dp['ms_insertion']).astype(float).astype(int)
+    assert numpy.all(num_metamers > 0)
+    new_plant = numpy.ones(nrow, dtype=bool)
+    new_plant[1:] = plants[1:] != plants[:-1]
+    new_plant[:1] = plants[:1] != 0
+    new_axe = new_plant.copy()
+    new_axe[1:] |= axes[1:] != axes[:-1]
+    # rows as dict of properties (all columns but topology)
+    keys = [k for k in dp if k not in topology]
+    rows = (dict(zip(keys, values)) for values in zip(*[dp[k] for k in keys]))
 
     g = MTG()
+    # (vid, properties) of all vertices, set in bulk at the end
+    collected = []
 
-    # buffers
-    # for detection of newplant/newaxe
-    prev_plant = 0
-    prev_axe = -1
-    # current vid
-    vid_plant = -1
-    vid_axe = -1
-    vid_metamer = -1
-    vid_node = -1
-    vid_elt = -1
-    # vid of top of stem nodes and elements
-    vid_topstem_node = -1
-    vid_topstem_element = -1
-    # vid of plant main stem (axe0)
-    vid_main_stem = -1
-    # buffer for the vid of main stem anchor points for the first metamer, node and element of tillers
+    # vid of main stem anchor points for the first metamer, node and element of tillers
     metamers = []
     nodes = []
     elts = []
 
-    dp = parameters
-    nrow = len(dp['plant'])
-
-    for i in range(nrow):
-        plant, num_metamer = [int(convert(dp.get(x)[i], undef=None)) for x in
-                              [topology[e] for e in [0, 2]]]
-        axe = dp.get(topology[1])[i]
-        mspos = int(convert(dp.get('ms_insertion')[i], undef=None))
-        args = properties_from_dict(dp, i, exclude=topology)
+    for i, args in enumerate(rows):
+        plant = plants[i]
+        num_metamer = num_metamers[i]
+        axe = axes[i]
+        mspos = ms_insertions[i]
         # Add plant if new
-        if plant != prev_plant:
-            label = 'plant' + str(plant)
+        if new_plant[i]:
             position = (0, 0, 0)
             azimuth = 0
             species = 0
@@ -453,104 +607,52 @@ def mtg_factory(parameters, metamer_factory=adel_metamer, leaf_sectors=1,
                 species = args['species']
             if stand and len(stand) >= plant:
                 position, azimuth = stand[plant - 1]
-            vid_plant = g.add_component(g.root, label=label, edge_type='/',
-                                        position=position, azimuth=azimuth,
-                                        refplant_id=args.get('refplant_id'),
-                                        species=species)
-            # reset buffers
-            prev_axe = -1
-            vid_axe = -1
-            vid_metamer = -1
-            vid_node = -1
-            vid_elt = -1
+            vid_plant = _new_vertex(g.add_component,
+                                    {'label': 'plant' + str(plant),
+                                     'position': position, 'azimuth': azimuth,
+                                     'refplant_id': args.get('refplant_id'),
+                                     'species': species},
+                                    collected, g.root, edge_type='/')
             vid_topstem_node = -1
             vid_topstem_element = -1
-            vid_main_stem = -1
             metamers = []
             nodes = []
             elts = []
 
         # Add axis
-        if axe != prev_axe:
-            label = ''.join(axe.split('.'))
+        if new_axe[i]:
             timetable = None
             if axis_dynamics:
                 timetable = axis_dynamics[str(plant)][str(axe)]
+            properties = {'label': ''.join(axe.split('.')),
+                          'timetable': timetable,
+                          'HS_final': args.get('HS_final'),
+                          'nff': args.get('nff'),
+                          'hasEar': args.get('hasEar'),
+                          'azimuth': args.get('az_insertion')}
             if axe == 'MS':
-                vid_axe = g.add_component(vid_plant, edge_type='/', label=label,
-                                          timetable=timetable,
-                                          HS_final=args.get('HS_final'),
-                                          nff=args.get('nff'),
-                                          hasEar=args.get('hasEar'),
-                                          azimuth=args.get('az_insertion'))
+                vid_axe = _new_vertex(g.add_component, properties, collected,
+                                      vid_plant, edge_type='/')
                 vid_main_stem = vid_axe
             else:
-                vid_axe = g.add_child(vid_main_stem, edge_type='+', label=label,
-                                      timetable=timetable,
-                                      HS_final=args.get('HS_final'),
-                                      nff=args.get('nff'),
-                                      hasEar=args.get('hasEar'),
-                                      azimuth=args.get('az_insertion'))
+                vid_axe = _new_vertex(g.add_child, properties, collected,
+                                      vid_main_stem, edge_type='+')
 
         # Add metamer
-        assert num_metamer > 0
         # args are added to metamers only if metamer_factory is none, otherwise compute metamer components
-        components = []
-        if metamer_factory:
-            xysr_key = None
-            if leaves[species] is not None and 'LcType' in args and 'LcIndex' in args:
-                lctype = int(args['LcType'])
-                lcindex = int(args['LcIndex'])
-                if lctype != -999 and lcindex != -999:
-                    age = None
-                    if dynamic_leaf_db[species]:
-                        age = float(args[
-                                        'rph']) - 0.3  # age_db = HS - rank + 1 = ph - 1.3 - rank +1 = rph - .3
-                        if age != 'NA':
-                            age = max(0, int(float(age)))
-                    xysr_key = leaves[species].get_leaf_key(lctype, lcindex,
-                                                            age)
-
-            elongation = None
-            if add_elongation:
-                startleaf = -.4
-                endleaf = 1.6
-                stemleaf = 1.2
-                startE = endleaf
-                endE = startE + (endleaf - startleaf) / stemleaf
-                endBlade = endleaf
-                if args['Gl'] > 0:
-                    endBlade = args['Ll'] / args['Gl'] * (endleaf - startleaf)
-                elongation = {'startleaf': startleaf, 'endBlade': endBlade,
-                              'endleaf': endleaf, 'endE': endE}
-            if not 'ntop' in args:
-                args.update({'ntop': None})
-            if not 'Gd' in args:
-                args.update({'Gd': 0.19})
-            args.update({'split': split})
-            
-            hs_f = args.get('HS_final')
-            if hs_f != 'NA':
-                if float(hs_f) < args.get('nff'):
-                    for what in (
-                    'Ll', 'Lv', 'Lr', 'Lsen', 'L_shape', 'Lw_shape', 'Gl', 'Gv',
-                    'Gsen', 'Gd', 'El', 'Ev', 'Esen', 'Ed'):
-                        args.update(
-                            {what: args.get(what) * aborting_tiller_reduction})
-            components = metamer_factory(Lsect=leaf_sectors, shape_key=xysr_key,
-                                         elongation=elongation,
-                                         leaves=leaves[species], **args)
-            args = {'L_shape': args.get('L_shape')}
-        #
-        label = 'metamer' + str(num_metamer)
-        new_metamer = g.add_component(vid_axe, edge_type='/', label=label,
-                                      **args)
+        components, args = metamer_components(
+            args, species=species, leaves=leaves,
+            dynamic_leaf_db=dynamic_leaf_db, metamer_factory=metamer_factory,
+            leaf_sectors=leaf_sectors, add_elongation=add_elongation,
+            split=split, aborting_tiller_reduction=aborting_tiller_reduction)
+        args['label'] = 'metamer' + str(num_metamer)
+        new_metamer = _new_vertex(g.add_component, args, collected, vid_axe,
+                                  edge_type='/')
         if axe == 'MS' and num_metamer == 1:
             vid_metamer = new_metamer
         elif num_metamer == 1:
             # add the edge with the bearing metamer on main stem
-            vid_metamer = metamers[mspos - 1]
-            vid_metamer = g.add_child(vid_metamer, child=new_metamer,
+            vid_metamer = g.add_child(metamers[mspos - 1], child=new_metamer,
                                       edge_type='+')
         else:
             vid_metamer = g.add_child(vid_metamer, child=new_metamer,
@@ -558,55 +660,202 @@ def mtg_factory(parameters, metamer_factory=adel_metamer, leaf_sectors=1,
 
         # add metamer components, if any           
         if len(components) > 0:
-            # deals with first component (internode) and first element 
-            node, elements = get_component(components, 0)
-            element = elements[0]
-            new_node = g.add_component(vid_metamer, edge_type='/', **node)
-            new_elt = g.add_component(new_node, edge_type='/', **element)
             if axe == 'MS' and num_metamer == 1:  # root of main stem
-                vid_node = new_node
-                vid_elt = new_elt
+                anchors = (None, None, '<')
             elif num_metamer == 1:  # root of tiller
-                vid_node = nodes[mspos - 1]
-                vid_node = g.add_child(vid_node, child=new_node, edge_type='+')
-                vid_elt = elts[mspos - 1]
-                vid_elt = g.add_child(vid_elt, child=new_elt, edge_type='+')
+                anchors = (nodes[mspos - 1], elts[mspos - 1], '+')
             else:
-                vid_node = g.add_child(vid_topstem_node, child=new_node,
-                                       edge_type='<')
-                vid_elt = g.add_child(vid_topstem_element, child=new_elt,
-                                      edge_type='<')
-            # add other elements of first component (the internode)
-            for i in range(1, len(elements)):
-                element = elements[i]
-                vid_elt = g.add_child(vid_elt, edge_type='<', **element)
-            vid_topstem_node = vid_node
-            vid_topstem_element = vid_elt  # last element of internode
-
-            # add other components   
-            for i in range(1, len(components)):
-                node, elements = get_component(components, i)
-                if node['label'] == 'sheath':
-                    edge_type = '+'
-                else:
-                    edge_type = '<'
-                vid_node = g.add_child(vid_node, edge_type=edge_type, **node)
-                element = elements[0]
-                new_elt = g.add_component(vid_node, edge_type='/', **element)
-                vid_elt = g.add_child(vid_elt, child=new_elt,
-                                      edge_type=edge_type)
-                for j in range(1, len(elements)):
-                    element = elements[j]
-                    vid_elt = g.add_child(vid_elt, edge_type='<', **element)
-
-                    # update buffers
+                anchors = (vid_topstem_node, vid_topstem_element, '<')
+            vid_topstem_node, vid_topstem_element = add_components(
+                g, vid_metamer, components, *anchors, collect=collected)
+
+        # update buffers
         if axe == 'MS':
             metamers.append(vid_metamer)
             if len(components) > 0:
                 nodes.append(vid_topstem_node)
                 elts.append(vid_topstem_element)
-        prev_plant = plant
-        prev_axe = axe
+
+    set_vertex_properties(g, collected)
+    return fat_mtg(g)
+
+
+def _set_properties(g, vid, properties):
+    """ set properties of vid, adding missing properties to g """
+    props = g.properties()
+    for k, v in properties.items():
+        if k not in props:
+            g.add_property(k)
+        props[k][vid] = v
+
+
+def _set_to_zero(g, vids):
+    """ set length-like and area-like properties of vids to zero """
+    props = g.properties()
+    zeroed = [k for k in ('length', 'visible_length', 'senesced_length',
+                          'green_length', 'rolled_length', 'area',
+                          'green_area', 'senesced_area') if k in props]
+    for vid in vids:
+        for k in zeroed:
+            if vid in props[k]:
+                props[k][vid] = 0
+
+
+def _metamer_anchors(g, bearer, edge_type):
+    """ anchors (node, element, edge_type) of the first organ of a metamer
+    borne by metamer bearer, as in mtg_factory: the internode of the bearer
+    and its last element """
+    if bearer is not None:
+        organs = g.components(bearer)
+        if len(organs) > 0:
+            internode = organs[0]
+            return internode, g.components(internode)[-1], edge_type
+    return None, None, '<'
+
+
+def _append_element(g, vid_elt, element):
+    """ add element after vid_elt, the last element of an organ. Elements of
+    other organs connected to vid_elt are moved to the new element """
+    successors = g.children(vid_elt)
+    new_elt = g.add_child(vid_elt, edge_type='<', **element)
+    for vid in successors:
+        g.replace_parent(vid, new_elt)
+    return new_elt
+
+
+def _update_components(g, vid_metamer, components, anchors):
+    """ update in place the organs and elements of vid_metamer. anchors are
+    used to connect the first organ if the metamer had no organ yet """
+    organs = {g.label(vid): vid for vid in g.components(vid_metamer)}
+    if len(organs) == 0:
+        add_components(g, vid_metamer, components, *anchors)
+        return
+    vid_node, vid_elt = None, None
+    for i in range(len(components)):
+        node, elements = get_component(components, i)
+        if node['label'] not in organs:
+            vid_node, vid_elt = _add_organ(g, vid_node, vid_elt, node,
+                                           elements)
+            continue
+        vid_node = organs[node['label']]
+        _set_properties(g, vid_node, node)
+        elts = g.components(vid_node)
+        for j, element in enumerate(elements):
+            if j < len(elts):
+                vid_elt = elts[j]
+                _set_properties(g, vid_elt, element)
+            else:
+                vid_elt = _append_element(g, vid_elt, element)
+        if len(elts) > len(elements):
+            _set_to_zero(g, elts[len(elements):])
+            vid_elt = elts[-1]
+
+
+def mtg_grow(g, parameters, metamer_factory=adel_metamer, leaf_sectors=1,
+             leaves=None, stand=None, axis_dynamics=None,
+             add_elongation=False, topology=['plant', 'axe_id', 'numphy'],
+             split=False, aborting_tiller_reduction=1.0):
+    """ Update in place a MTG built by mtg_factory with a new canopy table.
+
+    Existing plants, axes and metamers (matched by label) are updated, new ones
+    are added with the same topology as in mtg_factory, and metamers absent
+    from parameters are given a zero length and area. Properties not computed
+    by metamer_factory (eg set by other models) are left untouched.
+    Other arguments are the same as for mtg_factory.
+    Returns g
+    """
+    leaves, dynamic_leaf_db = _leaves_db(leaves)
+
+    # index of existing vertices
+    plants = {g.label(vid): vid for vid in g.vertices(scale=1)}
+    axes = {}
+    metamers = {}
+    for vid_plant in plants.values():
+        for vid_axe in g.components(vid_plant):
+            axes[(vid_plant, g.label(vid_axe))] = vid_axe
+            for vid_metamer in g.components(vid_axe):
+                metamers[(vid_axe, g.label(vid_metamer))] = vid_metamer
+    updated = set()
+
+    dp = parameters
+    nrow = len(dp['plant'])
+
+    for i in range(nrow):
+        plant, num_metamer = [int(convert(dp.get(x)[i], undef=None)) for x in
+                              [topology[e] for e in [0, 2]]]
+        axe = dp.get(topology[1])[i]
+        mspos = int(convert(dp.get('ms_insertion')[i], undef=None))
+        args = properties_from_dict(dp, i, exclude=topology)
+        # plant
+        label = 'plant' + str(plant)
+        if label not in plants:
+            position = (0, 0, 0)
+            azimuth = 0
+            if stand and len(stand) >= plant:
+                position, azimuth = stand[plant - 1]
+            plants[label] = g.add_component(g.root, label=label,
+                                            edge_type='/', position=position,
+                                            azimuth=azimuth,
+                                            refplant_id=args.get('refplant_id'),
+                                            species=args.get('species', 0))
+        vid_plant = plants[label]
+        species = g.property('species').get(vid_plant, 0)
+        # axis
+        label = ''.join(axe.split('.'))
+        timetable = None
+        if axis_dynamics:
+            timetable = axis_dynamics[str(plant)][str(axe)]
+        axe_properties = {'timetable': timetable,
+                          'HS_final': args.get('HS_final'),
+                          'nff': args.get('nff'),
+                          'hasEar': args.get('hasEar'),
+                          'azimuth': args.get('az_insertion')}
+        if (vid_plant, label) in axes:
+            vid_axe = axes[(vid_plant, label)]
+            _set_properties(g, vid_axe, axe_properties)
+        elif axe == 'MS':
+            vid_axe = g.add_component(vid_plant, edge_type='/', label=label,
+                                      **axe_properties)
+        else:
+            vid_axe = g.add_child(axes[(vid_plant, 'MS')], edge_type='+',
+                                  label=label, **axe_properties)
+        axes[(vid_plant, label)] = vid_axe
+        # metamer
+        assert num_metamer > 0
+        components, args = metamer_components(
+            args, species=species, leaves=leaves,
+            dynamic_leaf_db=dynamic_leaf_db, metamer_factory=metamer_factory,
+            leaf_sectors=leaf_sectors, add_elongation=add_elongation,
+            split=split, aborting_tiller_reduction=aborting_tiller_reduction)
+        label = 'metamer' + str(num_metamer)
+        if num_metamer == 1:
+            # first metamer of a tiller is borne by a main stem metamer
+            vid_axe_ms = axes[(vid_plant, 'MS')]
+            bearer = metamers.get((vid_axe_ms, 'metamer' + str(mspos)))
+            edge_type = '+'
+        else:
+            bearer = metamers.get((vid_axe, 'metamer' + str(num_metamer - 1)))
+            edge_type = '<'
+        if (vid_axe, label) in metamers:
+            vid_metamer = metamers[(vid_axe, label)]
+            _set_properties(g, vid_metamer, args)
+            if len(components) > 0:
+                _update_components(g, vid_metamer, components,
+                                   _metamer_anchors(g, bearer, edge_type))
+        else:
+            vid_metamer = g.add_component(vid_axe, edge_type='/',
+                                          label=label, **args)
+            if bearer is not None:
+                g.add_child(bearer, child=vid_metamer, edge_type=edge_type)
+            if len(components) > 0:
+                add_components(g, vid_metamer, components,
+                               *_metamer_anchors(g, bearer, edge_type))
+            metamers[(vid_axe, label)] = vid_metamer
+        updated.add(vid_metamer)
+
+    for vid_metamer in set(metamers.values()) - updated:
+        for organ in g.components(vid_metamer):
+            _set_to_zero(g, [organ] + list(g.components(organ)))
 
     return fat_mtg(g)
 
@@ -851,39 +1100,50 @@ def move_properties(g_source, g_dest, filter_length=True, cleanup_source=True):
 
 def exposed_areas(g):
     """ returns a Dataframe with all exposed (visible) areas of elements in g """
-    data = {}
     what = ('length', 'area', 'green_length', 'green_area', 'senesced_length',
             'senesced_area')
-    for vid in g.vertices_iter(scale=g.max_scale()):
-        n = g.node(vid)
-        if n.length > 0 and not n.label.startswith('Hidden'):
-            organ = n.complex()
-            metamer = organ.complex()
-            axe = metamer.complex()
-            plant = axe.complex()
-            numphy = int(''.join(list(metamer.label)[7:]))
-            nf = axe.nff
-            node_data = {
-                'plant': plant.label,
-                'axe': axe.label,
-                'metamer': numphy,
-                'organ': organ.label,
-                'vid': vid,
-                'ntop': nf - numphy + 1,
-                'element': n.label,
-                'refplant_id': plant.refplant_id,
-                'nff': nf,
-                'HS_final': axe.HS_final,
-                'L_shape': metamer.L_shape
-            }
-            properties = n.properties()
-            node_data.update({k: properties[k] for k in what})
-            if 'species' in plant.properties():
-                node_data.update({'species': plant.species})
-            else:
-                node_data.update({'species': 0})
-            data[vid] = node_data
-    df = pandas.DataFrame(data).T
+    label = g.property('label')
+    length = g.property('length')
+    vids = [vid for vid in g.vertices_iter(scale=g.max_scale()) if
+            (length.get(vid) or 0) > 0 and not label[vid].startswith('Hidden')]
+    # complex of elements, organs, metamers and axes, resolved once per complex
+    complex_of = {}
+
+    def _complexes(vids):
+        res = []
+        for vid in vids:
+            if vid not in complex_of:
+                complex_of[vid] = g.complex(vid)
+            res.append(complex_of[vid])
+        return res
+
+    organs = _complexes(vids)
+    metamers = _complexes(organs)
+    axes = _complexes(metamers)
+    plants = _complexes(axes)
+    numphy = numpy.array([int(label[m][7:]) for m in metamers], dtype=int)
+    nff = g.property('nff')
+    nf = pandas.Series([nff.get(a) for a in axes], dtype=object).infer_objects()
+    species = g.property('species')
+    refplant_id = g.property('refplant_id')
+    HS_final = g.property('HS_final')
+    L_shape = g.property('L_shape')
+    data = {'plant': [label[p] for p in plants],
+            'axe': [label[a] for a in axes],
+            'metamer': numphy,
+            'organ': [label[o] for o in organs],
+            'vid': numpy.array(vids, dtype=int),
+            'ntop': (nf - numphy + 1).values,
+            'element': [label[v] for v in vids],
+            'refplant_id': [refplant_id.get(p) for p in plants],
+            'nff': nf.values,
+            'HS_final': [HS_final.get(a) for a in axes],
+            'L_shape': [L_shape.get(m) for m in metamers]}
+    for k in what:
+        prop = g.property(k)
+        data[k] = [prop.get(v) for v in vids]
+    data['species'] = [species.get(p, 0) for p in plants]
+    df = pandas.DataFrame(data, index=vids).infer_objects()
     # hack
     df['d_basecol'] = 0
     return df
@@ -893,42 +1153,40 @@ def exposed_areas2canS(exposed_areas):
     """ adaptor to convert new adel output to old adel output (canS-like) dataframe """
     d = exposed_areas
     if len(d) > 0:
-        grouped = d.groupby(['species', 'plant', 'axe', 'metamer'],
-                            group_keys=False)
-
-
-        def _metamer(sub):
-            met = {'species': sub.species.values[0],
-                   'plant': sub.plant.values[0],
-                   'refplant_id': sub.refplant_id.values[0],
-                   'axe_id': sub.axe.values[0],
-                   'nff': sub.nff.values[0],
-                   'HS_final': sub.HS_final.values[0],
-                   'numphy': sub.metamer.values[0],
-                   'ntop': sub.ntop.values[0],
-                   'L_shape': sub.L_shape.values[0],
-                   'Lv': sub[sub.organ == 'blade'].length.sum(),
-                   'Lvgreen': sub[sub.organ == 'blade'].green_length.sum(),
-                   'Lvsen': sub[sub.organ == 'blade'].senesced_length.sum(),
-                   'Slv': sub[sub.organ == 'blade'].area.sum(),
-                   'Slvgreen': sub[sub.organ == 'blade'].green_area.sum(),
-                   'Slvsen': sub[sub.organ == 'blade'].senesced_area.sum(),
-                   'Gv': sub[sub.organ == 'sheath'].length.sum(),
-                   'Gvgreen': sub[sub.organ == 'sheath'].green_length.sum(),
-                   'Gvsen': sub[sub.organ == 'sheath'].senesced_length.sum(),
-                   'SGv': sub[sub.organ == 'sheath'].area.sum(),
-                   'SGvgreen': sub[sub.organ == 'sheath'].green_area.sum(),
-                   'SGvsen': sub[sub.organ == 'sheath'].senesced_area.sum(),
-                   'Ev': sub[sub.organ == 'internode'].length.sum(),
-                   'Evgreen': sub[sub.organ == 'internode'].green_length.sum(),
-                   'Evsen': sub[sub.organ == 'internode'].senesced_length.sum(),
-                   'SEv': sub[sub.organ == 'internode'].area.sum(),
-                   'SEvgreen': sub[sub.organ == 'internode'].green_area.sum(),
-                   'SEvsen': sub[sub.organ == 'internode'].senesced_area.sum()
-                   }
-            return pandas.DataFrame(met, index=[sub.index[0]])
-
-        d = grouped.apply(_metamer)
+        grouped = d.groupby(['species', 'plant', 'axe', 'metamer'])
+        group = grouped.ngroup().values
+        rank = grouped.cumcount().values
+        keep = group >= 0  # rows with undefined keys are dropped by groupby
+        d, group, rank = d[keep], group[keep], rank[keep]
+        # first row of each metamer, in group order
+        first = rank == 0
+        first = d[first].iloc[numpy.argsort(group[first], kind='stable')]
+        met = pandas.DataFrame({'species': first.species.values,
+                                'plant': first.plant.values,
+                                'refplant_id': first.refplant_id.values,
+                                'axe_id': first.axe.values,
+                                'nff': first.nff.values,
+                                'HS_final': first.HS_final.values,
+                                'numphy': first.metamer.values,
+                                'ntop': first.ntop.values,
+                                'L_shape': first.L_shape.values},
+                               index=first.index)
+        # sums per organ type
+        sums = {}
+        for organ, (lv, sv) in (('blade', ('Lv', 'Slv')),
+                                ('sheath', ('Gv', 'SGv')),
+                                ('internode', ('Ev', 'SEv'))):
+            is_organ = (d.organ == organ).values
+            for col, name in (('length', lv), ('green_length', lv + 'green'),
+                              ('senesced_length', lv + 'sen'),
+                              ('area', sv), ('green_area', sv + 'green'),
+                              ('senesced_area', sv + 'sen')):
+                values = pandas.to_numeric(d[col]).values
+                sums[name] = numpy.where(is_organ, values, 0)
+        sums = pandas.DataFrame(sums).groupby(group).sum()
+        for name in sums:
+            met[name] = sums[name].values
+        d = met
         # hack
         d['d_basecol'] = 0
     return d
@@ -14,6 +14,7 @@
 #       OpenAlea WebSite : http://openalea.gforge.inria.fr
 #
 ###############################################################################
+import os
 import numpy as np
 import pandas as pd
 import warnings
@@ -220,6 +221,11 @@ def aggregate_adel_output(adel_output_df, by=('TT', 'species', 'plant', 'axe_id'
     return adel_output_aggregated_df.reindex(column_names, axis=1)
             
     
+def _group_sum(values, groups, ngroups):
+    """ sum of values (nan being ignored) per group """
+    return np.bincount(groups, weights=np.nan_to_num(values, nan=0.0), minlength=ngroups)
+
+
 def phenology(adel_output_df):
     '''
     Calculate the phenology from the output of Adel.
@@ -236,71 +242,68 @@ def phenology(adel_output_df):
         pandas.DataFrame
  
     '''
-    
-    phenology_list = []
-    
-    for name, group in adel_output_df.groupby(['TT', 'species', 'plant', 'axe_id'], as_index=False):
-        TT, species, plant, axe_id = name
-        L_shape = group['L_shape']
-        indexes_of_vegetative_phytomers = group[group['numphy'] <= group['nff']].index
-        NFF = indexes_of_vegetative_phytomers.size
-        NFF = group['nff'].values[0]
-        # HS
-        indexes_of_all_non_null_Lv = group['Lv'][group['Lv'] != 0].index
-        NFV = len(indexes_of_all_non_null_Lv)
-        Lv_non_null_series = group['Lv'][indexes_of_vegetative_phytomers][indexes_of_all_non_null_Lv]
-        if len(Lv_non_null_series) == 0:
-            HS = 0.0
-            NFL = 0.0
-            d_base_lastcol = np.nan
-        else:
-            Lv_equal_L_shape_series = Lv_non_null_series[Lv_non_null_series == L_shape[indexes_of_all_non_null_Lv]]
-            if Lv_equal_L_shape_series.index.size == 0:
-                HS_indexes = Lv_non_null_series.index
-                NFL = 0.0
-                d_base_lastcol = np.nan
-            else:
-                index_of_last_Lv_equal_L_shape = Lv_equal_L_shape_series.index[-1]
-                index_of_first_Lv_not_equal_L_shape = index_of_last_Lv_equal_L_shape + 1
-                index_of_last_Lv_non_null = Lv_non_null_series.index[-1]
-                HS_indexes = list(range(index_of_first_Lv_not_equal_L_shape, index_of_last_Lv_non_null + 1))
-                NFL = group['numphy'][index_of_last_Lv_equal_L_shape]
-                d_base_lastcol = group['d_basecol'][index_of_last_Lv_equal_L_shape]
-            HS = NFL + \
-                 (Lv_non_null_series.loc[Lv_non_null_series.index.isin(HS_indexes)] /
-                  L_shape.loc[L_shape.index.isin(HS_indexes)].astype(float)) \
-                 .sum()
-        indexes_of_all_non_null_Lsen = group['Lvsen'][group['Lvsen'] != 0].index
-        Lsen_non_null_series = group['Lvsen'][indexes_of_vegetative_phytomers][indexes_of_all_non_null_Lsen]
-        Lsen_equal_L_shape_series = Lsen_non_null_series[Lsen_non_null_series == L_shape[indexes_of_all_non_null_Lsen]]
+    keys = ['TT', 'species', 'plant', 'axe_id']
+    grouped = adel_output_df.groupby(keys)
+    groups = grouped.ngroup().values
+    # rows sorted by group, keeping table order within groups
+    order = np.argsort(groups, kind='stable')
+    order = order[groups[order] >= 0]
+    df = adel_output_df.iloc[order]
+    groups = groups[order]
+    ngroups = grouped.ngroups
+    labels = df.index.values
+    position = np.arange(len(df))
+    first = np.ones(len(df), dtype=bool)
+    first[1:] = groups[1:] != groups[:-1]
+    first_rows = df[first]
+
+    numphy = df['numphy'].values
+    Lv = df['Lv'].values
+    Lvsen = df['Lvsen'].values
+    L_shape = df['L_shape'].values
+    # HS
+    NFV = np.bincount(groups, weights=(Lv != 0), minlength=ngroups).astype(int)
+    visible = (numphy <= df['nff'].values) & (Lv != 0)
+    has_visible = np.bincount(groups, weights=visible, minlength=ngroups) > 0
+    # last visible leaf with its mature length (ligulated)
+    ligulated = visible & (Lv == L_shape)
+    last_ligulated = np.full(ngroups, -1)
+    np.maximum.at(last_ligulated, groups[ligulated], position[ligulated])
+    has_ligulated = last_ligulated >= 0
+    NFL = np.where(has_ligulated, numphy[last_ligulated], 0.0)
+    d_base_lastcol = np.where(has_visible & has_ligulated,
+                              df['d_basecol'].values[last_ligulated], np.nan)
+    # growing leaves are visible leaves above the last ligulated one
+    last_label = np.where(has_ligulated, labels[last_ligulated], -np.inf)
+    growing = visible & (labels > last_label[groups])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        HS = NFL + _group_sum(np.where(growing, Lv / L_shape.astype(float), 0), groups, ngroups)
+        HS = np.where(has_visible, HS, 0.0)
+        NFL = np.where(has_visible, NFL, 0.0)
         # SSI
-        if indexes_of_all_non_null_Lsen.size == 0:
-            SSI = 0.0
-        else:
-            nonzero_Lvsen_indexes = group.index[group.Lvsen.to_numpy().nonzero()]
-            SSI = group['numphy'][nonzero_Lvsen_indexes[0]] - 1
-            if len(nonzero_Lvsen_indexes) > 0:
-                Lvsen_values = group['Lvsen'].loc[nonzero_Lvsen_indexes]
-                L_shape_values = group['L_shape'].loc[nonzero_Lvsen_indexes]
-                SSI += (Lvsen_values / L_shape_values).sum()
-        
-        indexes_of_all_null_Lshape = L_shape[L_shape == 0.0].index
-        HS_final = group['HS_final'][group.first_valid_index()]
-        #if group['hasEar'].nunique() > 1:
-        #    warnings.warn('Multiple value of hasEar for group {}'.format(name), InputWarning)
-        #has_ear = group['hasEar'][group.first_valid_index()]
-        has_ear = group['HS_final'][group.first_valid_index()] == group['nff'][group.first_valid_index()] 
-         
-        GreenLeaf = HS - SSI
-        
-        phenology_list.append([TT, species, plant, axe_id, NFF, HS, SSI, GreenLeaf, NFL,
-                              NFV, has_ear, d_base_lastcol, HS_final])
-    
-    phenology_df = pd.DataFrame(phenology_list, 
-                                columns=['TT', 'species', 'plant', 'axe_id', 'NFF',
-                                         'HS', 'SSI', 'GreenLeaf', 'NFL',
-                                         'NFV', 'has_ear', 'd_base-lastcol', 
-                                         'HS_final'])
+        senescent = Lvsen != 0
+        first_senescent = np.full(ngroups, len(df))
+        np.minimum.at(first_senescent, groups[senescent], position[senescent])
+        has_senescent = first_senescent < len(df)
+        SSI = np.where(has_senescent,
+                       numphy[np.minimum(first_senescent, len(df) - 1)] - 1 +
+                       _group_sum(np.where(senescent, Lvsen / L_shape, 0), groups, ngroups),
+                       0.0)
+
+    HS_final = first_rows['HS_final'].values
+    phenology_df = pd.DataFrame({'TT': first_rows['TT'].values,
+                                 'species': first_rows['species'].values,
+                                 'plant': first_rows['plant'].values,
+                                 'axe_id': first_rows['axe_id'].values,
+                                 'NFF': first_rows['nff'].values,
+                                 'HS': HS,
+                                 'SSI': SSI,
+                                 'GreenLeaf': HS - SSI,
+                                 'NFL': NFL,
+                                 'NFV': NFV,
+                                 'has_ear': HS_final == first_rows['nff'].values,
+                                 'd_base-lastcol': d_base_lastcol,
+                                 'HS_final': HS_final})
     
     return phenology_df
                                                 
@@ -341,44 +344,44 @@ def axis_statistics(adel_output_df, domain_area, convUnit=0.01):
     
     area_in_cm = domain_area * 1.0 / convUnit ** 2
 
-    axis_statistics_list = []
-    
     is_active = pd.Series(0, index=intermediate_df.index)
     
     growing_1_df = intermediate_df[(intermediate_df['HS'] < intermediate_df['HS_final']) & (intermediate_df['HS'] > 0.5) & (intermediate_df['Slv'] > 0)]
     growing_2_df = intermediate_df[(intermediate_df['HS'] >= intermediate_df['HS_final']) & (intermediate_df['has_ear'] == 1) & (intermediate_df['Slv'] > 0)]
     growing_indexes = growing_1_df.index.union(growing_2_df.index)
-    growing_df = intermediate_df.loc[growing_indexes]
     is_active.loc[growing_indexes] = 1
     intermediate_df['is_active'] = is_active
-    
-    for (ThermalTime, species, axe_id, NFF, has_ear), group in intermediate_df.groupby(['TT', 'species', 'axe_id', 'NFF', 'has_ear'], as_index=False):
-        HS = group['HS'].mean()
-        SSI = group['SSI'].mean()
-        tot_LAI = group['Slv'].sum() / area_in_cm
-        green_LAI = group['Slvgreen'].sum() / area_in_cm
-        tot_PAI = (group['Slv'] + (group['SGv'] + group['SEv']) / 2.0 ).sum() / area_in_cm
-        green_PAI = (group['Slvgreen'] + (group['SGvgreen'] + group['SEvgreen']) / 2.0 ).sum() / area_in_cm
-        d_base_lastcol = group['d_base-lastcol'].mean()
-        axes_cardinality = len(group)
-        
-        active_axes_cardinality = len(group[group['is_active'] == 1])
-        
-        if axe_id == 'MS':
-            axis_order = 0
-        else:
-            axis_order = axe_id.count('.') + 1
-        
-        axis_statistics_list.append([ThermalTime, species, axe_id, NFF, HS, SSI, tot_LAI,
-                                     green_LAI, tot_PAI, green_PAI, has_ear, 
-                                     d_base_lastcol, axes_cardinality, 
-                                     active_axes_cardinality, axis_order])
-        
-    axis_statistics_df = \
-        pd.DataFrame(axis_statistics_list,
-                     columns=['ThermalTime', 'species', 'axe_id', 'NFF', 'HS', 'SSI', 'LAI totale', 'LAI vert',
-                              'PAI total', 'PAI vert', 'has_ear', 'd_base-lastcol', 'axes_cardinality', 
-                              'active_axes_cardinality', 'axis_order'])
+
+    df = intermediate_df.assign(
+        PAI=intermediate_df['Slv'] + (intermediate_df['SGv'] + intermediate_df['SEv']) / 2.0,
+        green_PAI=intermediate_df['Slvgreen'] + (intermediate_df['SGvgreen'] + intermediate_df['SEvgreen']) / 2.0,
+        active=(intermediate_df['is_active'] == 1).astype(int))
+    keys = ['TT', 'species', 'axe_id', 'NFF', 'has_ear']
+    stats = df.groupby(keys).agg(HS=('HS', 'mean'), SSI=('SSI', 'mean'),
+                                 Slv=('Slv', 'sum'), Slvgreen=('Slvgreen', 'sum'),
+                                 PAI=('PAI', 'sum'), green_PAI=('green_PAI', 'sum'),
+                                 d_base_lastcol=('d_base-lastcol', 'mean'),
+                                 axes_cardinality=('HS', 'size'),
+                                 active=('active', 'sum')).reset_index()
+    axis_order = np.array([0 if axe_id == 'MS' else axe_id.count('.') + 1
+                           for axe_id in stats['axe_id']], dtype=int)
+
+    axis_statistics_df = pd.DataFrame({
+        'ThermalTime': stats['TT'].values,
+        'species': stats['species'].values,
+        'axe_id': stats['axe_id'].values,
+        'NFF': stats['NFF'].values,
+        'HS': stats['HS'].values,
+        'SSI': stats['SSI'].values,
+        'LAI totale': stats['Slv'].values / area_in_cm,
+        'LAI vert': stats['Slvgreen'].values / area_in_cm,
+        'PAI total': stats['PAI'].values / area_in_cm,
+        'PAI vert': stats['green_PAI'].values / area_in_cm,
+        'has_ear': stats['has_ear'].values,
+        'd_base-lastcol': stats['d_base_lastcol'].values,
+        'axes_cardinality': stats['axes_cardinality'].values,
+        'active_axes_cardinality': stats['active'].values,
+        'axis_order': axis_order})
     
     return axis_statistics_df, intermediate_df
     
@@ -445,38 +448,193 @@ def plot_statistics(axis_statistics_df, plant_number, domain_area):
     return plot_statistics_df
     
     
+class StatisticsAccumulator(object):
+    """ Incremental axis and plot statistics of a simulation
+
+    Each call to add processes the output of Adel for one (or a few) time
+    step(s): the axis and plot statistics of the step are computed and their
+    rows are appended to csv files (if paths are given) and/or to an
+    in-memory columnar store (if keep is True). Previous output is never read
+    back while adding steps, hence memory and I/O per step do not depend on the
+    number of steps already processed.
+    By default (keep=None), rows are kept in memory only if no path is given.
+    Statistics of a table that is not kept are read back from its csv file.
+
+    Plot statistics columns are fixed once for all, with one
+    'active_axes_density_for_axis_order_<order>' column per order in
+    0..max_axis_order (NaN if no axis of that order exists at a given step).
+    """
+
+    def __init__(self, domain_area, plant_number, convUnit=0.01,
+                 axis_path=None, plot_path=None, max_axis_order=3,
+                 keep=None):
+        self.domain_area = domain_area
+        self.plant_number = plant_number
+        self.convUnit = convUnit
+        self.paths = {'axis': axis_path, 'plot': plot_path}
+        if keep is None:
+            keep = axis_path is None and plot_path is None
+        self.keep = keep
+        self.axis_columns = ['ThermalTime', 'species', 'axe_id', 'NFF', 'HS',
+                             'SSI', 'LAI totale', 'LAI vert', 'PAI total',
+                             'PAI vert', 'has_ear', 'd_base-lastcol',
+                             'axes_cardinality', 'active_axes_cardinality',
+                             'axis_order']
+        self.plot_columns = ['aire du plot', 'Nbr.plant.perplot',
+                             'ThermalTime', 'species', 'LAI_tot', 'LAI_vert',
+                             'PAI_tot', 'PAI_vert', 'Nbr.axe.tot.m2',
+                             'number_of_active_axes_per_m2'] + \
+                            ['active_axes_density_for_axis_order_{}'.format(
+                                order) for order in range(max_axis_order + 1)]
+        self.max_axis_order = max_axis_order
+        self.nsteps = 0
+        # {table: {column: [arrays, one per step]}}
+        self._store = {'axis': {c: [] for c in self.axis_columns},
+                       'plot': {c: [] for c in self.plot_columns}}
+        # existing non-empty files are appended to without header
+        self._header = {}
+        for table, file_path in self.paths.items():
+            if file_path is not None:
+                try:
+                    self._header[table] = os.path.getsize(file_path) == 0
+                except OSError:
+                    self._header[table] = True
+
+    def add(self, adel_output_df):
+        """ process the output of Adel (one row per element, as returned by
+        Adel.get_exposed_areas(g, convert=True)) for the current step(s).
+
+        Return the axis and plot statistics of the step(s)
+        """
+        if adel_output_df.empty:
+            return None, None
+        axstat, _ = axis_statistics(adel_output_df, self.domain_area,
+                                    self.convUnit)
+        if axstat['axis_order'].max() > self.max_axis_order:
+            warnings.warn('axis orders greater than {} are not reported in '
+                          'plot statistics'.format(self.max_axis_order))
+        pstat = plot_statistics(axstat, self.plant_number, self.domain_area)
+        pstat = pstat.reindex(self.plot_columns, axis=1)
+        self._append('axis', axstat)
+        self._append('plot', pstat)
+        self.nsteps += 1
+        return axstat, pstat
+
+    def _append(self, table, df):
+        file_path = self.paths[table]
+        if file_path is not None:
+            df.to_csv(file_path, mode='a', header=self._header[table],
+                      na_rep='NA', index=False)
+            self._header[table] = False
+        if self.keep:
+            store = self._store[table]
+            for column in store:
+                store[column].append(df[column].values)
+
+    def _table(self, table):
+        store = self._store[table]
+        columns = list(store)
+        if not self.keep:
+            file_path = self.paths[table]
+            if file_path is not None and os.path.exists(file_path):
+                return pd.read_csv(file_path)
+            return pd.DataFrame(columns=columns)
+        if len(store[columns[0]]) == 0:
+            return pd.DataFrame(columns=columns)
+        return pd.DataFrame({c: np.concatenate(store[c]) for c in columns},
+                            columns=columns)
+
+    def axis_statistics(self):
+        """ axis statistics of all steps processed so far """
+        return self._table('axis')
+
+    def plot_statistics(self):
+        """ plot statistics of all steps processed so far """
+        return self._table('plot')
+
+
+def midrib_shape_statistics(x, y, offsets, hins):
+    """ Compute angles and heights of midribs given as ragged arrays.
+
+    x, y are the concatenated coordinates of all midribs, midrib i being
+    x[offsets[i]:offsets[i + 1]], and hins their insertion heights. Every
+    midrib should have at least two points.
+    Returns a dict of arrays (one value per midrib)
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    offsets = np.asarray(offsets, dtype=int)
+    hins = np.asarray(hins, dtype=float)
+    npts = np.diff(offsets)
+    if np.any(npts < 2):
+        raise ValueError('midribs should have at least two points')
+    nmid = len(npts)
+    # segments (pairs of consecutive points of the same midrib)
+    inside = np.ones(max(len(x) - 1, 0), dtype=bool)
+    inside[offsets[1:-1] - 1] = False
+    dx = np.diff(x)[inside]
+    dy = np.diff(y)[inside]
+    ds = np.sqrt(dx ** 2 + dy ** 2)
+    theta = np.arctan2(dy, dx)
+    seg_offsets = offsets - np.arange(nmid + 1)
+    # curvature between consecutive segments of the same midrib
+    inside = np.ones(max(len(theta) - 1, 0), dtype=bool)
+    inside[seg_offsets[1:-1] - 1] = False
+    with np.errstate(divide='ignore', invalid='ignore'):
+        dphi = np.diff(theta)[inside] / ds[1:][inside]
+    sum_dphi = np.bincount(np.repeat(np.arange(nmid), npts - 2),
+                           weights=dphi, minlength=nmid)
+    length = np.bincount(np.repeat(np.arange(nmid), npts - 1), weights=ds,
+                         minlength=nmid)
+    phi0 = theta[seg_offsets[:-1]]
+    starts = offsets[:-1]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        h_projection = (np.maximum.reduceat(x, starts) -
+                        np.minimum.reduceat(x, starts)) / length
+    return {'insertion_angle': np.degrees(phi0),
+            'mean_leaf_angle': np.degrees(phi0 + sum_dphi / (npts - 1)),
+            'insertion_height': hins,
+            'maximal_height': hins + np.maximum.reduceat(y, starts),
+            'tip_height': hins + y[offsets[1:] - 1],
+            'h_projection': h_projection}
+
+
+def midrib_array_statistics(midribs):
+    """ Compute synthetic statistics on midribs given as ragged arrays (the
+    dict returned by Adel.midrib_arrays), sorted by vid
+    """
+    order = np.argsort(midribs['vid'], kind='stable')
+    offsets = np.asarray(midribs['offsets'])
+    npts = np.diff(offsets)[order]
+    index = np.repeat(offsets[:-1][order] - np.cumsum(npts) + npts,
+                      npts) + np.arange(npts.sum())
+    sorted_offsets = np.zeros(len(order) + 1, dtype=int)
+    sorted_offsets[1:] = np.cumsum(npts)
+    stats = midrib_shape_statistics(np.asarray(midribs['x'])[index],
+                                    np.asarray(midribs['y'])[index],
+                                    sorted_offsets,
+                                    np.asarray(midribs['hins'])[order])
+    res = pd.DataFrame({'vid': np.asarray(midribs['vid'])[order],
+                        'species': np.asarray(midribs['species'])[order],
+                        'plant': np.asarray(midribs['plant'])[order],
+                        'axe': np.asarray(midribs['axe'])[order],
+                        'leaf': np.asarray(midribs['metamer'])[order]})
+    for k, v in stats.items():
+        res[k] = v
+    return res
+
+
 def midrib_statistics(midribs):
     """ Compute synthetic statistics on a midrib output table (the one produced by astk_interface.AdelWheat.get_midribs method)
     """
-    def _curvilinear_abscisse( x, y ):
-        s = np.zeros(len(x))
-        s[1:] = np.sqrt(np.diff(x)**2+np.diff(y)**2)
-        return s.cumsum()
-
-    def _curvature_xys(x,y,s):
-        ds = np.diff(s)
-        dx, dy = np.diff(x), np.diff(y)
-        theta = np.arctan2(dy,dx)
-        dtheta = np.diff(theta) / ds[1:]
-        return (x[0], y[0]), theta[0], s, dtheta
-    
-    def _process(midrib):
-        hins = midrib['hins'][0]
-        x = midrib['x']
-        y = midrib['y']
-        s = _curvilinear_abscisse(x,y)
-        origin, phi0, s, dphi = _curvature_xys(x,y,s)
-        #
-        return pd.Series({'species': midrib['species'].values[0],
-                                'plant':midrib['plant'].values[0],
-                                 'axe':midrib['axe'].values[0],
-                                 'leaf':midrib['metamer'].values[0],
-                                 'insertion_angle': np.degrees(phi0),
-                                 'mean_leaf_angle': np.degrees(np.mean([phi0]+(phi0 + dphi).tolist())),
-                                 'insertion_height': hins,
-                                 'maximal_height':hins + y.max(),
-                                 'tip_height': hins + y.tolist()[-1],
-                                 'h_projection': (x.max() - x.min()) / s.max()})
-
-    return midribs.groupby('vid', as_index=False).apply(_process)
+    midribs = midribs.sort_values('vid', kind='stable')
+    vid = midribs['vid'].values
+    starts = np.flatnonzero(np.r_[True, vid[1:] != vid[:-1]])
+    offsets = np.append(starts, len(vid))
+    first = midribs.iloc[starts]
+    arrays = {'vid': vid[starts], 'offsets': offsets,
+              'x': midribs['x'].values, 'y': midribs['y'].values}
+    for k in ('species', 'plant', 'axe', 'metamer', 'hins'):
+        arrays[k] = first[k].values
+    return midrib_array_statistics(arrays)
     
\ No newline at end of file
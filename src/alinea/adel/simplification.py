@@ -1,4 +1,5 @@
 from math import sqrt
+import numpy as np
 from heapq import *
 from openalea.plantgl.all import Vector3
 
@@ -17,60 +18,76 @@ def max_distance(pts, line):
     return index, max_dist/d_line
 
 def distance( pt, p0, p1):
+    """ squared distance of point(s) pt to the line (p0, p1).
+
+    pt, p0 and p1 are 3d points or (n, 3) arrays of points. If p0 == p1, the
+    squared distance to p0 is returned
+    """
+    pt, p0, p1 = (np.asarray(p, dtype=float) for p in (pt, p0, p1))
     line = p1 - p0
-    length = line.__normSquared__()
-    d = ((pt-p0) ^ line).__normSquared__()
-    d /= length
-    return d
+    length = (line * line).sum(axis=-1)
+    c = np.cross(pt - p0, line)
+    d = (c * c).sum(axis=-1)
+    d0 = ((pt - p0) ** 2).sum(axis=-1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(length > 0, d / length, d0)
 
-def cost( polyline, nb_points):
-    nb_points += 2
-    n = len(polyline)
-    pts = [ pt for pt in polyline ]
-    _cost = []
-    
-    sibling=[[i-1, i+1] for i in range(n)]
-    
-    # compute the cost for each points
-    heap_cost = []
-    _cost = {}
-    
-    for i in range(1, n-1):
-        d = distance(polyline[i], polyline[i-1], polyline[i+1])
-        _cost[i]=d
-        heappush(heap_cost,[d,i])
-    
-    while len(heap_cost) > nb_points-2:
-        d, i = heappop(heap_cost)
+def _distance(pt, p0, p1):
+    """ distance for a single point, with python floats """
+    lx, ly, lz = p1[0] - p0[0], p1[1] - p0[1], p1[2] - p0[2]
+    vx, vy, vz = pt[0] - p0[0], pt[1] - p0[1], pt[2] - p0[2]
+    length = lx * lx + ly * ly + lz * lz
+    if length <= 0:
+        return vx * vx + vy * vy + vz * vz
+    cx, cy, cz = vy * lz - vz * ly, vz * lx - vx * lz, vx * ly - vy * lx
+    return (cx * cx + cy * cy + cz * cz) / length
+
+def simplify_mask(polyline, nb_points):
+    """ return a boolean mask of the points kept when simplifying polyline up
+    to nb_points (end points are always kept).
 
-        assert pts[i] is not None
-        pts[i] = None
-        
+    Points are removed one at a time, the one with the lowest cost (squared
+    distance to the line joining its remaining neighbours) first. Costs are
+    kept in a heap with lazy deletion: outdated entries are skipped when popped.
+    """
+    pts = np.array([tuple(pt) for pt in polyline], dtype=float).reshape(-1, 3)
+    n = len(pts)
+    keep = np.ones(n, dtype=bool)
+    if n <= 2:
+        return keep
+    left = np.arange(-1, n - 1)
+    right = np.arange(1, n + 1)
+    costs = np.full(n, np.inf)
+    costs[1:-1] = distance(pts[1:-1], pts[:-2], pts[2:])
+    heap_cost = [(d, i) for i, d in enumerate(costs[1:-1].tolist(), 1)]
+    heapify(heap_cost)
+    costs = costs.tolist()
+    coords = pts.tolist()
+    left, right = left.tolist(), right.tolist()
+
+    nb_removed = n - max(nb_points, 2)
+    while nb_removed > 0:
+        d, i = heappop(heap_cost)
+        if not keep[i] or d != costs[i]:
+            # outdated entry
+            continue
+        keep[i] = False
+        nb_removed -= 1
         # update i-1 and i+1 distance
-        il, ir = sibling[i]
-        
-        if il != 0:
-            sibling[il][1]=ir
-            ill = sibling[il][0]
-            dl = distance(pts[il], pts[ill], pts[ir]) 
-            old_dl = _cost[il]
-            heap_index = heap_cost.index([old_dl, il])
-            _cost[il] = dl
-            del heap_cost[heap_index]
-            heappush(heap_cost, [dl, il])
-        if ir != n-1:
-            sibling[ir][0]=il
-            irr = sibling[ir][1]
-            dr = distance(pts[ir], pts[il], pts[irr]) 
-            old_dr = _cost[ir]
-            heap_index = heap_cost.index([old_dr, ir])
-            _cost[ir] = dr
-            del heap_cost[heap_index]
-            heappush(heap_cost, [dr, ir])
-    # bug in the algorithm...
-    pts[1] = None
-    pts[-2] = None
-    return pts
-    
-        
+        il, ir = left[i], right[i]
+        right[il] = ir
+        left[ir] = il
+        for j in (il, ir):
+            if 0 < j < n - 1:
+                dj = _distance(coords[j], coords[left[j]], coords[right[j]])
+                costs[j] = dj
+                heappush(heap_cost, (dj, j))
+    return keep
+
+def cost( polyline, nb_points):
+    """ simplify polyline up to nb_points.
 
+    Return the list of points of polyline, with None for removed points
+    """
+    keep = simplify_mask(polyline, nb_points)
+    return [pt if k else None for pt, k in zip(polyline, keep)]
@@ -0,0 +1,284 @@
+# -*- python -*-
+#
+#       Copyright 2015 INRIA - CIRAD - INRA
+#
+#       Distributed under the Cecill-C License.
+#       See accompanying file LICENSE.txt or copy at
+#           http://www.cecill.info/licences/Licence_CeCILL-C_V1-en.html
+#
+#       WebSite : https://github.com/openalea-incubator/adel
+#
+# ==============================================================================
+"""
+Compact, versioned on-disk format for canopy snapshots
+
+A snapshot is a directory of numpy (.npy) files plus a json header:
+    - the topology of the mtg (scale, complex and parent of vertices),
+    - mtg properties stored as typed columns (vids + values),
+    - all element meshes, as concatenated point and (local) index arrays with
+      offsets per element.
+All arrays can be memory-mapped at load time. Properties that do not fit a
+typed column are json encoded (see json_numpy), so that no pickle is involved.
+"""
+import json
+import numbers
+import os
+from collections.abc import MutableMapping
+
+import numpy
+from openalea.mtg import MTG
+
+import alinea.adel.json_numpy as json_np
+from alinea.adel.mtg_interpreter import mesh_arrays, triangle_set
+
+SNAPSHOT_FORMAT = 'adel-snapshot'
+SNAPSHOT_VERSION = 2
+_HEADER = 'header.json'
+
+
+def _is_bool(v):
+    return isinstance(v, (bool, numpy.bool_))
+
+
+def _is_number(v):
+    return isinstance(v, (numbers.Number, numpy.number)) and not _is_bool(v)
+
+
+def _column(values):
+    """ return (kind, array or None) for a list of property values """
+    if all(_is_bool(v) for v in values):
+        return 'bool', numpy.array(values, dtype=bool)
+    if all(_is_number(v) for v in values):
+        if all(isinstance(v, (numbers.Integral, numpy.integer)) for v in values):
+            return 'int', numpy.array(values, dtype=numpy.int64)
+        if all(isinstance(v, (numbers.Real, numpy.floating)) for v in values):
+            return 'float', numpy.array(values, dtype=float)
+    if all(isinstance(v, str) for v in values):
+        return 'str', numpy.array(values, dtype=str)
+    # fixed length sequences of floats (anchor points, ...). Other sequences
+    # (eg shape keys, mixing strings, integers and None) are json encoded
+    if all(isinstance(v, (tuple, list, numpy.ndarray)) for v in values):
+        items = [tuple(v) for v in values]
+        if (len(set(len(v) for v in items)) == 1 and
+                all(isinstance(x, (float, numpy.floating))
+                    for v in items for x in v)):
+            return 'vector', numpy.array(items, dtype=float)
+    return 'json', None
+
+
+def _encode_tuples(value):
+    """ mark tuples (eg shape keys) of a json property value, so that they
+    are restored as tuples and not as lists """
+    if isinstance(value, tuple):
+        return {'__tuple__': [_encode_tuples(v) for v in value]}
+    if isinstance(value, list):
+        return [_encode_tuples(v) for v in value]
+    if isinstance(value, dict):
+        return {k: _encode_tuples(v) for k, v in value.items()}
+    return value
+
+
+def _json_hook(dct):
+    if '__tuple__' in dct:
+        return tuple(dct['__tuple__'])
+    return json_np.json_numpy_obj_hook(dct)
+
+
+def save_snapshot(g, path):
+    """ save mtg g (and its geometry) as a snapshot directory at path """
+    if not os.path.exists(path):
+        os.makedirs(path)
+
+    def _save(name, array):
+        numpy.save(os.path.join(path, name + '.npy'), array)
+
+    # topology
+    vids = sorted(g.vertices())
+    vids = [vid for vid in vids if vid != g.root]
+    _save('vid', numpy.array(vids, dtype=numpy.int64))
+    _save('scale', numpy.array([g.scale(vid) for vid in vids], dtype=numpy.int64))
+    complex_ = [g.complex(vid) for vid in vids]
+    _save('complex', numpy.array([-1 if c is None else c for c in complex_],
+                                 dtype=numpy.int64))
+    # (parent, child) edges, in children order
+    edges = [(vid, child) for vid in vids for child in g.children(vid)]
+    _save('edges', numpy.array(edges, dtype=numpy.int64).reshape(-1, 2))
+
+    # properties
+    header_properties = []
+    for i, (name, prop) in enumerate(sorted(g.properties().items())):
+        if name == 'geometry' or len(prop) == 0:
+            continue
+        pvids = sorted(prop)
+        values = [prop[vid] for vid in pvids]
+        kind, array = _column(values)
+        key = 'property%d' % i
+        _save(key + '_vid', numpy.array(pvids, dtype=numpy.int64))
+        if kind == 'json':
+            try:
+                with open(os.path.join(path, key + '.json'), 'w') as f:
+                    json_np.dump(_encode_tuples(values), f)
+            except TypeError:
+                raise TypeError('property %s cannot be saved in a snapshot'
+                                % name)
+        else:
+            _save(key, array)
+        header_properties.append({'name': name, 'key': key, 'kind': kind})
+
+    # meshes
+    has_geometry = 'geometry' in g.property_names()
+    if has_geometry:
+        mvids, points, indices, point_offsets, index_offsets = mesh_arrays(
+            g.property('geometry'))
+        _save('mesh_vid', mvids)
+        _save('mesh_points', points)
+        _save('mesh_indices', indices)
+        _save('mesh_point_offsets', point_offsets)
+        _save('mesh_index_offsets', index_offsets)
+
+    header = {'format': SNAPSHOT_FORMAT, 'version': SNAPSHOT_VERSION,
+              'properties': header_properties, 'geometry': has_geometry}
+    with open(os.path.join(path, _HEADER), 'w') as f:
+        json.dump(header, f)
+    return path
+
+
+def read_header(path):
+    """ read and check the header of a snapshot """
+    fheader = os.path.join(path, _HEADER)
+    if not os.path.exists(fheader):
+        raise IOError('%s is not an adel snapshot' % path)
+    with open(fheader) as f:
+        header = json.load(f)
+    if header.get('format') != SNAPSHOT_FORMAT:
+        raise IOError('%s is not an adel snapshot' % path)
+    if header['version'] > SNAPSHOT_VERSION:
+        raise IOError('snapshot version %d is not supported (max version: %d)'
+                      % (header['version'], SNAPSHOT_VERSION))
+    return header
+
+
+def load_array(path, name, mmap=True):
+    """ load (memory-map) an array of a snapshot """
+    return numpy.load(os.path.join(path, name + '.npy'),
+                      mmap_mode='r' if mmap else None)
+
+
+class SnapshotGeometry(MutableMapping):
+    """ {vid: geometry} mapping reading meshes of a snapshot on demand.
+
+    Point and index arrays are memory-mapped: the mesh of an element is only
+    read (and converted to a plantgl TriangleSet) on first access, then kept.
+    Geometries can be set or deleted as in a dict, without touching the file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.points = load_array(path, 'mesh_points')
+        self.indices = load_array(path, 'mesh_indices')
+        self.point_offsets = load_array(path, 'mesh_point_offsets')
+        self.index_offsets = load_array(path, 'mesh_index_offsets')
+        self._index = {vid: i for i, vid in
+                       enumerate(load_array(path, 'mesh_vid').tolist())}
+        self._loaded = {}
+        self._removed = set()
+
+    def arrays(self, vid):
+        """ (points, indices) memory-mapped arrays of the stored mesh of vid """
+        i = self._index[vid]
+        return (self.points[self.point_offsets[i]:self.point_offsets[i + 1]],
+                self.indices[self.index_offsets[i]:self.index_offsets[i + 1]])
+
+    def _stored(self, vid):
+        return vid in self._index and vid not in self._removed
+
+    def __getitem__(self, vid):
+        if vid in self._loaded:
+            return self._loaded[vid]
+        if not self._stored(vid):
+            raise KeyError(vid)
+        geom = triangle_set(*self.arrays(vid))
+        self._loaded[vid] = geom
+        return geom
+
+    def __setitem__(self, vid, geom):
+        self._loaded[vid] = geom
+
+    def __delitem__(self, vid):
+        if vid not in self._loaded and not self._stored(vid):
+            raise KeyError(vid)
+        self._loaded.pop(vid, None)
+        if vid in self._index:
+            self._removed.add(vid)
+
+    def __contains__(self, vid):
+        return vid in self._loaded or self._stored(vid)
+
+    def __iter__(self):
+        for vid in self._index:
+            if vid not in self._loaded and vid not in self._removed:
+                yield vid
+        for vid in list(self._loaded):
+            yield vid
+
+    def __len__(self):
+        stored = sum(1 for vid in self._index
+                     if vid not in self._loaded and vid not in self._removed)
+        return stored + len(self._loaded)
+
+
+def load_snapshot(path, load_geom=True, mmap=True, lazy=False):
+    """ load a mtg saved with save_snapshot.
+
+    If lazy is True, the geometry property is a SnapshotGeometry, that reads
+    meshes from the (memory-mapped) snapshot on first access
+    """
+    header = read_header(path)
+
+    def _load(name):
+        return load_array(path, name, mmap)
+
+    g = MTG()
+    vids = _load('vid').tolist()
+    scale = _load('scale').tolist()
+    complex_ = _load('complex').tolist()
+    # components are created scale by scale, then linked to their parent
+    for _, vid, c in sorted(zip(scale, vids, complex_)):
+        g.add_component(g.root if c < 0 else c, component_id=vid)
+    for parent, child in _load('edges').tolist():
+        g.add_child(parent, child=child)
+
+    props = g.properties()
+    for p in header['properties']:
+        name, key, kind = p['name'], p['key'], p['kind']
+        pvids = _load(key + '_vid').tolist()
+        if kind == 'json':
+            with open(os.path.join(path, key + '.json')) as f:
+                values = json_np.load(f, object_hook=_json_hook)
+        elif kind == 'vector':
+            values = list(map(tuple, _load(key).tolist()))
+        else:
+            values = _load(key).tolist()
+        if name not in props:
+            g.add_property(name)
+        props[name].update(zip(pvids, values))
+
+    if load_geom and header['geometry']:
+        if lazy:
+            props['geometry'] = SnapshotGeometry(path)
+        else:
+            mvids = _load('mesh_vid')
+            points = _load('mesh_points')
+            indices = _load('mesh_indices')
+            point_offsets = _load('mesh_point_offsets')
+            index_offsets = _load('mesh_index_offsets')
+            geometry = {}
+            for i, vid in enumerate(mvids.tolist()):
+                geometry[vid] = triangle_set(
+                    points[point_offsets[i]:point_offsets[i + 1]],
+                    indices[index_offsets[i]:index_offsets[i + 1]])
+            if 'geometry' not in props:
+                g.add_property('geometry')
+            props['geometry'].update(geometry)
+
+    return g
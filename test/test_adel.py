@@ -42,6 +42,16 @@ def test_scene():
     assert len(s) == 6
 
 
+def test_triangles():
+    tri = adel.triangles(g)
+    ntri = len(tri['triangles'])
+    assert ntri > 0
+    assert tri['triangles'].shape == (ntri, 3, 3)
+    assert set(tri['vid']) == set(g.property('geometry'))
+    assert tri['triangles'].dtype == 'float32'
+    assert len(tri['vid']) == len(tri['label']) == len(tri['is_green']) == ntri
+
+
 def test_statistics():
     adel = test_instantiate()
     g = test_data.adel_two_metamers()
@@ -77,6 +87,26 @@ def test_save_and_load():
     if os.path.exists(fg):
         os.remove(fg)
 
+def test_save_and_load_snapshot():
+    import shutil
+    fsnap = adel.save(g, index=1, format='snapshot')
+    gg = adel.load(index=1)
+    assert len(gg) == len(g)
+    assert gg.property('label') == g.property('label')
+    assert len(gg.property('geometry')) == len(g.property('geometry'))
+    # shape keys mix strings, integers and None: they should be left unchanged
+    assert gg.property('shape_key') == g.property('shape_key')
+    assert all(isinstance(k, tuple) for k in gg.property('shape_key').values()
+               if k is not None)
+    midribs = adel.get_midribs(gg)
+    assert len(midribs) == len(adel.get_midribs(g))
+    gg = adel.load(index=1, lazy=True)
+    geometry = gg.property('geometry')
+    assert len(geometry) == len(g.property('geometry'))
+    vid = next(iter(geometry))
+    assert len(geometry[vid].pointList) == len(g.property('geometry')[vid].pointList)
+    shutil.rmtree(fsnap)
+
 def test_duplicated():
     try:
         gg = adel.duplicated(g)
@@ -1,4 +1,6 @@
+import numpy
 from alinea.adel.astk_interface import AdelWheat
+from alinea.adel.mtg_interpreter import mesh_arrays, mtg_interpreter
 # from alinea.astk.TimeControl import TimeControlSet
 
 
@@ -19,6 +21,124 @@ def test_statistics():
     pstats = adel.plot_statistics(g)
 
 
+def test_engines():
+    for engine in ('R', 'numpy'):
+        adel = AdelWheat(nplants=2, seed=1, engine=engine)
+        g = adel.setup_canopy(age=100)
+        assert len(g.vertices()) > 20
+        assert list(g.property('geometry').values())[0].isValid()
+        g = adel.grow_dd(g, 100)
+        assert adel.canopy_age == 200
+        areas = adel.get_exposed_areas(g)
+        assert 'green_area' in areas
+    # same plants, same kinetics
+    r_canopy = AdelWheat(nplants=2, seed=1).run_adel(300)
+    np_canopy = AdelWheat(nplants=2, seed=1, engine='numpy').run_adel(300)
+    for k in ('Ll', 'Lv', 'Gl', 'Gv', 'El', 'Ev'):
+        numpy.testing.assert_allclose(np_canopy[k], r_canopy[k])
+
+
+def test_canopy_table():
+    dates = [100, 200, 300]
+    for engine in ('R', 'numpy'):
+        adel = AdelWheat(nplants=2, seed=1, engine=engine)
+        table = adel.canopy_table(dates)
+        assert set(table['TT']) == set(dates)
+        for date in dates:
+            canopy = adel.run_adel(date)
+            sel = table['TT'] == date
+            assert sel.sum() == len(canopy['plant'])
+            for k in ('Ll', 'Lv', 'Gl', 'Gv', 'El', 'Ev'):
+                numpy.testing.assert_allclose(table[k][sel], canopy[k])
+
+
+def test_instancing():
+    adel = AdelWheat(nplants=4, duplicate=2, seed=1)
+    g = adel.setup_canopy(age=300)
+    instances = adel.setup_canopy(age=300, instancing=True)
+    assert len(instances) == 4
+    # same geometry, plant by plant
+    geometry = g.property('geometry')
+    for i, plant in enumerate(g.vertices(scale=1)):
+        vids = [vid for vid in g.components_at_scale(plant, g.max_scale())
+                if vid in geometry]
+        instance_geometry = instances.instance_geometry(i)
+        ivids = [vid for vid in instances.elements(instances.references[i])
+                 if vid in instance_geometry]
+        points = mesh_arrays({0: [geometry[vid] for vid in vids]})[1]
+        ipoints = mesh_arrays({0: [instance_geometry[vid] for vid in ivids]})[1]
+        numpy.testing.assert_allclose(ipoints, points, atol=1e-6)
+    # same areas and statistics
+    keys = ['plant', 'axe', 'metamer', 'organ', 'element']
+    areas = adel.get_exposed_areas(g).sort_values(keys, kind='stable')
+    iareas = adel.get_exposed_areas(instances).sort_values(keys, kind='stable')
+    for k in keys:
+        assert areas[k].tolist() == iareas[k].tolist()
+    for k in ('area', 'green_area', 'senesced_area'):
+        numpy.testing.assert_allclose(iareas[k].values, areas[k].values)
+    axstat = adel.axis_statistics(g)
+    iaxstat = adel.axis_statistics(instances)
+    numpy.testing.assert_allclose(iaxstat['LAI totale'].values,
+                                  axstat['LAI totale'].values)
+    # instanced canopies are not mtgs
+    for f in (lambda: adel.grow_dd(instances, 100), lambda: adel.save(instances)):
+        try:
+            f()
+            assert False
+        except TypeError:
+            pass
+
+
+def test_interpretation_cache():
+    adel = AdelWheat(nplants=2, seed=1)
+    g = adel.setup_canopy(age=300)
+    # only elements that grew are meshed again
+    g = adel.grow_dd(g, 100)
+    vids, points, indices, _, _ = mesh_arrays(g.property('geometry'))
+    g = mtg_interpreter(g, adel.leaves, classic=adel.classic,
+                        face_up=adel.face_up, use_cache=False)
+    uvids, upoints, uindices, _, _ = mesh_arrays(g.property('geometry'))
+    assert uvids == vids
+    numpy.testing.assert_allclose(points, upoints, atol=1e-6)
+    numpy.testing.assert_array_equal(indices, uindices)
+    # interpreting an unchanged canopy from the cache
+    g = mtg_interpreter(g, adel.leaves, classic=adel.classic,
+                        face_up=adel.face_up)
+    g = mtg_interpreter(g, adel.leaves, classic=adel.classic,
+                        face_up=adel.face_up)
+    numpy.testing.assert_allclose(mesh_arrays(g.property('geometry'))[1],
+                                  upoints, atol=1e-6)
+
+
+def test_parallel_interpretation():
+    adel = AdelWheat(nplants=3, seed=1)
+    g = adel.setup_canopy(age=300)
+    vids, points, indices, _, _ = mesh_arrays(g.property('geometry'))
+    anchors = dict(g.property('anchor_point'))
+    g = mtg_interpreter(g, adel.leaves, classic=adel.classic,
+                        face_up=adel.face_up, processes=2)
+    pvids, ppoints, pindices, _, _ = mesh_arrays(g.property('geometry'))
+    assert pvids == vids
+    numpy.testing.assert_allclose(ppoints, points, atol=1e-6)
+    numpy.testing.assert_array_equal(pindices, indices)
+    panchors = g.property('anchor_point')
+    assert sorted(panchors) == sorted(anchors)
+    for vid in anchors:
+        numpy.testing.assert_allclose(tuple(panchors[vid]), tuple(anchors[vid]),
+                                      atol=1e-6)
+    # same canopy when built and grown with a pool of processes
+    padel = AdelWheat(nplants=3, seed=1, processes=2)
+    pg = padel.setup_canopy(age=300)
+    assert mesh_arrays(pg.property('geometry'))[0] == vids
+    numpy.testing.assert_allclose(mesh_arrays(pg.property('geometry'))[1],
+                                  points, atol=1e-6)
+    pg = padel.grow_dd(pg, 100)
+    g = adel.grow_dd(g, 100)
+    numpy.testing.assert_allclose(mesh_arrays(pg.property('geometry'))[1],
+                                  mesh_arrays(g.property('geometry'))[1],
+                                  atol=1e-6)
+
+
 # to be repaired
 # def test_dynamic():
 #     nplants = 1
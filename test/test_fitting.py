@@ -277,3 +277,105 @@ StemElement(1,3.200001,0.04,0.04)StemElement(1,16.250000,0.04,0.04)[/(180.000000
 
     #Viewer.display(scene)
     #raw_input('enter')
+
+
+def _simplify_reference(polyline, nb_points):
+    """ straightforward O(n2) simplification: remove, one at a time, the inner
+    point closest to the line joining its remaining neighbours """
+    from alinea.adel.simplification import _distance
+    kept = list(range(len(polyline)))
+    while len(kept) > max(nb_points, 2):
+        costs = [_distance(polyline[kept[k]], polyline[kept[k - 1]],
+                           polyline[kept[k + 1]])
+                 for k in range(1, len(kept) - 1)]
+        del kept[1 + costs.index(min(costs))]
+    return kept
+
+
+def test_simplify_mask():
+    from alinea.adel.simplification import simplify_mask
+    rng = random.Random(0)
+    for n in (3, 10, 50):
+        polyline = [(rng.random(), rng.random(), rng.random()) for i in range(n)]
+        for nb_points in (2, 3, n // 2, n - 1):
+            keep = simplify_mask(polyline, nb_points)
+            assert keep.sum() == max(nb_points, 2)
+            assert keep[0] and keep[-1]
+            assert keep.nonzero()[0].tolist() == _simplify_reference(polyline, nb_points)
+    # a peak is the last inner point removed
+    polyline = [(x, y, 0) for x, y in zip(range(10), [0, 1, 2, 3, 4, 5, 4, 3, 2, 1])]
+    assert simplify_mask(polyline, 3).nonzero()[0].tolist() == [0, 5, 9]
+
+
+def test_simplify_mask_degenerated():
+    from alinea.adel.simplification import simplify_mask
+    polyline = [(i, 2 * i, 0) for i in range(6)]
+    # nothing to remove
+    for nb_points in (6, 10):
+        assert simplify_mask(polyline, nb_points).all()
+    assert simplify_mask(polyline[:2], 1).all()
+    assert len(simplify_mask([], 3)) == 0
+    # at least the end points are kept
+    assert simplify_mask(polyline, 0).nonzero()[0].tolist() == [0, 5]
+    # collinear points
+    keep = simplify_mask(polyline, 4)
+    assert keep.sum() == 4 and keep[0] and keep[-1]
+    # duplicated points
+    keep = simplify_mask([(0, 0, 0)] * 5, 3)
+    assert keep.sum() == 3 and keep[0] and keep[-1]
+
+
+def _leaf_to_mesh_reference(x, y, r, twist_start=0, twist_end=0):
+    """ leaf mesh built with python lists, triangle by triangle """
+    import numpy as np
+    n = len(x)
+    theta = np.linspace(np.radians(twist_start), np.radians(twist_end), n)
+    points = list(zip(x, -r/2. * abs(np.cos(theta)), y + abs(np.sin(theta)) * r / 2.))
+    points.extend(list(zip(x, r/2. * abs(np.cos(theta)), y - abs(np.sin(theta)) * r / 2.)))
+    ind = list(range(n - 2)) if n > 2 else [0]
+    indices = [(i, i + n, i + n + 1) for i in ind]
+    indices.extend([(i, i + n + 1, i + 1) for i in ind])
+    indices.append((n - 2, 2 * n - 2, 2 * n - 1))
+    if r[-1] >= 0.001:
+        indices.append((n - 2, 2 * n - 1, n - 1))
+    return points, indices
+
+
+def _triangle_area(a, b, c):
+    u = [b[i] - a[i] for i in range(3)]
+    v = [c[i] - a[i] for i in range(3)]
+    w = (u[1] * v[2] - u[2] * v[1], u[2] * v[0] - u[0] * v[2], u[0] * v[1] - u[1] * v[0])
+    return sum(x * x for x in w) ** 0.5 / 2.
+
+
+def test_leaf_arrays():
+    import numpy as np
+    rng = np.random.RandomState(0)
+    for n in (2, 3, 10):
+        for twist in ((0, 0), (0, 90), (30, 360)):
+            for tip in (0, 0.5):
+                x = np.cumsum(rng.rand(n))
+                y = rng.rand(n)
+                r = rng.rand(n)
+                r[-1] = tip
+                points, indices = fitting.leaf_to_mesh(x, y, r, *twist)
+                ref_points, ref_indices = _leaf_to_mesh_reference(x, y, r, *twist)
+                np.testing.assert_allclose(points, ref_points)
+                assert indices == ref_indices
+                areas = fitting.triangle_areas(np.array(points), np.array(indices))
+                np.testing.assert_allclose(areas, [_triangle_area(*[points[i] for i in ind])
+                                                   for ind in indices])
+    # degenerated triangles
+    points = np.array([(0, 0, 0), (1, 0, 0), (2, 0, 0), (0, 1, 0)])
+    np.testing.assert_allclose(fitting.triangle_areas(points, np.array([(0, 1, 2), (0, 1, 3)])),
+                               [0, 0.5])
+
+
+def test_mesh4_triangles():
+    leaf = list(db.values())[0][0]
+    for s_base, s_top in ((0, 1), (0.2, 0.6), (0.9, 1)):
+        points, indices = fitting.mesh4(leaf, 10., 8., s_base, s_top, 1.)
+        assert len(indices) > 0
+        assert all(_triangle_area(*[points[i] for i in ind]) > 1e-6 for ind in indices)
+    # tiny elements are degenerated
+    assert fitting.mesh4(leaf, 10., 8., 0.5, 0.5, 1.) == ([], [])
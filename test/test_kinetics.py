@@ -0,0 +1,94 @@
+import numpy
+from alinea.adel.kinetics import runAdel, RunAdel, canopy_table, openapprox, \
+    ssi_table
+
+
+def synthetic_plant():
+    """ a two axes plant, as returned by AdelR.plant_parameters """
+    nf = numpy.array([4., 3.])
+    nrow = 7
+    phytoT = {k: numpy.zeros((nrow, 2)) for k in
+              ('Ll', 'Lw', 'Gl', 'Gd', 'El', 'Ed', 'Azim', 'Lindex', 'Lseed')}
+    for a in range(2):
+        n = int(nf[a])
+        phytoT['Ll'][:n, a] = numpy.linspace(8, 14, n)
+        phytoT['Lw'][:n, a] = 1
+        phytoT['Gl'][:n, a] = numpy.linspace(3, 8, n)
+        phytoT['Gd'][:n, a] = 0.3
+        phytoT['El'][:n, a] = [0] * (n - 2) + [4, 10]
+        phytoT['Ed'][:n, a] = 0.3
+        phytoT['Azim'][:n, a] = 180
+        phytoT['Lindex'][:n, a] = 1
+        phytoT['Lseed'][:n, a] = 1
+        phytoT['Lindex'][n:, a] = -999
+        phytoT['Lseed'][n:, a] = -999
+    # ear, peduncle and awn of main stem
+    phytoT['El'][4:7, 0] = [20, 8, 2]
+    phytoT['Ed'][4:7, 0] = 0.5
+
+    def pheno(n, start):
+        n = numpy.arange(n + 1.)
+        return {'n': n, 'tip': start + 100 * n, 'col': start + 100 * n + 150,
+                'ssi': start + 100 * n + 400, 'disp': start + 100 * n + 600}
+
+    return {'refp': '1',
+            'axeT': {'axe': numpy.array(['MS', 'T1']), 'nf': nf,
+                     'nf_end': nf, 'emf1': numpy.array([0., 200.]),
+                     'end': numpy.array([numpy.nan, 500.]),
+                     'disp': numpy.array([numpy.nan, 900.]),
+                     'azT': numpy.array([10., 75.]),
+                     'azTb': numpy.array([0., 5.]),
+                     'incT': numpy.array([2., 60.]),
+                     'dredT': numpy.array([0., 5.]),
+                     'hasEar': numpy.array([1., 0.]),
+                     'HS_final': numpy.array([4., numpy.nan])},
+            'phytoT': phytoT,
+            'pheno': [pheno(4, -100), pheno(3, 100)],
+            'pedT': [{'startPed': 500., 'endPed': 600., 'senPed': 900.}, None],
+            'ssisenT': {'ndel': numpy.array([1., 2., 3., 4.]),
+                        'rate1': numpy.array([0.07] * 4),
+                        'dssit1': numpy.array([0, 1.2, 2.5, 3]),
+                        'dssit2': numpy.array([1.2, 2.5, 3.7, 4])},
+            'ssipars': None}
+
+
+def test_openapprox():
+    res = openapprox([0, 1, 2], [0, 2, 4], [-1, 0.5, 3])
+    numpy.testing.assert_allclose(res, [-2, 1, 6])
+    res = openapprox([0, 1, 2], [0, 2, 4], [-1, 3], extrapolate=False)
+    numpy.testing.assert_allclose(res, [0, 4])
+
+
+def test_ssi_table():
+    table = ssi_table(r1=0.1, ndel=3)
+    numpy.testing.assert_allclose(table.sum(axis=1), 1)
+    numpy.testing.assert_allclose(table.sum(axis=0), 1)
+
+
+def test_run_adel():
+    plant = synthetic_plant()
+    canopy = RunAdel(300, [plant])
+    assert canopy['TT'][0] == 300
+    assert set(canopy['axe_id']) == {'MS', 'T1'}
+    assert numpy.all(canopy['Lv'] <= canopy['Ll'] + 1e-6)
+    assert numpy.all(canopy['Gv'] <= canopy['Gl'] + 1e-6)
+    # very early canopy: only two rows of main stem are kept
+    canopy = RunAdel(-150, [plant])
+    assert len(canopy['plant']) == 2
+    # lengths grow with time
+    early, late = runAdel([200, 400], [plant])
+    assert late['Ll'].sum() > early['Ll'].sum()
+
+
+def test_canopy_table():
+    plant = synthetic_plant()
+    dates = [200, 300, 400]
+    table = canopy_table(dates, [plant])
+    tables = runAdel(dates, [plant])
+    assert len(table['TT']) == sum(len(t['TT']) for t in tables)
+    assert set(table['TT']) == set(dates)
+    assert table['HS_final'].dtype.kind == 'f'
+    assert table['axe_id'].dtype.kind == 'U'
+    for t in tables:
+        sel = table['TT'] == t['TT'][0]
+        numpy.testing.assert_allclose(table['Lv'][sel], t['Lv'])
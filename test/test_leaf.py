@@ -207,3 +207,157 @@ def test81(leaf=leaf, scene = None):
 #m2.apply(sc)
 #sc.surface
 
+
+
+def test_fit_cache():
+    import os, pickle, tempfile
+    from alinea.adel.geometric_elements import Leaves
+    cache_dir = tempfile.mkdtemp()
+    leaves = Leaves(fit_cache_dir=None)
+    cached = Leaves(fit_cache_dir=cache_dir, processes=2)
+    assert len(os.listdir(cache_dir)) == 1
+    cached = Leaves(fit_cache_dir=cache_dir)
+    for k in leaves.leaves:
+        for leaf, cached_leaf in zip(leaves.leaves[k], cached.leaves[k]):
+            for x, y in zip(leaf, cached_leaf):
+                numpy.testing.assert_allclose(x, y)
+    # the cache is opt-in
+    assert Leaves().fit_cache_dir is None
+    # corrupt or stale files are fitted again
+    fcache = os.path.join(cache_dir, os.listdir(cache_dir)[0])
+    for content in (b'not a pickle', pickle.dumps({'1': 'stale'})):
+        with open(fcache, 'wb') as f:
+            f.write(content)
+        cached = Leaves(fit_cache_dir=cache_dir)
+        for leaf, cached_leaf in zip(leaves.leaves['1'], cached.leaves['1']):
+            for x, y in zip(leaf, cached_leaf):
+                numpy.testing.assert_allclose(x, y)
+
+
+def test_lazy_fit():
+    from alinea.adel.echap_leaf import echap_leaves
+    leaves = echap_leaves(lazy_fit=True)
+    key = leaves.get_leaf_key(1, 1, age=3)
+    leaf = leaves.get_leaf(key)
+    assert len(leaf) == 4
+    nfitted = sum(len(shapes.fitted) for k in leaves.leaves for shapes in leaves.leaves[k])
+    assert nfitted == 1
+    leaves.prefetch([3, 5])
+    eager = echap_leaves()
+    for x, y in zip(leaf, eager.get_leaf(key)):
+        numpy.testing.assert_allclose(x, y)
+
+
+def test_shape_store():
+    import pickle
+    from alinea.adel.geometric_elements import Leaves
+    leaves = Leaves(fit_cache_dir=None)
+    store = leaves.shapes
+    assert len(store) == sum(len(v) for v in leaves.leaves.values())
+    key = store.keys[0]
+    shape = leaves.get_leaf(key)
+    assert shape is leaves.leaves[key[0]][key[1]]
+    assert not shape.x.flags.writeable
+    s = shape.s.copy()
+    fitting.leaf_element(shape, 10., 10., 0, 1, 1.)
+    numpy.testing.assert_array_equal(shape.s, s)
+    unpickled = pickle.loads(pickle.dumps(leaves))
+    numpy.testing.assert_array_equal(unpickled.get_leaf(key).r, shape.r)
+
+
+def test_shared_memory():
+    import pickle
+    from alinea.adel.geometric_elements import Leaves
+    leaves = Leaves(fit_cache_dir=None)
+    key = leaves.shapes.keys[0]
+    name = leaves.share_memory()
+    copy = pickle.loads(pickle.dumps(leaves))
+    assert copy.shapes.shared_memory_name == name
+    numpy.testing.assert_array_equal(copy.get_leaf(key).x, leaves.get_leaf(key).x)
+    copy.unshare_memory()
+    leaves.unshare_memory()
+    assert leaves.shapes.shared_memory_name is None
+
+
+def test_blade_elt_areas():
+    from alinea.adel.geometric_elements import Leaves
+    leaves = Leaves()
+    bounds = numpy.linspace(0, 1, 7)
+    ff = leaves.form_factor()
+    for k in leaves.srdb:
+        key = (k, 0, None)
+        areas = leaves.blade_elt_areas(key, 10., 2., bounds[:-1], bounds[1:])
+        # element areas add up to the blade area
+        numpy.testing.assert_allclose(areas.sum(), leaves.blade_elt_area(key, 10., 2., 0, 1))
+        numpy.testing.assert_allclose(areas.sum(), ff[k] * 10. * 2.)
+    # known shapes: rectangular and tapered blades
+    s = numpy.linspace(0, 1, 5)
+    leaves.srdb = {'rect': {'s': s, 'r': numpy.ones(5)}, 'taper': {'s': s, 'r': 1 - s}}
+    leaves.fit_sr_tables()
+    numpy.testing.assert_allclose(leaves.form_factor()['rect'], 1)
+    numpy.testing.assert_allclose(leaves.form_factor()['taper'], 0.5)
+    base, top = numpy.array([0, 0.1, 0.3]), numpy.array([0.1, 0.3, 1])
+    numpy.testing.assert_allclose(leaves.blade_elt_areas(('rect', 0, None), 10., 2., base, top),
+                                  (top - base) * 20)
+    numpy.testing.assert_allclose(leaves.blade_elt_areas(('taper', 0, None), 10., 2., base, top),
+                                  ((top - base) - (top ** 2 - base ** 2) / 2) * 20)
+
+
+def test_mesh_cache():
+    import pickle
+    from alinea.adel.geometric_elements import Leaves
+    leaves = Leaves(fit_cache_dir=None, mesh_cache_size=3)
+    uncached = Leaves(fit_cache_dir=None, mesh_cache_size=0)
+    key = leaves.shapes.keys[0]
+    elements = [(20., 1.5, 15., 0, 0.5, 1), (20., 1.5, 15., 0.5, 1, 1),
+                (20., 1.5, 15., 0, 1, 0.8), (12., 1., 12., 0.2, 0.7, 1)]
+    # cached meshes are the uncached ones
+    for flipx in (False, True):
+        for element in elements * 2:
+            mesh = leaves.mesh(key, *element, flipx=flipx)
+            expected = uncached.mesh(key, *element, flipx=flipx)
+            numpy.testing.assert_allclose(numpy.array(mesh.pointList),
+                                          numpy.array(expected.pointList))
+            numpy.testing.assert_array_equal(numpy.array(mesh.indexList),
+                                             numpy.array(expected.indexList))
+    assert uncached.mesh_cache_info()['currsize'] == 0
+    # least recently used meshes are dropped first
+    info = leaves.mesh_cache_info()
+    assert (info['hits'], info['misses'], info['currsize']) == (0, 16, 3)
+    mesh = leaves.mesh(key, *elements[-1], flipx=True)
+    assert leaves.mesh(key, *elements[-1], flipx=True) is mesh
+    # parameters are rounded to mesh_cache_decimals
+    assert (leaves.mesh(key, 20., 1.5, 15. + 1e-6, 0, 1, 0.8, flipx=True) is
+            leaves.mesh(key, *elements[2], flipx=True))
+    assert leaves.mesh_cache_info()['hits'] == 4
+    leaves.mesh(key, *elements[0], flipx=True)
+    assert leaves.mesh_cache_info()['misses'] == 17
+    # the cache is not pickled
+    assert pickle.loads(pickle.dumps(leaves)).mesh_cache_info()['currsize'] == 0
+
+
+def test_unpickle_previous_versions():
+    import pickle
+    from alinea.adel.geometric_elements import Leaves
+    leaves = Leaves(fit_cache_dir=None)
+    key = leaves.shapes.keys[0]
+    old = pickle.loads(pickle.dumps(leaves))
+    # attributes introduced with the shape store, fit cache, lazy fit and sr tables
+    old.leaves = {k: [tuple(numpy.array(a) for a in leaf) for leaf in v]
+                  for k, v in leaves.leaves.items()}
+    for name in ('shapes', 'lazy_fit', 'processes', 'fit_cache_dir', 'sr_tables',
+                 'mesh_cache_size', 'mesh_cache_decimals', '_mesh_cache',
+                 'mesh_cache_hits', 'mesh_cache_misses'):
+        del old.__dict__[name]
+    old = pickle.loads(pickle.dumps(old))
+    assert (old.lazy_fit, old.processes, old.fit_cache_dir) == (False, None, None)
+    assert old.shapes.keys == leaves.shapes.keys
+    for x, y in zip(old.get_leaf(key), leaves.get_leaf(key)):
+        numpy.testing.assert_array_equal(x, y)
+    numpy.testing.assert_allclose(old.blade_elt_area(key, 10., 1., 0.2, 0.7),
+                                  leaves.blade_elt_area(key, 10., 1., 0.2, 0.7))
+    assert old.mesh_cache_info() == {'hits': 0, 'misses': 0, 'maxsize': 10000, 'currsize': 0}
+    mesh = old.mesh(key, 10., 1., 8., 0.2, 0.7)
+    numpy.testing.assert_allclose(numpy.array(mesh.pointList),
+                                  numpy.array(leaves.mesh(key, 10., 1., 8., 0.2, 0.7).pointList))
+    assert old.mesh(key, 10., 1., 8., 0.2, 0.7) is mesh
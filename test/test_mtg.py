@@ -260,3 +260,48 @@ StemElement(1,3.200001,0.04,0.04)StemElement(1,16.250000,0.04,0.04)[/(180.000000
 
     #Viewer.display(scene)
     #raw_input('enter')
+
+def _can_reference(g):
+    """ can file formatted one triangle at a time """
+    geometry = g.property('geometry')
+    can_label = g.property('can_label')
+    lines = ['# File generated by OpenAlea.Adel program']
+    for root_elt in g.roots_iter(scale=g.max_scale()):
+        for vid in pre_order(g, root_elt):
+            mesh = geometry.get(vid)
+            if not mesh:
+                continue
+            pts = [tuple(pt) for pt in mesh.pointList]
+            for ind in mesh.indexList:
+                lines.append("p 1 %s 3 %s" % (str(can_label[vid]), ' '.join(
+                    '%.6f' % x for i in ind for x in pts[i])))
+    lines.append('')
+    return '\n'.join(lines)
+
+def test_to_canestra():
+    import io
+    g = MTG()
+    plant = g.add_component(g.root, label='plant')
+    stem = g.add_component(plant, label='StemElement')
+    leaf = g.add_child(stem, label='LeafElement', edge_type='+')
+    top = g.add_child(stem, label='StemElement', edge_type='<')
+    g.add_property('geometry')
+    g.add_property('can_label')
+    # empty geometry
+    assert to_canestra(g) == '# File generated by OpenAlea.Adel program\n'
+    assert to_canestra(g) == _can_reference(g)
+    points = [(0, 0, 0), (1, 0, 0), (0, 1.5, 0), (1, 1, 2.123456789)]
+    g.property('geometry').update({
+        stem: TriangleSet(points, [(0, 1, 2), (1, 3, 2)]),
+        leaf: TriangleSet(points, [(0, 1, 3)]),
+        top: TriangleSet(points, [(0, 2, 3), (1, 2, 3), (0, 1, 2)])})
+    g.property('can_label').update({stem: '100001001', leaf: '100001002',
+                                    top: '100001003'})
+    expected = _can_reference(g)
+    assert to_canestra(g) == expected
+    assert len(expected.splitlines()) == 7
+    # written by chunks of a few triangles
+    for chunk_size in (1, 2, 4, 100):
+        f = io.StringIO()
+        write_canestra(g, f, chunk_size=chunk_size)
+        assert f.getvalue() == expected
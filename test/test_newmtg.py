@@ -0,0 +1,209 @@
+import numpy
+import pandas
+from openalea.mtg import MTG
+
+from alinea.adel.newmtg import (mtg_factory, mtg_grow, blade_elements,
+                                exposed_areas, exposed_areas2canS)
+from alinea.adel.geometric_elements import Leaves
+from alinea.adel.kinetics import RunAdel
+
+from test_kinetics import synthetic_plant
+
+
+def _keys(g):
+    """ vertex -> path of (label, rank among components with that label) """
+    keys = {g.root: ()}
+
+    def key(vid):
+        if vid not in keys:
+            cid = g.complex(vid)
+            same = [v for v in g.components(cid) if g.label(v) == g.label(vid)]
+            keys[vid] = key(cid) + ((g.label(vid), same.index(vid)),)
+        return keys[vid]
+
+    for vid in g.vertices():
+        key(vid)
+    return keys
+
+
+def _canonical(g):
+    """ topology and properties of g, indexed by vertex paths """
+    keys = _keys(g)
+    edge_type = g.property('edge_type')
+    topology = {keys[v]: (keys.get(g.parent(v)), edge_type.get(v)) for v in
+                g.vertices() if v != g.root}
+    properties = {name: {keys[v]: repr(value) for v, value in prop.items()}
+                  for name, prop in g.properties().items()
+                  if name != 'geometry'}
+    return topology, properties
+
+
+def test_mtg_grow():
+    plant = synthetic_plant()
+    leaves = {0: Leaves()}
+    stand = [((i, 0, 0), 10 * i) for i in range(2)]
+    for t1, t2 in ((-150, 500), (100, 300), (300, 300)):
+        g = mtg_factory(RunAdel(t1, [plant, plant]), stand=stand,
+                        leaves=leaves)
+        g = mtg_grow(g, RunAdel(t2, [plant, plant]), stand=stand,
+                     leaves=leaves)
+        ref = mtg_factory(RunAdel(t2, [plant, plant]), stand=stand,
+                          leaves=leaves)
+        topology, properties = _canonical(g)
+        ref_topology, ref_properties = _canonical(ref)
+        assert topology == ref_topology
+        assert properties == ref_properties
+        # successors of elements are not duplicated
+        edge_type = g.property('edge_type')
+        for vid in g.vertices():
+            assert [edge_type[c] for c in g.children(vid)].count('<') <= 1
+
+
+def test_mtg_grow_first_organs():
+    plant = synthetic_plant()
+    leaves = {0: Leaves()}
+    g = mtg_factory(RunAdel(100, [plant]), leaves=leaves, metamer_factory=None)
+    g = mtg_grow(g, RunAdel(300, [plant]), leaves=leaves)
+    ref = mtg_factory(RunAdel(300, [plant]), leaves=leaves)
+    assert _canonical(g)[0] == _canonical(ref)[0]
+
+
+def test_mtg_grow_dropped_elements():
+    plant = synthetic_plant()
+    leaves = {0: Leaves()}
+    g = mtg_factory(RunAdel(200, [plant]), leaves=leaves)
+    g = mtg_grow(g, RunAdel(600, [plant]), leaves=leaves)
+    ref = mtg_factory(RunAdel(600, [plant]), leaves=leaves)
+    topology, properties = _canonical(g)
+    ref_topology, ref_properties = _canonical(ref)
+    # elements that are no longer visible are kept, with a zero area
+    for k, v in ref_topology.items():
+        assert topology[k] == v
+    for k in set(topology) - set(ref_topology):
+        assert properties['area'].get(k, '0') in ('0', 'None')
+
+
+def test_blade_elements_areas():
+    leaves = Leaves()
+    key = (list(leaves.srdb)[0], 0)
+    L, W = 20., 2.
+    for sectors in (1, 3, 7):
+        for l, lvis, lrolled, lsen in ((20, 20, 0, 0), (20, 12, 3, 5),
+                                       (15, 9, 9, 2), (20, 20, 4, 20),
+                                       (10, 0, 0, 0)):
+            elements = blade_elements(sectors, l, lvis, lrolled, lsen, L, W,
+                                      key, leaves)
+            hidden, visible = elements[0], elements[1:]
+            numpy.testing.assert_allclose(
+                hidden['area'],
+                leaves.blade_elt_area(key, L, W, (L - l) / L, (L - lvis) / L))
+            # visible elements add up to the visible part of the blade
+            area = leaves.blade_elt_area(key, L, W, (L - lvis) / L, 1)
+            numpy.testing.assert_allclose(sum(e['area'] for e in visible), area)
+            numpy.testing.assert_allclose(
+                sum(e['senesced_area'] for e in visible),
+                leaves.blade_elt_area(key, L, W, (L - min(lsen, lvis)) / L, 1))
+            numpy.testing.assert_allclose(
+                sum(e['length'] for e in visible), lvis, atol=1e-9)
+            for e in visible:
+                numpy.testing.assert_allclose(
+                    e['area'], e['green_area'] + e['senesced_area'])
+            # split green and senescent elements add up to the same area
+            split = blade_elements(sectors, l, lvis, lrolled, lsen, L, W, key,
+                                   leaves, split=True)[1:]
+            assert len(split) == 2 * len(visible)
+            numpy.testing.assert_allclose(sum(e['area'] for e in split), area)
+        # whole blade
+        elements = blade_elements(sectors, L, L, 0, 0, L, W, key, leaves)
+        numpy.testing.assert_allclose(sum(e['area'] for e in elements[1:]),
+                                      leaves.form_factor()[key[0]] * L * W)
+
+
+def _areas(length, area, green_length, green_area):
+    return dict(length=length, area=area, green_length=green_length,
+                green_area=green_area, senesced_length=length - green_length,
+                senesced_area=area - green_area)
+
+
+def _small_canopy():
+    """ a hand-built canopy of two plants """
+    g = MTG()
+    elements = []
+
+    def add(cid, label, **properties):
+        return g.add_component(cid, label=label, **properties)
+
+    def add_elements(metamer, organ, *elts):
+        vid = add(metamer, organ)
+        for label, properties in elts:
+            elements.append(add(vid, label, **properties))
+
+    plant = add(g.root, 'plant1', refplant_id=1)
+    axe = add(plant, 'MS', nff=2, HS_final=2.5)
+    metamer = add(axe, 'metamer1', L_shape=10.)
+    add_elements(metamer, 'internode', ('StemElement', _areas(2, 1, 2, 1)))
+    add_elements(metamer, 'sheath', ('HiddenElement', _areas(1, 1, 1, 1)),
+                 ('StemElement', _areas(0, 0, 0, 0)))
+    add_elements(metamer, 'blade', ('LeafElement1', _areas(3, 2, 2, 1.5)),
+                 ('LeafElement2', _areas(4, 3, 4, 3)))
+    metamer = add(axe, 'metamer2', L_shape=12.)
+    add_elements(metamer, 'blade', ('LeafElement1', _areas(5, 4, 5, 4)))
+    axe = add(plant, 'T1', nff=1, HS_final=1.2)
+    metamer = add(axe, 'metamer1', L_shape=8.)
+    add_elements(metamer, 'sheath', ('StemElement', _areas(1.5, 0.5, 1.5, 0.5)))
+    plant = add(g.root, 'plant2', refplant_id=2, species=1)
+    axe = add(plant, 'MS', nff=1, HS_final=1.)
+    metamer = add(axe, 'metamer1', L_shape=9.)
+    add_elements(metamer, 'blade', ('LeafElement1', _areas(2, 1, 0, 0)))
+    return g, elements
+
+
+def test_exposed_areas():
+    g, elements = _small_canopy()
+    df = exposed_areas(g)
+    # hidden elements and elements of null length are not exposed
+    visible = [vid for i, vid in enumerate(elements) if i not in (1, 2)]
+    assert df.index.tolist() == visible
+    assert df['vid'].tolist() == visible
+    assert df['plant'].tolist() == ['plant1'] * 5 + ['plant2']
+    assert df['axe'].tolist() == ['MS'] * 4 + ['T1', 'MS']
+    assert df['metamer'].tolist() == [1, 1, 1, 2, 1, 1]
+    assert df['organ'].tolist() == ['internode', 'blade', 'blade', 'blade',
+                                    'sheath', 'blade']
+    assert df['element'].tolist() == ['StemElement', 'LeafElement1',
+                                      'LeafElement2', 'LeafElement1',
+                                      'StemElement', 'LeafElement1']
+    assert df['ntop'].tolist() == [2, 2, 2, 1, 1, 1]
+    assert df['nff'].tolist() == [2, 2, 2, 2, 1, 1]
+    assert df['refplant_id'].tolist() == [1] * 5 + [2]
+    assert df['species'].tolist() == [0] * 5 + [1]
+    numpy.testing.assert_allclose(df['HS_final'], [2.5] * 4 + [1.2, 1])
+    numpy.testing.assert_allclose(df['L_shape'], [10, 10, 10, 12, 8, 9])
+    numpy.testing.assert_allclose(df['area'], [1, 2, 3, 4, 0.5, 1])
+    numpy.testing.assert_allclose(df['green_length'], [2, 2, 4, 5, 1.5, 0])
+    numpy.testing.assert_allclose(df['senesced_area'], [0, 0.5, 0, 0, 0, 1])
+    for k in ('length', 'area', 'green_area', 'nff', 'metamer', 'L_shape'):
+        assert df[k].dtype != object
+    assert (df['d_basecol'] == 0).all()
+
+
+def test_exposed_areas2canS():
+    g, elements = _small_canopy()
+    df = exposed_areas2canS(exposed_areas(g))
+    expected = pandas.DataFrame({
+        'species': [0, 0, 0, 1], 'plant': ['plant1', 'plant1', 'plant1', 'plant2'],
+        'refplant_id': [1, 1, 1, 2], 'axe_id': ['MS', 'MS', 'T1', 'MS'],
+        'nff': [2, 2, 1, 1], 'HS_final': [2.5, 2.5, 1.2, 1.],
+        'numphy': [1, 2, 1, 1], 'ntop': [2, 1, 1, 1],
+        'L_shape': [10., 12, 8, 9],
+        'Lv': [7., 5, 0, 2], 'Lvgreen': [6., 5, 0, 0], 'Lvsen': [1., 0, 0, 2],
+        'Slv': [5., 4, 0, 1], 'Slvgreen': [4.5, 4, 0, 0], 'Slvsen': [0.5, 0, 0, 1],
+        'Gv': [0, 0, 1.5, 0], 'Gvgreen': [0, 0, 1.5, 0], 'Gvsen': [0.] * 4,
+        'SGv': [0, 0, 0.5, 0], 'SGvgreen': [0, 0, 0.5, 0], 'SGvsen': [0.] * 4,
+        'Ev': [2., 0, 0, 0], 'Evgreen': [2., 0, 0, 0], 'Evsen': [0.] * 4,
+        'SEv': [1., 0, 0, 0], 'SEvgreen': [1., 0, 0, 0], 'SEvsen': [0.] * 4,
+        'd_basecol': 0},
+        index=[elements[i] for i in (0, 5, 6, 7)])
+    assert df.columns.tolist() == expected.columns.tolist()
+    pandas.testing.assert_frame_equal(df, expected, check_dtype=False)
+    assert len(exposed_areas2canS(exposed_areas(MTG()))) == 0
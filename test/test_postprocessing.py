@@ -76,6 +76,74 @@ def test_plot_statistics():
     desired_plot_statistics_df = desired_plot_statistics_df.select_dtypes(include=[np.number])
     np.testing.assert_allclose(plot_statistics_df.values, desired_plot_statistics_df.values, RELATIVE_TOLERANCE, ABSOLUTE_TOLERANCE)
     
+def test_statistics_accumulator():
+    adel_output_df = pd.read_csv(INPUTS_DIRPATH/ADEL_OUTPUT_FILENAME)
+    adel_output_df['species'] = '0'
+    axis_statistics_df, _ = pp.axis_statistics(adel_output_df, domain_area=1)
+    plot_statistics_df = pp.plot_statistics(axis_statistics_df, plant_number=9, domain_area=1)
+    tmpdir = path(tempfile.mkdtemp())
+    accumulator = pp.StatisticsAccumulator(domain_area=1, plant_number=9,
+                                           axis_path=tmpdir/'axis.csv',
+                                           plot_path=tmpdir/'plot.csv',
+                                           keep=True)
+    for TT, step in adel_output_df.groupby('TT'):
+        accumulator.add(step)
+    assert accumulator.nsteps == adel_output_df['TT'].nunique()
+    axstat = accumulator.axis_statistics()
+    np.testing.assert_allclose(axstat.select_dtypes(include=[np.number]).values,
+                               axis_statistics_df.select_dtypes(include=[np.number]).values)
+    pstat = accumulator.plot_statistics()
+    for column in plot_statistics_df.columns:
+        if column != 'species':
+            np.testing.assert_allclose(pstat[column].values, plot_statistics_df[column].values)
+    written = pd.read_csv(tmpdir/'axis.csv')
+    assert len(written) == len(axstat)
+    np.testing.assert_allclose(written['LAI totale'].values, axstat['LAI totale'].values)
+    assert len(pd.read_csv(tmpdir/'plot.csv')) == len(pstat)
+
+
+def test_statistics_accumulator_not_kept():
+    adel_output_df = pd.read_csv(INPUTS_DIRPATH/ADEL_OUTPUT_FILENAME)
+    adel_output_df['species'] = '0'
+    tmpdir = path(tempfile.mkdtemp())
+    kept = pp.StatisticsAccumulator(domain_area=1, plant_number=9)
+    accumulator = pp.StatisticsAccumulator(domain_area=1, plant_number=9,
+                                           axis_path=tmpdir/'axis.csv',
+                                           plot_path=tmpdir/'plot.csv')
+    assert kept.keep and not accumulator.keep
+    for TT, step in adel_output_df.groupby('TT'):
+        kept.add(step)
+        accumulator.add(step)
+    # nothing is retained in memory when output files are given
+    for table in accumulator._store.values():
+        assert all(len(arrays) == 0 for arrays in table.values())
+    # statistics are read back from the files
+    axstat = accumulator.axis_statistics()
+    assert len(axstat) == len(kept.axis_statistics())
+    np.testing.assert_allclose(axstat['LAI totale'].values,
+                               kept.axis_statistics()['LAI totale'].values)
+    assert len(accumulator.plot_statistics()) == len(kept.plot_statistics())
+
+
+def test_midrib_statistics():
+    # a straight horizontal midrib (vid 5), and a midrib bent at 45 degrees (vid 3)
+    midribs = pd.DataFrame({'vid': [5, 5, 5, 3, 3, 3],
+                            'ntop': 1, 'metamer': [2, 2, 2, 1, 1, 1],
+                            'axe': 'MS', 'plant': 1, 'species': 0,
+                            'x': [0., 1, 2, 0, 1, 2],
+                            'y': [0., 0, 0, 0, 1, 1],
+                            'hins': [3., 3, 3, 1, 1, 1]})
+    stats = pp.midrib_statistics(midribs)
+    assert stats['vid'].tolist() == [3, 5]
+    assert stats['leaf'].tolist() == [1, 2]
+    np.testing.assert_allclose(stats['insertion_angle'], [45, 0])
+    np.testing.assert_allclose(stats['mean_leaf_angle'], [45 - 45 / 2, 0])
+    np.testing.assert_allclose(stats['insertion_height'], [1, 3])
+    np.testing.assert_allclose(stats['maximal_height'], [2, 3])
+    np.testing.assert_allclose(stats['tip_height'], [2, 3])
+    np.testing.assert_allclose(stats['h_projection'], [2 / (1 + np.sqrt(2)), 1])
+
+
 # if __name__ == '__main__':
 #     test_aggregate_adel_output()
 #     test_phenology()